@@ -0,0 +1,9 @@
+-- Document Intelligence result cache (PostgresResultCacheBackend in python.py, result_cache="postgres").
+-- Extracted fields per (model ID, content key); "lastHitAt" drives expiry and LRU eviction.
+CREATE TABLE IF NOT EXISTS document_analysis_cache (
+    cache_key TEXT PRIMARY KEY,
+    extracted_data JSONB NOT NULL,
+    "createdAt" TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    "lastHitAt" TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS document_analysis_cache_last_hit_idx ON document_analysis_cache ("lastHitAt");
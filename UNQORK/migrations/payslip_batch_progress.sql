@@ -0,0 +1,11 @@
+-- Batch progress ledger (BatchProgressLedger in python.py, used with checkpoint=True).
+-- Completed stages per document of a batch, keyed by message_id and clean blob URL.
+CREATE TABLE IF NOT EXISTS payslip_batch_progress (
+    message_id TEXT NOT NULL,
+    file_reference TEXT NOT NULL,
+    etag TEXT,
+    stages TEXT[] NOT NULL DEFAULT '{}',
+    data JSONB NOT NULL DEFAULT '{}'::jsonb,
+    "updatedAt" TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (message_id, file_reference)
+);
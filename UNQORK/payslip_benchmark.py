@@ -0,0 +1,886 @@
+"""
+End-to-end throughput benchmark for the payslip matching flow (python.py).
+
+Runs payslip_matching_flow against local stand-ins instead of Azure:
+- an in-process Blob Storage emulator (with per-operation latency),
+- a fake Document Intelligence client with a configurable latency distribution,
+  429 injection and canned AnalyzeResult payloads,
+- a local Postgres seeded with a synthetic tenant, process and employee roster.
+
+Reports docs/sec, p50/p95/p99 per stage (from the flow's own trace spans) and peak
+memory for each batch size, and appends the results to a JSON-lines file so runs can
+be compared for regressions.
+
+Requirements: prefect, psycopg2 and pypdf (as for the flow) and a Postgres server the
+flow can reach on the default port. The database schema is created if missing.
+
+Usage:
+    python payslip_benchmark.py --db-host localhost --db-name payslip_bench --db-user postgres --db-password postgres
+    python payslip_benchmark.py ... --sizes 10,100,1000,10000 --split --pages-per-pdf 20
+    python payslip_benchmark.py ... --di-latency lognormal:2.0,0.4 --throttle-rate 0.05 --compare
+    python payslip_benchmark.py ... --flow-option pipeline=true --flow-option result_cache='"disk:/var/tmp/payslip-cache"'
+    python payslip_benchmark.py ... --task-overhead   # per-document cost of Prefect task runs (lightweight_tasks)
+"""
+
+import argparse
+import hashlib
+import importlib.util
+import io
+import json
+import os
+import random
+import re
+import resource
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import unquote, urlparse
+
+import psycopg2
+import psycopg2.extras
+
+
+BENCHMARK_ENVIRONMENT = "bench"
+BENCHMARK_ACCOUNT = "benchaccount"
+BENCHMARK_ACCOUNT_KEY = "YmVuY2htYXJrLWtleS1mb3ItbG9jYWwtc3RhbmQtaW5zLW9ubHk="  # base64, signs local SAS tokens only
+BENCHMARK_CONTAINER = "document-repo"
+DEFAULT_RESULTS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_results.jsonl")
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "migrations")
+STAGE_PERCENTILES = (50, 95, 99)
+
+FIRST_NAMES = ["Jean", "Marie", "Pierre", "Sophie", "Luc", "Claire", "Paul", "Julie", "Marc", "Anne",
+               "Louis", "Emma", "Hugo", "Lea", "Jules", "Chloe", "Nathan", "Ines", "Tom", "Sarah"]
+LAST_NAMES = ["Martin", "Bernard", "Dubois", "Thomas", "Robert", "Richard", "Petit", "Durand", "Leroy", "Moreau",
+              "Simon", "Laurent", "Lefebvre", "Michel", "Garcia", "David", "Bertrand", "Roux", "Vincent", "Fournier"]
+
+
+def load_flow_module():
+    """Import python.py (next to this script) as a module."""
+    # Imported by name from a sys.path directory, as the flow's deployment imports it
+    flow_dir = os.path.dirname(os.path.abspath(__file__))
+    if flow_dir not in sys.path:
+        sys.path.insert(0, flow_dir)
+    return importlib.import_module("python")
+
+
+# ---------------------------------------------------------------------------
+# Synthetic documents and roster
+# ---------------------------------------------------------------------------
+
+def employee_name(index: int) -> Tuple[str, str]:
+    """Deterministic, unique (first name, last name) for an employee index."""
+    first = FIRST_NAMES[index % len(FIRST_NAMES)]
+    last = LAST_NAMES[(index // len(FIRST_NAMES)) % len(LAST_NAMES)]
+    suffix = index // (len(FIRST_NAMES) * len(LAST_NAMES))
+    return first, f"{last}{suffix}" if suffix else last
+
+
+def build_pdf(employee_indexes: List[int]) -> bytes:
+    """
+    Build an uncompressed PDF with one page per employee index.
+
+    Each page's content stream carries an "EMP:<index>" marker, which the fake
+    Document Intelligence client reads back (also from pages split out by pypdf).
+    """
+    objects = []
+    page_ids = []
+    font_id = 3
+    objects.append(b"<< /Type /Catalog /Pages 2 0 R >>")
+    objects.append(None)  # Pages, filled in below
+    objects.append(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+    for employee_index in employee_indexes:
+        first, last = employee_name(employee_index)
+        text = f"BT /F1 12 Tf 72 720 Td (PAYSLIP {first} {last} EMP:{employee_index}) Tj ET".encode("latin-1")
+        content_id = len(objects) + 1
+        objects.append(b"<< /Length %d >>\nstream\n" % len(text) + text + b"\nendstream")
+        page_ids.append(len(objects) + 1)
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents %d 0 R "
+            b"/Resources << /Font << /F1 %d 0 R >> >> >>" % (content_id, font_id)
+        )
+    kids = b" ".join(b"%d 0 R" % page_id for page_id in page_ids)
+    objects[1] = b"<< /Type /Pages /Kids [" + kids + b"] /Count %d >>" % len(page_ids)
+
+    output = io.BytesIO()
+    output.write(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(output.tell())
+        output.write(b"%d 0 obj\n" % number + body + b"\nendobj\n")
+    xref_offset = output.tell()
+    output.write(b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1))
+    for offset in offsets:
+        output.write(b"%010d 00000 n \n" % offset)
+    output.write(b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref_offset))
+    return output.getvalue()
+
+
+# ---------------------------------------------------------------------------
+# Blob Storage emulator
+# ---------------------------------------------------------------------------
+
+class EmulatedBlobStorage:
+    """In-memory blob store shared by the emulated clients; every call sleeps latency_seconds."""
+
+    def __init__(self, latency_seconds: float = 0.005):
+        self.latency_seconds = latency_seconds
+        self.blobs: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        self.operations: Dict[str, int] = {}
+        self.lock = threading.Lock()
+
+    def call(self, operation: str) -> None:
+        with self.lock:
+            self.operations[operation] = self.operations.get(operation, 0) + 1
+        if self.latency_seconds:
+            time.sleep(self.latency_seconds)
+
+    def put(self, container: str, name: str, data: bytes, metadata=None, tags=None, content_settings=None) -> Dict[str, Any]:
+        with self.lock:
+            blob = {
+                "data": bytes(data),
+                "metadata": dict(metadata or {}),
+                "tags": dict(tags or {}),
+                "content_settings": content_settings or SimpleNamespace(content_type="application/pdf", content_md5=hashlib.md5(data).digest(),
+                                                                        content_encoding=None, content_language=None,
+                                                                        content_disposition=None, cache_control=None),
+                "etag": f'"{uuid.uuid4().hex}"',
+                "last_modified": datetime.now(timezone.utc)
+            }
+            self.blobs[(container, name)] = blob
+            return {"etag": blob["etag"], "last_modified": blob["last_modified"]}
+
+    def get(self, container: str, name: str) -> Dict[str, Any]:
+        with self.lock:
+            blob = self.blobs.get((container, name))
+        if blob is None:
+            raise KeyError(f"Blob not found: {container}/{name}")
+        return blob
+
+    def touch(self, blob: Dict[str, Any]) -> Dict[str, Any]:
+        blob["etag"] = f'"{uuid.uuid4().hex}"'
+        blob["last_modified"] = datetime.now(timezone.utc)
+        return {"etag": blob["etag"], "last_modified": blob["last_modified"]}
+
+
+def _not_found(message: str):
+    from azure.core.exceptions import ResourceNotFoundError
+    return ResourceNotFoundError(message)
+
+
+class EmulatedDownloader:
+    def __init__(self, data: bytes):
+        self.data = data
+        self.size = len(data)
+
+    def readall(self) -> bytes:
+        return self.data
+
+    def readinto(self, stream) -> int:
+        stream.write(self.data)
+        return self.size
+
+    def chunks(self):
+        for start in range(0, len(self.data), 4 * 1024 * 1024):
+            yield self.data[start:start + 4 * 1024 * 1024]
+
+
+class EmulatedBlobClient:
+    def __init__(self, storage: EmulatedBlobStorage, container_name: str, blob_name: str):
+        self.storage = storage
+        self.container_name = container_name
+        self.blob_name = blob_name
+        self.account_name = BENCHMARK_ACCOUNT
+        self.url = f"https://{BENCHMARK_ACCOUNT}.blob.core.windows.net/{container_name}/{blob_name}"
+
+    def _blob(self):
+        try:
+            return self.storage.get(self.container_name, self.blob_name)
+        except KeyError as e:
+            raise _not_found(str(e))
+
+    def upload_blob(self, data, overwrite=False, metadata=None, tags=None, content_settings=None, **kwargs):
+        self.storage.call("upload_blob")
+        body = data.read() if hasattr(data, "read") else bytes(data)
+        return self.storage.put(self.container_name, self.blob_name, body, metadata, tags, content_settings)
+
+    def upload_blob_from_url(self, source_url, overwrite=False, metadata=None, tags=None, content_settings=None, **kwargs):
+        self.storage.call("upload_blob_from_url")
+        source_container, source_name = _blob_path_from_url(source_url)
+        source = self.storage.get(source_container, source_name)
+        return self.storage.put(self.container_name, self.blob_name, source["data"], metadata, tags, content_settings)
+
+    def start_copy_from_url(self, source_url, metadata=None, tags=None, **kwargs):
+        self.storage.call("start_copy_from_url")
+        source_container, source_name = _blob_path_from_url(source_url)
+        source = self.storage.get(source_container, source_name)
+        self.storage.put(self.container_name, self.blob_name, source["data"], metadata if metadata is not None else source["metadata"],
+                         tags if tags is not None else source["tags"], source["content_settings"])
+        return {"copy_status": "success"}
+
+    def get_blob_properties(self, **kwargs):
+        self.storage.call("get_blob_properties")
+        blob = self._blob()
+        return SimpleNamespace(
+            name=self.blob_name, container=self.container_name, size=len(blob["data"]),
+            metadata=dict(blob["metadata"]), etag=blob["etag"], last_modified=blob["last_modified"],
+            content_settings=blob["content_settings"], tag_count=len(blob["tags"]),
+            copy=SimpleNamespace(status="success")
+        )
+
+    def get_blob_tags(self, **kwargs):
+        self.storage.call("get_blob_tags")
+        return dict(self._blob()["tags"])
+
+    def set_blob_tags(self, tags=None, **kwargs):
+        self.storage.call("set_blob_tags")
+        blob = self._blob()
+        blob["tags"] = dict(tags or {})
+        return {}
+
+    def set_blob_metadata(self, metadata=None, **kwargs):
+        self.storage.call("set_blob_metadata")
+        blob = self._blob()
+        blob["metadata"] = dict(metadata or {})
+        return self.storage.touch(blob)
+
+    def set_http_headers(self, content_settings=None, **kwargs):
+        self.storage.call("set_http_headers")
+        blob = self._blob()
+        blob["content_settings"] = content_settings
+        return self.storage.touch(blob)
+
+    def download_blob(self, offset=None, length=None, **kwargs):
+        self.storage.call("download_blob")
+        data = self._blob()["data"]
+        if offset is not None:
+            data = data[offset:offset + length if length is not None else None]
+        return EmulatedDownloader(data)
+
+    def delete_blob(self, **kwargs):
+        self.storage.call("delete_blob")
+        with self.storage.lock:
+            if self.storage.blobs.pop((self.container_name, self.blob_name), None) is None:
+                raise _not_found(f"Blob not found: {self.container_name}/{self.blob_name}")
+
+
+class EmulatedContainerClient:
+    def __init__(self, storage: EmulatedBlobStorage, container_name: str):
+        self.storage = storage
+        self.container_name = container_name
+
+    def get_blob_client(self, blob):
+        return EmulatedBlobClient(self.storage, self.container_name, blob)
+
+    def list_blobs(self, name_starts_with: str = "", **kwargs):
+        self.storage.call("list_blobs")
+        with self.storage.lock:
+            names = sorted(name for container, name in self.storage.blobs if container == self.container_name and name.startswith(name_starts_with or ""))
+        for name in names:
+            blob = self.storage.blobs.get((self.container_name, name))
+            if blob is not None:
+                yield SimpleNamespace(name=name, size=len(blob["data"]), metadata=dict(blob["metadata"]), tags=dict(blob["tags"]),
+                                      etag=blob["etag"], last_modified=blob["last_modified"], content_settings=blob["content_settings"])
+
+    def walk_blobs(self, name_starts_with: str = "", delimiter: str = "/", **kwargs):
+        from azure.storage.blob import BlobPrefix
+
+        class EmulatedBlobPrefix(BlobPrefix):
+            def __init__(self, name):
+                self.name = self.prefix = name
+
+        prefix = name_starts_with or ""
+        directories = set()
+        for blob in self.list_blobs(prefix):
+            rest = blob.name[len(prefix):]
+            if delimiter in rest:
+                directory = prefix + rest.split(delimiter, 1)[0] + delimiter
+                if directory not in directories:
+                    directories.add(directory)
+                    yield EmulatedBlobPrefix(directory)
+            else:
+                yield blob
+
+    def delete_blob(self, blob, **kwargs):
+        EmulatedBlobClient(self.storage, self.container_name, blob).delete_blob()
+
+    def delete_blobs(self, *blobs, raise_on_any_failure=True, **kwargs):
+        self.storage.call("delete_blobs")
+        responses = []
+        with self.storage.lock:
+            for name in blobs:
+                found = self.storage.blobs.pop((self.container_name, name), None) is not None
+                responses.append(SimpleNamespace(status_code=202 if found else 404))
+        return iter(responses)
+
+    def find_blobs_by_tags(self, filter_expression: str, **kwargs):
+        self.storage.call("find_blobs_by_tags")
+        conditions = dict(re.findall(r'"([^"]+)"\s*=\s*\'((?:[^\']|\'\')*)\'', filter_expression))
+        with self.storage.lock:
+            matches = [name for (container, name), blob in self.storage.blobs.items()
+                       if container == self.container_name and all(blob["tags"].get(k) == v.replace("''", "'") for k, v in conditions.items())]
+        return iter(SimpleNamespace(name=name) for name in matches)
+
+
+class EmulatedBlobServiceClient:
+    def __init__(self, storage: EmulatedBlobStorage):
+        self.storage = storage
+        self.account_name = BENCHMARK_ACCOUNT
+        self.url = f"https://{BENCHMARK_ACCOUNT}.blob.core.windows.net/"
+        self.credential = SimpleNamespace(account_name=BENCHMARK_ACCOUNT, account_key=BENCHMARK_ACCOUNT_KEY)
+
+    def get_container_client(self, container):
+        return EmulatedContainerClient(self.storage, container)
+
+    def get_blob_client(self, container, blob):
+        return EmulatedBlobClient(self.storage, container, blob)
+
+    def get_user_delegation_key(self, key_start_time, key_expiry_time):
+        raise NotImplementedError("The emulator signs with the account key")
+
+    def close(self):
+        pass
+
+
+def _blob_path_from_url(url: str) -> Tuple[str, str]:
+    container, _, name = urlparse(url).path.lstrip("/").partition("/")
+    return container, unquote(name)
+
+
+class EmulatedHttpResponse:
+    def __init__(self, status_code: int, content: bytes = b""):
+        self.status_code = status_code
+        self.content = content
+        self.text = content.decode("utf-8", "replace")
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise RuntimeError(f"HTTP {self.status_code}")
+
+
+class EmulatedHttpSession:
+    """Serves GETs of blob URLs from the emulator and accepts notification POSTs."""
+
+    def __init__(self, storage: EmulatedBlobStorage):
+        self.storage = storage
+        self.notifications = 0
+
+    def get(self, url, **kwargs):
+        self.storage.call("http_get")
+        try:
+            return EmulatedHttpResponse(200, self.storage.get(*_blob_path_from_url(url))["data"])
+        except KeyError:
+            return EmulatedHttpResponse(404)
+
+    def post(self, url, **kwargs):
+        self.notifications += 1
+        return EmulatedHttpResponse(202)
+
+    def close(self):
+        pass
+
+
+# ---------------------------------------------------------------------------
+# Fake Document Intelligence
+# ---------------------------------------------------------------------------
+
+def parse_latency_distribution(spec: str):
+    """
+    Parse "fixed:S", "uniform:LOW,HIGH", "lognormal:MEDIAN,SIGMA" or "normal:MEAN,STDDEV" (seconds)
+    into a sampler function.
+    """
+    kind, _, args = spec.partition(":")
+    values = [float(value) for value in args.split(",") if value]
+    if kind == "fixed":
+        return lambda rng: values[0]
+    if kind == "uniform":
+        return lambda rng: rng.uniform(values[0], values[1])
+    if kind == "lognormal":
+        import math
+        return lambda rng: rng.lognormvariate(math.log(values[0]), values[1])
+    if kind == "normal":
+        return lambda rng: max(0.0, rng.gauss(values[0], values[1]))
+    raise ValueError(f"Unknown latency distribution '{spec}'")
+
+
+class FakeResponse:
+    def __init__(self, status_code: int, headers: Optional[Dict[str, str]] = None):
+        self.http_response = SimpleNamespace(status_code=status_code, headers=headers or {})
+        self.status_code = status_code
+
+
+class FakePoller:
+    def __init__(self, client: "FakeDocumentIntelligenceClient", body: bytes, delay: float):
+        self.client = client
+        self.body = body
+        self.delay = delay
+
+    def result(self):
+        time.sleep(self.delay)
+        return self.client.canned_result(self.body)
+
+
+class FakeDocumentIntelligenceClient:
+    """
+    Stand-in for DocumentIntelligenceClient.
+
+    Analyses take a sampled latency. Throttling is injected at throttle_rate and whenever more
+    than capacity analyses are in flight: the 429 is reported to raw_response_hook and the call
+    waits retry_after before trying again, as the SDK's retry policy would.
+    """
+
+    def __init__(self, storage: EmulatedBlobStorage, latency, throttle_rate: float = 0.0,
+                 retry_after: float = 1.0, capacity: Optional[int] = None, seed: int = 0):
+        self.storage = storage
+        self.latency = latency
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.capacity = capacity
+        self.rng = random.Random(seed)
+        self.in_flight = 0
+        self.stats = {"analyses": 0, "throttled": 0}
+        self.lock = threading.Lock()
+
+    def begin_analyze_document(self, model_id, body=None, raw_response_hook=None, **kwargs):
+        if hasattr(body, "read"):
+            content = body.read()
+        else:
+            url = getattr(body, "url_source", None) or (body or {}).get("url_source")
+            content = self.storage.get(*_blob_path_from_url(url))["data"]
+        while True:
+            with self.lock:
+                throttled = self.rng.random() < self.throttle_rate or (self.capacity is not None and self.in_flight >= self.capacity)
+                if throttled:
+                    self.stats["throttled"] += 1
+                else:
+                    self.in_flight += 1
+                    self.stats["analyses"] += 1
+                    delay = self.latency(self.rng)
+            if not throttled:
+                break
+            if raw_response_hook:
+                raw_response_hook(FakeResponse(429, {"Retry-After": str(self.retry_after)}))
+            time.sleep(self.retry_after)
+        if raw_response_hook:
+            raw_response_hook(FakeResponse(202))
+        poller = FakePoller(self, content, delay)
+        original_result = poller.result
+
+        def result():
+            try:
+                return original_result()
+            finally:
+                with self.lock:
+                    self.in_flight -= 1
+                if raw_response_hook:
+                    raw_response_hook(FakeResponse(200))
+        poller.result = result
+        return poller
+
+    def canned_result(self, content: bytes):
+        """AnalyzeResult-shaped payload: one payslip document per EMP marker, in page order."""
+        documents = []
+        markers = [int(marker) for marker in re.findall(rb"EMP:(\d+)", content)]
+        for page_number, employee_index in enumerate(markers, 1):
+            first, last = employee_name(employee_index)
+            fields = {
+                "employee_name": SimpleNamespace(content=f"{first} {last}", confidence=0.97),
+                "employee_id": SimpleNamespace(content=f"E{employee_index:06d}", confidence=0.95),
+                "employer": SimpleNamespace(content="Benchmark SARL", confidence=0.93),
+                "payment_date": SimpleNamespace(content="31/03/2024", confidence=0.92),
+                "net_payment": SimpleNamespace(content=f"{1500 + employee_index % 1000}.00", confidence=0.91),
+                "pay_cycle": SimpleNamespace(content="Mars 2024", confidence=0.9)
+            }
+            documents.append(SimpleNamespace(fields=fields, bounding_regions=[SimpleNamespace(page_number=page_number)]))
+        return SimpleNamespace(documents=documents, pages=[SimpleNamespace(page_number=n) for n in range(1, len(markers) + 1)])
+
+    def close(self):
+        pass
+
+
+# ---------------------------------------------------------------------------
+# Postgres
+# ---------------------------------------------------------------------------
+
+SCHEMA_DDL = """
+CREATE TABLE IF NOT EXISTS processes (
+    id UUID PRIMARY KEY,
+    tenant_id UUID NOT NULL
+);
+CREATE TABLE IF NOT EXISTS employee_profiles (
+    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    tenant_id UUID NOT NULL,
+    name TEXT,
+    last_name TEXT,
+    other_name TEXT,
+    preferred_name TEXT,
+    employee_identifier TEXT,
+    "createdAt" TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    "updatedAt" TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    "deletedAt" TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS employee_profiles_tenant_idx ON employee_profiles (tenant_id);
+CREATE TABLE IF NOT EXISTS payslip_matching_results (
+    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    tenant_id UUID NOT NULL,
+    process_instance_id UUID NOT NULL,
+    user_id TEXT NOT NULL,
+    file_reference TEXT NOT NULL,
+    extracted_data JSONB,
+    match_status TEXT,
+    audit_log JSONB,
+    message_id TEXT,
+    "createdAt" TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    "updatedAt" TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE (tenant_id, process_instance_id, user_id, file_reference, message_id)
+);
+"""
+
+
+def seed_database(connect_args: Dict[str, str], roster_size: int) -> Tuple[str, str]:
+    """Create the schema (and apply migrations/) if needed and a fresh tenant, process and roster. Returns (tenant_id, process_id)."""
+    tenant_id, process_id = str(uuid.uuid4()), str(uuid.uuid4())
+    conn = psycopg2.connect(**connect_args)
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(SCHEMA_DDL)
+            # Tables the flow's optional features expect (checkpoint ledger, ...)
+            for migration in sorted(os.listdir(MIGRATIONS_DIR)):
+                if migration.endswith(".sql"):
+                    with open(os.path.join(MIGRATIONS_DIR, migration)) as migration_file:
+                        cursor.execute(migration_file.read())
+            cursor.execute("INSERT INTO processes (id, tenant_id) VALUES (%s, %s)", (process_id, tenant_id))
+            rows = []
+            for index in range(roster_size):
+                first, last = employee_name(index)
+                rows.append((tenant_id, first, last, None, None, f"E{index:06d}"))
+            psycopg2.extras.execute_values(
+                cursor,
+                "INSERT INTO employee_profiles (tenant_id, name, last_name, other_name, preferred_name, employee_identifier) VALUES %s",
+                rows, page_size=1000
+            )
+        conn.commit()
+    finally:
+        conn.close()
+    return tenant_id, process_id
+
+
+# ---------------------------------------------------------------------------
+# Measurement
+# ---------------------------------------------------------------------------
+
+class SpanRecorder:
+    """Span exporter collecting stage durations from the flow's trace_stage spans."""
+
+    def __init__(self):
+        self.durations: Dict[str, List[float]] = {}
+        self.lock = threading.Lock()
+
+    def export(self, span: Dict[str, Any]) -> None:
+        duration = (int(span["endTimeUnixNano"]) - int(span["startTimeUnixNano"])) / 1e9
+        with self.lock:
+            self.durations.setdefault(span["name"], []).append(duration)
+
+    def flush(self) -> None:
+        pass
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        summary = {}
+        with self.lock:
+            for stage, values in self.durations.items():
+                ordered = sorted(values)
+                entry = {"count": len(ordered), "total": round(sum(ordered), 4)}
+                for percentile in STAGE_PERCENTILES:
+                    rank = min(len(ordered) - 1, max(0, int(round(percentile / 100 * len(ordered) + 0.5)) - 1))
+                    entry[f"p{percentile}"] = round(ordered[rank], 4)
+                summary[stage] = entry
+        return summary
+
+
+class PeakMemorySampler:
+    """Samples resident memory (Linux /proc, else ru_maxrss) while a run is in progress."""
+
+    def __init__(self, interval: float = 0.05):
+        self.interval = interval
+        self.peak_bytes = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    @staticmethod
+    def current_rss() -> int:
+        try:
+            with open("/proc/self/statm") as statm:
+                return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        except (OSError, ValueError):
+            rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            return rss if sys.platform == "darwin" else rss * 1024
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak_bytes = max(self.peak_bytes, self.current_rss())
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self.baseline_bytes = self.current_rss()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak_bytes = max(self.peak_bytes, self.current_rss())
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return None
+
+
+# ---------------------------------------------------------------------------
+# Runs
+# ---------------------------------------------------------------------------
+
+def install_stand_ins(flow_module, args, storage: EmulatedBlobStorage) -> FakeDocumentIntelligenceClient:
+    """Point the flow's client factories and secrets at the local stand-ins."""
+    di_client = FakeDocumentIntelligenceClient(
+        storage, parse_latency_distribution(args.di_latency), args.throttle_rate, args.retry_after, args.di_capacity, args.seed
+    )
+    http_session = EmulatedHttpSession(storage)
+    flow_module.reset_shared_clients()
+    flow_module.create_blob_storage_client = lambda environment="staging": EmulatedBlobServiceClient(storage)
+    flow_module.create_document_intelligence_client = lambda environment="staging": di_client
+    flow_module.create_http_session = lambda *a, **k: http_session
+    flow_module._DOCUMENT_INTELLIGENCE_MODEL_IDS.clear()
+    flow_module.invalidate_employee_roster_index()
+    flow_module._SECRET_CACHE.update({
+        f"db-host-{BENCHMARK_ENVIRONMENT}": args.db_host,
+        f"db-name-{BENCHMARK_ENVIRONMENT}": args.db_name,
+        f"db-user-{BENCHMARK_ENVIRONMENT}": args.db_user,
+        f"db-password-{BENCHMARK_ENVIRONMENT}": args.db_password,
+        f"azure-storage-connection-string-{BENCHMARK_ENVIRONMENT}":
+            f"DefaultEndpointsProtocol=https;AccountName={BENCHMARK_ACCOUNT};AccountKey={BENCHMARK_ACCOUNT_KEY};EndpointSuffix=core.windows.net",
+        f"document-intelligence-model-id-{BENCHMARK_ENVIRONMENT}": "payslip-benchmark-model",
+        f"notification-api-url-{BENCHMARK_ENVIRONMENT}": "https://notifications.invalid/benchmark",
+        f"notification-api-subscription-key-{BENCHMARK_ENVIRONMENT}": "benchmark"
+    })
+    return di_client
+
+
+def upload_documents(storage: EmulatedBlobStorage, pages: int, pages_per_pdf: int, run_id: str) -> List[str]:
+    """Upload PDFs totalling `pages` pages; returns their (unsigned) URLs."""
+    urls = []
+    employee_index = 0
+    file_index = 0
+    while employee_index < pages:
+        count = min(pages_per_pdf, pages - employee_index)
+        name = f"bench/{run_id}/upload_{file_index:05d}.pdf"
+        storage.put(BENCHMARK_CONTAINER, name, build_pdf(list(range(employee_index, employee_index + count))),
+                    metadata={"file_name": f"upload_{file_index:05d}.pdf"})
+        urls.append(f"https://{BENCHMARK_ACCOUNT}.blob.core.windows.net/{BENCHMARK_CONTAINER}/{name}")
+        employee_index += count
+        file_index += 1
+    return urls
+
+
+def run_once(flow_module, args, pages: int, flow_options: Dict[str, Any]) -> Dict[str, Any]:
+    """Run the flow once for a batch of `pages` pages and return its measurements."""
+    storage = EmulatedBlobStorage(args.blob_latency_ms / 1000.0)
+    di_client = install_stand_ins(flow_module, args, storage)
+    connect_args = {"host": args.db_host, "dbname": args.db_name, "user": args.db_user, "password": args.db_password}
+    tenant_id, process_id = seed_database(connect_args, max(pages, args.roster_size))
+
+    run_id = uuid.uuid4().hex[:8]
+    pages_per_pdf = args.pages_per_pdf if args.split else 1
+    document_urls = upload_documents(storage, pages, pages_per_pdf, run_id)
+
+    recorder = SpanRecorder()
+    flow_module._SPAN_EXPORTER = recorder
+    flow_module.METRICS.reset()
+    storage.operations.clear()
+
+    with PeakMemorySampler() as memory:
+        start = time.perf_counter()
+        flow_module.payslip_matching_flow(
+            blob_location=None,
+            user_id="benchmark-user",
+            process_instance_id=process_id,
+            tenant_id=tenant_id,
+            document_urls=document_urls,
+            split=args.split,
+            environment=BENCHMARK_ENVIRONMENT,
+            message_id=str(uuid.uuid4()),
+            **flow_options
+        )
+        elapsed = time.perf_counter() - start
+    flow_module._SPAN_EXPORTER = None
+
+    stages = recorder.summary()
+    return {
+        "pages": pages,
+        "files": len(document_urls),
+        "seconds": round(elapsed, 3),
+        "docs_per_second": round(pages / elapsed, 3) if elapsed else None,
+        "peak_rss_mb": round(memory.peak_bytes / 1024 / 1024, 1),
+        "rss_growth_mb": round((memory.peak_bytes - memory.baseline_bytes) / 1024 / 1024, 1),
+        "analyses": di_client.stats["analyses"],
+        "throttled": di_client.stats["throttled"],
+        "storage_operations": dict(sorted(storage.operations.items())),
+        "stages": stages
+    }
+
+
+def measure_task_call_overhead(flow_module, calls: int) -> Dict[str, float]:
+    """Per-call cost of a per-document helper as a Prefect task and as a plain call, inside a flow run."""
+    from prefect import flow
+
+    result = FakeDocumentIntelligenceClient(EmulatedBlobStorage(0), lambda rng: 0.0).canned_result(build_pdf([0]))
+    timings = {}
+
+    @flow(name="payslip-task-overhead")
+    def task_overhead_flow():
+        for lightweight in (False, True):
+            flow_module.set_lightweight_tasks(lightweight)
+            start = time.perf_counter()
+            for _ in range(calls):
+                flow_module.extract_payslip_fields(result, verbose=False)
+            timings["lightweight_ms" if lightweight else "tasks_ms"] = (time.perf_counter() - start) / calls * 1000
+
+    task_overhead_flow()
+    timings["overhead_ms"] = timings["tasks_ms"] - timings["lightweight_ms"]
+    return timings
+
+
+def print_result(result: Dict[str, Any], previous: Optional[Dict[str, Any]]) -> None:
+    line = (f"{result['pages']:>6} pages ({result['files']} file(s)): {result['seconds']:>8.2f}s, "
+            f"{result['docs_per_second']:>8.2f} docs/s, peak RSS {result['peak_rss_mb']} MB "
+            f"(+{result['rss_growth_mb']} MB), {result['throttled']} throttled")
+    if previous and previous.get("docs_per_second"):
+        change = (result["docs_per_second"] - previous["docs_per_second"]) / previous["docs_per_second"] * 100
+        line += f"  [{change:+.1f}% docs/s vs {previous.get('revision') or 'previous run'}]"
+    print(line)
+    header = f"{'stage':<18}{'count':>8}" + "".join(f"{'p' + str(p):>10}" for p in STAGE_PERCENTILES) + f"{'total':>10}"
+    print("    " + header)
+    for stage, entry in sorted(result["stages"].items(), key=lambda item: -item[1]["total"]):
+        previous_entry = ((previous or {}).get("stages") or {}).get(stage)
+        marker = ""
+        if previous_entry and previous_entry.get("p95"):
+            marker = f"  ({(entry['p95'] - previous_entry['p95']) / previous_entry['p95'] * 100:+.0f}% p95)"
+        print("    " + f"{stage:<18}{entry['count']:>8}" + "".join(f"{entry[f'p{p}']:>10.3f}" for p in STAGE_PERCENTILES)
+              + f"{entry['total']:>10.1f}" + marker)
+
+
+def load_previous_results(path: str, key: Dict[str, Any]) -> Dict[int, Dict[str, Any]]:
+    """Latest stored result per batch size for the same configuration."""
+    previous = {}
+    if not os.path.exists(path):
+        return previous
+    with open(path, encoding="utf-8") as results_file:
+        for line in results_file:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if record.get("configuration") == key:
+                previous[record["result"]["pages"]] = dict(record["result"], revision=record.get("revision"))
+    return previous
+
+
+def parse_flow_options(options: List[str]) -> Dict[str, Any]:
+    """key=value flow parameters; values are parsed as JSON when possible (true, 8, "postgres", {...})."""
+    parsed = {}
+    for option in options or []:
+        key, _, value = option.partition("=")
+        try:
+            parsed[key] = json.loads(value)
+        except ValueError:
+            parsed[key] = value
+    return parsed
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark payslip_matching_flow against local stand-ins for Azure and Postgres")
+    parser.add_argument("--sizes", default="10,100,1000", help="Comma-separated batch sizes in pages (e.g. 10,100,1000,10000)")
+    parser.add_argument("--split", action="store_true", help="Upload multi-page PDFs and run the flow in split mode")
+    parser.add_argument("--pages-per-pdf", type=int, default=10, help="Pages per uploaded PDF in split mode")
+    parser.add_argument("--di-latency", default="lognormal:1.5,0.35", help="Analysis latency: fixed:S, uniform:A,B, lognormal:MEDIAN,SIGMA or normal:MEAN,SD")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="Probability of a 429 per analysis attempt")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="Retry-After seconds sent with injected 429s")
+    parser.add_argument("--di-capacity", type=int, default=None, help="Concurrent analyses accepted before returning 429")
+    parser.add_argument("--blob-latency-ms", type=float, default=5.0, help="Latency of every emulated storage call")
+    parser.add_argument("--roster-size", type=int, default=500, help="Minimum employees seeded per run")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed for latency and throttling")
+    parser.add_argument("--flow-option", action="append", default=[], metavar="KEY=VALUE", help="Extra payslip_matching_flow parameter (JSON value)")
+    parser.add_argument("--db-host", default="localhost")
+    parser.add_argument("--db-name", default="payslip_bench")
+    parser.add_argument("--db-user", default="postgres")
+    parser.add_argument("--db-password", default="postgres")
+    parser.add_argument("--results", default=DEFAULT_RESULTS_FILE, help="JSON-lines file the results are appended to")
+    parser.add_argument("--label", default=None, help="Free-form label stored with the results")
+    parser.add_argument("--compare", action="store_true", help="Show changes against the last stored run with the same configuration")
+    parser.add_argument("--no-store", action="store_true", help="Don't append the results to --results")
+    parser.add_argument("--task-overhead", action="store_true",
+                        help="Run each batch with lightweight_tasks off and on and report the orchestration overhead per document")
+    parser.add_argument("--task-overhead-calls", type=int, default=200, help="Calls timed for the per-call task overhead")
+    args = parser.parse_args(argv)
+
+    flow_options = parse_flow_options(args.flow_option)
+    if flow_options.get("execution_mode") == "asyncio":
+        parser.error("execution_mode=asyncio uses the aio Azure clients, which have no local stand-in")
+    if isinstance(flow_options.get("fanout_processes"), int) and flow_options["fanout_processes"] > 1:
+        parser.error("fanout_processes > 1 runs the batch in spawned worker processes, which don't get the local stand-ins")
+
+    # --task-overhead runs every batch size with per-document helpers as Prefect tasks and as plain calls
+    variants = [(None, flow_options)]
+    if args.task_overhead:
+        variants = [("tasks", dict(flow_options, lightweight_tasks=False)), ("lightweight", dict(flow_options, lightweight_tasks=True))]
+    configurations = {
+        name: {
+            "split": args.split, "pages_per_pdf": args.pages_per_pdf if args.split else 1, "di_latency": args.di_latency,
+            "throttle_rate": args.throttle_rate, "retry_after": args.retry_after, "di_capacity": args.di_capacity,
+            "blob_latency_ms": args.blob_latency_ms, "flow_options": options
+        }
+        for name, options in variants
+    }
+    previous = {name: load_previous_results(args.results, configuration) if args.compare else {}
+                for name, configuration in configurations.items()}
+
+    flow_module = load_flow_module()
+    revision = git_revision()
+    if args.task_overhead:
+        per_call = measure_task_call_overhead(flow_module, args.task_overhead_calls)
+        print(f"extract_payslip_fields per call: {per_call['tasks_ms']:.3f} ms as a task, "
+              f"{per_call['lightweight_ms']:.3f} ms as a plain call ({per_call['overhead_ms']:.3f} ms orchestration overhead)")
+    for name, options in variants:
+        print(f"Benchmarking revision {revision or 'unknown'} with {json.dumps(configurations[name])}")
+    for pages in [int(size) for size in args.sizes.split(",") if size]:
+        results = {}
+        for name, options in variants:
+            results[name] = result = run_once(flow_module, args, pages, options)
+            if name:
+                print(f"[{name}]")
+            print_result(result, previous[name].get(pages))
+            if not args.no_store:
+                with open(args.results, "a", encoding="utf-8") as results_file:
+                    results_file.write(json.dumps({
+                        "timestamp": datetime.now(timezone.utc).isoformat(),
+                        "revision": revision,
+                        "label": args.label,
+                        "configuration": configurations[name],
+                        "result": result
+                    }) + "\n")
+        if args.task_overhead:
+            overhead = (results["tasks"]["seconds"] - results["lightweight"]["seconds"]) / pages
+            print(f"{pages:>6} pages: orchestration overhead {overhead * 1000:.1f} ms per document "
+                  f"({results['tasks']['docs_per_second']:.2f} -> {results['lightweight']['docs_per_second']:.2f} docs/s)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
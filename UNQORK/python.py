@@ -3,24 +3,45 @@
 # from Azure Blob Storage without downloading files locally. It uses SAS tokens for secure
 # access and is designed to be migrated to Azure Managed Identity authentication in the future.
 
+import asyncio
+import atexit
+import contextvars
+import functools
+import hashlib
+import heapq
+import importlib.machinery
+import importlib.util
 import logging
 import os
 import io
 import json
+import multiprocessing
+import queue
 import re
+import sys
+import tempfile
+import threading
 import time
+import unicodedata
 import uuid
+from collections import OrderedDict, deque
 from typing import Dict, Any, List, Optional, Tuple
-from datetime import datetime, timedelta
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta, timezone
+from email.utils import parsedate_to_datetime
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 import requests
+import requests.adapters
 import psycopg2
+import psycopg2.extras
 from prefect import flow, task, get_run_logger
 from prefect.blocks.system import Secret
 from urllib.parse import urlparse, parse_qs, unquote, quote
-from azure.storage.blob import BlobServiceClient, ContainerClient, generate_blob_sas, BlobSasPermissions, ContentSettings
+from azure.storage.blob import BlobPrefix, BlobServiceClient, ContainerClient, generate_blob_sas, generate_container_sas, BlobSasPermissions, ContainerSasPermissions, ContentSettings
 from azure.identity import DefaultAzureCredential
+from azure.core import MatchConditions
 from azure.core.credentials import AzureKeyCredential
+from azure.core.exceptions import HttpResponseError
+from azure.core.pipeline.transport import RequestsTransport
 from azure.ai.documentintelligence import DocumentIntelligenceClient
 from azure.ai.documentintelligence.models import AnalyzeDocumentRequest, AnalyzeResult
 from prefect import flow, task
@@ -45,6 +66,431 @@ try:
 except ImportError:
     DATEUTIL_AVAILABLE = False
 
+# Fast string similarity for fuzzy employee name matching
+try:
+    from rapidfuzz import process as rapidfuzz_process
+    from rapidfuzz.distance import JaroWinkler
+    RAPIDFUZZ_AVAILABLE = True
+except ImportError:
+    RAPIDFUZZ_AVAILABLE = False
+
+# Async Azure clients for the asyncio execution mode (the aio transport needs aiohttp)
+try:
+    # The aio clients import without aiohttp but fail on their first request, so check for it up front
+    if importlib.util.find_spec("aiohttp") is None:
+        raise ImportError("aiohttp is required by the async Azure transport")
+    from azure.ai.documentintelligence.aio import DocumentIntelligenceClient as AsyncDocumentIntelligenceClient
+    from azure.storage.blob.aio import BlobServiceClient as AsyncBlobServiceClient
+    ASYNC_AZURE_AVAILABLE = True
+except ImportError:
+    ASYNC_AZURE_AVAILABLE = False
+
+
+# Instrumentation
+# Spans per document and stage (nested through a context variable) feed latency histograms
+# and counters. Metrics are exposed in Prometheus text format (start_metrics_server) and
+# spans can be appended to a file as OTLP/JSON lines (configure_instrumentation(trace_file=...)).
+METRICS_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+TRACE_EXPORT_BATCH_SIZE = 512
+TRACE_SERVICE_NAME = "payslip-matching"
+
+_CURRENT_SPAN = contextvars.ContextVar("payslip_current_span", default=None)
+
+
+class MetricsRegistry:
+    """Thread-safe counters and latency histograms keyed by metric name and label set."""
+
+    def __init__(self, buckets: Tuple[float, ...] = METRICS_LATENCY_BUCKETS):
+        self.buckets = buckets
+        self._counters: Dict[str, Dict[Tuple, float]] = {}
+        self._histograms: Dict[str, Dict[Tuple, Dict[str, Any]]] = {}
+        self._help: Dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name: str, amount: float = 1, help_text: str = "", **labels) -> None:
+        """Add amount to a counter."""
+        key = tuple(sorted((k, str(v)) for k, v in labels.items()))
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + amount
+            if help_text:
+                self._help.setdefault(name, help_text)
+
+    def observe(self, name: str, value: float, help_text: str = "", **labels) -> None:
+        """Record a latency (seconds) in a histogram."""
+        key = tuple(sorted((k, str(v)) for k, v in labels.items()))
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = series[key] = {"buckets": [0] * len(self.buckets), "count": 0, "sum": 0.0, "max": 0.0}
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    histogram["buckets"][index] += 1
+                    break
+            histogram["count"] += 1
+            histogram["sum"] += value
+            histogram["max"] = max(histogram["max"], value)
+            if help_text:
+                self._help.setdefault(name, help_text)
+
+    def histogram_summary(self, name: str, label: str) -> Dict[str, Dict[str, float]]:
+        """count/total/mean/max of a histogram per value of one label (e.g. per stage)."""
+        summary = {}
+        with self._lock:
+            for key, histogram in self._histograms.get(name, {}).items():
+                entry = summary.setdefault(dict(key).get(label, ""), {"count": 0, "total": 0.0, "max": 0.0})
+                entry["count"] += histogram["count"]
+                entry["total"] += histogram["sum"]
+                entry["max"] = max(entry["max"], histogram["max"])
+        for entry in summary.values():
+            entry["mean"] = entry["total"] / entry["count"] if entry["count"] else 0.0
+        return summary
+
+    def render_prometheus(self) -> str:
+        """Render every metric in the Prometheus text exposition format."""
+        def label_text(key: Tuple, extra: Tuple = ()) -> str:
+            pairs = list(key) + list(extra)
+            if not pairs:
+                return ""
+            escaped = (f'{k}="{str(v).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"' for k, v in pairs)
+            return "{" + ",".join(escaped) + "}"
+        
+        lines = []
+        with self._lock:
+            for name, series in sorted(self._counters.items()):
+                lines.append(f"# HELP {name} {self._help.get(name, name)}")
+                lines.append(f"# TYPE {name} counter")
+                lines.extend(f"{name}{label_text(key)} {value}" for key, value in sorted(series.items()))
+            for name, series in sorted(self._histograms.items()):
+                lines.append(f"# HELP {name} {self._help.get(name, name)}")
+                lines.append(f"# TYPE {name} histogram")
+                for key, histogram in sorted(series.items()):
+                    cumulative = 0
+                    for bound, count in zip(self.buckets, histogram["buckets"]):
+                        cumulative += count
+                        lines.append(f"{name}_bucket{label_text(key, (('le', repr(bound)),))} {cumulative}")
+                    lines.append(f"{name}_bucket{label_text(key, (('le', '+Inf'),))} {histogram['count']}")
+                    lines.append(f"{name}_sum{label_text(key)} {histogram['sum']}")
+                    lines.append(f"{name}_count{label_text(key)} {histogram['count']}")
+        return "\n".join(lines) + "\n"
+
+    def reset(self) -> None:
+        """Drop every recorded value."""
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+
+METRICS = MetricsRegistry()
+
+
+class OtlpFileSpanExporter:
+    """
+    Appends finished spans to a file as OTLP/JSON lines (one ExportTraceServiceRequest per line),
+    readable by the OpenTelemetry Collector's otlpjsonfile receiver.
+    """
+
+    def __init__(self, path: str, batch_size: int = TRACE_EXPORT_BATCH_SIZE):
+        self.path = path
+        self.batch_size = batch_size
+        self._spans: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+
+    def export(self, span: Dict[str, Any]) -> None:
+        """Queue a finished span; a full batch is written out."""
+        with self._lock:
+            self._spans.append(span)
+            full = len(self._spans) >= self.batch_size
+        if full:
+            self.flush()
+
+    def flush(self) -> None:
+        """Write every queued span."""
+        with self._lock:
+            spans, self._spans = self._spans, []
+        if not spans:
+            return
+        line = json.dumps({"resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": TRACE_SERVICE_NAME}}]},
+            "scopeSpans": [{"scope": {"name": TRACE_SERVICE_NAME}, "spans": spans}]
+        }]})
+        with self._write_lock, open(self.path, "a", encoding="utf-8") as trace_file:
+            trace_file.write(line + "\n")
+
+
+_SPAN_EXPORTER: Optional[OtlpFileSpanExporter] = None
+_METRICS_SERVERS: Dict[int, Any] = {}
+_INSTRUMENTATION_LOCK = threading.Lock()
+
+
+def _otlp_attribute(key: str, value) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"key": key, "value": {"boolValue": value}}
+    if isinstance(value, int):
+        return {"key": key, "value": {"intValue": str(value)}}
+    if isinstance(value, float):
+        return {"key": key, "value": {"doubleValue": value}}
+    return {"key": key, "value": {"stringValue": str(value)}}
+
+
+class trace_stage:
+    """
+    Time a stage as a span: `with trace_stage("save", document=name):`.
+    
+    The span nests under the current span of this thread/task (a new trace otherwise), its
+    duration is recorded in payslip_stage_duration_seconds{stage=...} and failures in
+    payslip_stage_errors_total. Also usable as a decorator: `@trace_stage("match")`.
+    """
+
+    def __init__(self, stage: str, **attributes):
+        self.stage = stage
+        self.attributes = attributes
+
+    def set_attribute(self, key: str, value) -> None:
+        self.attributes[key] = value
+
+    def __enter__(self) -> "trace_stage":
+        parent = _CURRENT_SPAN.get()
+        self.trace_id = parent.trace_id if parent else uuid.uuid4().hex
+        self.parent_span_id = parent.span_id if parent else None
+        self.span_id = uuid.uuid4().hex[:16]
+        self._token = _CURRENT_SPAN.set(self)
+        self.start_ns = time.time_ns()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        duration = time.perf_counter() - self._start
+        _CURRENT_SPAN.reset(self._token)
+        METRICS.observe("payslip_stage_duration_seconds", duration, "Latency of each processing stage", stage=self.stage)
+        if exc is not None:
+            METRICS.inc("payslip_stage_errors_total", 1, "Failed stage executions", stage=self.stage, error=type(exc).__name__)
+        exporter = _SPAN_EXPORTER
+        if exporter is not None:
+            span = {
+                "traceId": self.trace_id,
+                "spanId": self.span_id,
+                "name": self.stage,
+                "kind": 1,
+                "startTimeUnixNano": str(self.start_ns),
+                "endTimeUnixNano": str(self.start_ns + int(duration * 1e9)),
+                "attributes": [_otlp_attribute(k, v) for k, v in self.attributes.items() if v is not None],
+                "status": {"code": 2, "message": str(exc)} if exc is not None else {"code": 1}
+            }
+            if self.parent_span_id:
+                span["parentSpanId"] = self.parent_span_id
+            exporter.export(span)
+        return False
+
+    def __call__(self, function):
+        stage, attributes = self.stage, self.attributes
+        
+        @functools.wraps(function)
+        def traced(*args, **kwargs):
+            with trace_stage(stage, **attributes):
+                return function(*args, **kwargs)
+        return traced
+
+
+def count_http_response(service: str, response) -> None:
+    """Count an HTTP response by service and status (throttling separately); usable as a raw_response_hook."""
+    status = getattr(getattr(response, 'http_response', response), 'status_code', None)
+    METRICS.inc("payslip_http_responses_total", 1, "HTTP responses from Azure services", service=service, status=status)
+    if status in THROTTLING_STATUS_CODES:
+        METRICS.inc("payslip_throttled_responses_total", 1, "Throttled (429/503) responses; each one is retried", service=service)
+
+
+def start_metrics_server(port: int, host: str = "0.0.0.0") -> bool:
+    """
+    Serve METRICS at http://host:port/metrics from a daemon thread (once per port per process).
+    
+    Returns:
+        True if the endpoint is serving
+    """
+    import http.server
+    
+    class MetricsHandler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] not in ('/metrics', '/'):
+                self.send_error(404)
+                return
+            body = METRICS.render_prometheus().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        
+        def log_message(self, format, *args):
+            pass
+    
+    with _INSTRUMENTATION_LOCK:
+        if port in _METRICS_SERVERS:
+            return True
+        try:
+            server = http.server.ThreadingHTTPServer((host, port), MetricsHandler)
+        except OSError as e:
+            logging.getLogger(__name__).warning(f"Could not start metrics endpoint on port {port}: {str(e)}")
+            return False
+        threading.Thread(target=server.serve_forever, name=f"metrics-{port}", daemon=True).start()
+        _METRICS_SERVERS[port] = server
+        return True
+
+
+def configure_instrumentation(metrics_port: Optional[int] = None, trace_file: Optional[str] = None) -> None:
+    """Start the Prometheus endpoint and/or OTLP file span export (both optional; metrics are always recorded)."""
+    global _SPAN_EXPORTER
+    if metrics_port:
+        start_metrics_server(metrics_port)
+    if trace_file:
+        with _INSTRUMENTATION_LOCK:
+            if _SPAN_EXPORTER is None or _SPAN_EXPORTER.path != trace_file:
+                if _SPAN_EXPORTER is not None:
+                    _SPAN_EXPORTER.flush()
+                _SPAN_EXPORTER = OtlpFileSpanExporter(trace_file)
+
+
+def flush_instrumentation() -> None:
+    """Write out spans still queued for the trace file."""
+    if _SPAN_EXPORTER is not None:
+        _SPAN_EXPORTER.flush()
+
+
+atexit.register(flush_instrumentation)
+
+
+# Structured document logging
+# The per-document hot path (analysis, extraction, matching, save) logs dozens of lines per
+# document in the default "verbose" mode. In "structured" mode it skips them and instead emits
+# one JSON summary event per document plus a sample of detail events. Events are only rendered
+# when a handler formats them, and a per-batch budget caps how many reach Prefect's log API
+# (warning-level summaries, i.e. unmatched documents, and errors are always logged).
+LOG_MODES = ("verbose", "structured")
+LOG_DETAIL_SAMPLE_RATE = 0.01  # Fraction of detail events kept in structured mode
+LOG_EVENT_BUDGET = 5000  # Events per batch before info-level events are dropped
+
+
+class _LazyEvent:
+    """Log message argument rendered as compact JSON only when a handler formats the record."""
+
+    __slots__ = ("name", "fields")
+
+    def __init__(self, name: str, fields: Dict[str, Any]):
+        self.name = name
+        self.fields = fields
+
+    def __str__(self) -> str:
+        return json.dumps({"event": self.name, **self.fields}, default=str, separators=(",", ":"))
+
+
+class DocumentEventLog:
+    """
+    Logging policy of a batch's per-document hot path.
+
+    In "verbose" mode callers keep their detailed log lines (verbose is True) and event()/summary()
+    do nothing. In "structured" mode summary() emits one event per document and event() keeps
+    every 1/sample_rate-th detail event, both counted against the batch's budget.
+    """
+
+    def __init__(self, mode: str = "verbose", sample_rate: float = LOG_DETAIL_SAMPLE_RATE, budget: Optional[int] = LOG_EVENT_BUDGET):
+        if mode not in LOG_MODES:
+            raise ValueError(f"log_mode must be one of {LOG_MODES}, got '{mode}'")
+        self.mode = mode
+        self.verbose = mode == "verbose"
+        self.sample_rate = sample_rate
+        self.budget = budget
+        self.stats = {"emitted": 0, "sampled_out": 0, "over_budget": 0}
+        self._detail_events = 0
+        self._lock = threading.Lock()
+
+    def _admit(self, sampled: bool, always: bool = False) -> bool:
+        with self._lock:
+            if sampled:
+                self._detail_events += 1
+                # Deterministic sampling: keep the event whenever the running quota crosses an integer
+                if int(self._detail_events * self.sample_rate) == int((self._detail_events - 1) * self.sample_rate):
+                    self.stats["sampled_out"] += 1
+                    return False
+            if not always and self.budget is not None and self.stats["emitted"] >= self.budget:
+                self.stats["over_budget"] += 1
+                return False
+            self.stats["emitted"] += 1
+            return True
+
+    def event(self, logger, name: str, level: int = logging.INFO, **fields) -> None:
+        """Emit a sampled detail event (structured mode only)."""
+        if self.verbose or not logger.isEnabledFor(level) or not self._admit(sampled=True):
+            return
+        logger.log(level, "%s", _LazyEvent(name, fields))
+
+    def summary(self, logger, name: str, level: int = logging.INFO, **fields) -> None:
+        """Emit a document's summary event (structured mode only); warnings bypass the budget."""
+        if self.verbose or not logger.isEnabledFor(level) or not self._admit(sampled=False, always=level >= logging.WARNING):
+            return
+        logger.log(level, "%s", _LazyEvent(name, fields))
+
+
+_VERBOSE_EVENT_LOG = DocumentEventLog()
+_DOCUMENT_EVENT_LOGS: Dict[Tuple[str, Optional[str]], DocumentEventLog] = {}
+_DOCUMENT_EVENT_LOGS_LOCK = threading.Lock()
+
+
+def open_document_event_log(environment: str, message_id: Optional[str], mode: str = "verbose", **kwargs) -> DocumentEventLog:
+    """Set the hot-path logging policy of a batch (replacing any previous one)."""
+    event_log = DocumentEventLog(mode, **kwargs)
+    with _DOCUMENT_EVENT_LOGS_LOCK:
+        _DOCUMENT_EVENT_LOGS[(environment, message_id)] = event_log
+    return event_log
+
+
+def get_document_event_log(environment: str, message_id: Optional[str]) -> DocumentEventLog:
+    """Return the batch's logging policy (verbose when none was opened)."""
+    with _DOCUMENT_EVENT_LOGS_LOCK:
+        return _DOCUMENT_EVENT_LOGS.get((environment, message_id), _VERBOSE_EVENT_LOG)
+
+
+def close_document_event_log(environment: str, message_id: Optional[str]) -> Optional[Dict[str, int]]:
+    """Remove a batch's logging policy. Returns its event counts (None in verbose mode)."""
+    with _DOCUMENT_EVENT_LOGS_LOCK:
+        event_log = _DOCUMENT_EVENT_LOGS.pop((environment, message_id), None)
+    return event_log.stats if event_log is not None and not event_log.verbose else None
+
+
+# Lightweight task mode
+# Helpers called once or more per document (client getters, SAS signing, extraction, matching,
+# saving, the per-document task itself) are Prefect tasks, so every call creates a task run with
+# state transitions and API traffic. With lightweight_tasks=True only the coarse stages (listing,
+# splitting, the document batch, source files, rename, notification) are orchestrated and these
+# helpers run as plain function calls. The mode is a context variable, so it follows the flow
+# into worker threads started with contextvars.copy_context().
+_LIGHTWEIGHT_TASKS = contextvars.ContextVar("payslip_lightweight_tasks", default=False)
+
+
+def hot_path_task(fn):
+    """
+    @task for per-document helpers; they run as plain functions in the lightweight task mode.
+
+    The Prefect task stays available as .task and the undecorated function as .fn.
+    """
+    orchestrated = task(fn)
+
+    @functools.wraps(fn)
+    def call(*args, **kwargs):
+        if _LIGHTWEIGHT_TASKS.get():
+            return fn(*args, **kwargs)
+        return orchestrated(*args, **kwargs)
+
+    call.fn = fn
+    call.task = orchestrated
+    return call
+
+
+def set_lightweight_tasks(enabled: bool) -> None:
+    """Switch per-document helpers between Prefect tasks and plain calls for the current context."""
+    _LIGHTWEIGHT_TASKS.set(enabled)
+
 
 # Global cache for secrets to avoid repeated API calls
 _SECRET_CACHE = {}
@@ -64,13 +510,13 @@ def get_cached_secret(secret_name: str) -> str:
     return _SECRET_CACHE[secret_name]
 
 
-def get_db_connection(environment: str = "staging"):
+def create_db_connection(environment: str = "staging"):
     """
-    Get a database connection using cached credentials.
-    
+    Open a new (unpooled) database connection using cached credentials.
+
     Args:
         environment: The environment (staging/production)
-        
+
     Returns:
         psycopg2 connection object
     """
@@ -80,7 +526,7 @@ def get_db_connection(environment: str = "staging"):
         'user': get_cached_secret(f'db-user-{environment}'),
         'password': get_cached_secret(f'db-password-{environment}'),
     }
-    
+
     return psycopg2.connect(
         host=db_params['host'],
         dbname=db_params['database'],
@@ -89,6 +535,286 @@ def get_db_connection(environment: str = "staging"):
     )
 
 
+# Connection pool sizing. The pool is sized from the number of document workers
+# (see process_document_urls) plus headroom for the flow itself and rename/source saves.
+DB_POOL_DEFAULT_MAX_SIZE = 5
+DB_POOL_HEADROOM = 2
+DB_POOL_ACQUIRE_TIMEOUT_SECONDS = 60
+DB_POOL_HEALTH_CHECK_INTERVAL_SECONDS = 30
+
+
+class DatabaseConnectionPool:
+    """
+    Thread-safe pool of psycopg2 connections for a single environment.
+
+    Connections are created lazily up to max_size. Callers block (up to a timeout)
+    when the pool is exhausted. Idle connections are health-checked with SELECT 1
+    before being handed out if they have been idle longer than the health check interval.
+    """
+
+    def __init__(
+        self,
+        environment: str,
+        max_size: int = DB_POOL_DEFAULT_MAX_SIZE,
+        health_check_interval: float = DB_POOL_HEALTH_CHECK_INTERVAL_SECONDS
+    ):
+        self.environment = environment
+        self.max_size = max(1, max_size)
+        self.health_check_interval = health_check_interval
+        self._idle = []  # List of (connection, last_used_monotonic)
+        self._in_use = 0
+        self._condition = threading.Condition()
+        self._stats = {
+            "connections_created": 0,
+            "connections_discarded": 0,
+            "checkouts": 0,
+            "waits": 0,
+            "total_wait_seconds": 0.0,
+            "max_wait_seconds": 0.0,
+            "health_checks": 0,
+            "health_check_failures": 0,
+            "peak_in_use": 0
+        }
+
+    def resize(self, max_size: int) -> None:
+        """Change the maximum pool size. Shrinking only closes idle connections."""
+        with self._condition:
+            self.max_size = max(1, max_size)
+            while self._idle and len(self._idle) + self._in_use > self.max_size:
+                conn, _ = self._idle.pop()
+                self._close_quietly(conn)
+            self._condition.notify_all()
+
+    def acquire(self, timeout: float = DB_POOL_ACQUIRE_TIMEOUT_SECONDS):
+        """
+        Check a connection out of the pool, creating one if below max_size.
+
+        Raises:
+            TimeoutError: If no connection becomes available within the timeout
+        """
+        wait_start = time.monotonic()
+        waited = False
+
+        with self._condition:
+            while True:
+                if self._idle:
+                    conn, last_used = self._idle.pop()
+                    self._in_use += 1
+                    break
+                if self._in_use < self.max_size:
+                    conn, last_used = None, None
+                    self._in_use += 1
+                    break
+
+                waited = True
+                remaining = timeout - (time.monotonic() - wait_start)
+                if remaining <= 0:
+                    raise TimeoutError(
+                        f"Timed out after {timeout}s waiting for a database connection "
+                        f"(environment: {self.environment}, max_size: {self.max_size})"
+                    )
+                self._condition.wait(remaining)
+
+            wait_seconds = time.monotonic() - wait_start
+            self._stats["checkouts"] += 1
+            self._stats["peak_in_use"] = max(self._stats["peak_in_use"], self._in_use)
+            if waited:
+                self._stats["waits"] += 1
+                self._stats["total_wait_seconds"] += wait_seconds
+                self._stats["max_wait_seconds"] = max(self._stats["max_wait_seconds"], wait_seconds)
+
+        # Connect and health-check outside the lock so other threads are not blocked
+        try:
+            if conn is not None and not self._is_healthy(conn, last_used):
+                self._close_quietly(conn)
+                conn = None
+            if conn is None:
+                conn = create_db_connection(self.environment)
+                with self._condition:
+                    self._stats["connections_created"] += 1
+            return conn
+        except Exception:
+            with self._condition:
+                self._in_use -= 1
+                self._condition.notify()
+            raise
+
+    def release(self, conn) -> None:
+        """Return a connection to the pool, discarding it if it is broken."""
+        reusable = not conn.closed
+        if reusable and conn.status != psycopg2.extensions.STATUS_READY:
+            # Never hand out a connection with an open or aborted transaction
+            try:
+                conn.rollback()
+            except Exception:
+                reusable = False
+
+        with self._condition:
+            self._in_use -= 1
+            if reusable and len(self._idle) + self._in_use < self.max_size:
+                self._idle.append((conn, time.monotonic()))
+            else:
+                self._close_quietly(conn)
+            self._condition.notify()
+
+    def close_all(self) -> None:
+        """Close all idle connections. Checked-out connections are closed on release."""
+        with self._condition:
+            while self._idle:
+                conn, _ = self._idle.pop()
+                self._close_quietly(conn)
+
+    def stats(self) -> Dict[str, Any]:
+        """Return a snapshot of pool usage and wait statistics."""
+        with self._condition:
+            snapshot = dict(self._stats)
+            snapshot.update({
+                "environment": self.environment,
+                "max_size": self.max_size,
+                "in_use": self._in_use,
+                "idle": len(self._idle),
+                "avg_wait_seconds": round(
+                    self._stats["total_wait_seconds"] / self._stats["waits"], 4
+                ) if self._stats["waits"] else 0.0
+            })
+            return snapshot
+
+    def _is_healthy(self, conn, last_used: float) -> bool:
+        if conn.closed:
+            return False
+        if time.monotonic() - last_used < self.health_check_interval:
+            return True
+
+        with self._condition:
+            self._stats["health_checks"] += 1
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except Exception:
+            with self._condition:
+                self._stats["health_check_failures"] += 1
+            return False
+
+    def _close_quietly(self, conn) -> None:
+        with self._condition:
+            self._stats["connections_discarded"] += 1
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+
+class PooledConnection:
+    """
+    Proxy around a pooled psycopg2 connection.
+
+    Behaves like the underlying connection, except that close() returns the
+    connection to its pool instead of closing the socket. This keeps existing
+    call sites (cursor/commit/rollback/close) unchanged.
+    """
+
+    def __init__(self, pool: DatabaseConnectionPool, conn):
+        self._pool = pool
+        self._conn = conn
+
+    def __getattr__(self, name):
+        conn = self.__dict__.get('_conn')
+        if conn is None:
+            raise psycopg2.InterfaceError("connection already returned to pool")
+        return getattr(conn, name)
+
+    def __enter__(self):
+        return self._conn.__enter__()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return self._conn.__exit__(exc_type, exc_value, traceback)
+
+    def close(self) -> None:
+        conn, self._conn = self._conn, None
+        if conn is not None:
+            self._pool.release(conn)
+
+
+_DB_POOLS: Dict[str, DatabaseConnectionPool] = {}
+_DB_POOLS_LOCK = threading.Lock()
+
+
+def get_db_pool(environment: str = "staging") -> DatabaseConnectionPool:
+    """
+    Get (or lazily create) the connection pool for an environment.
+
+    Args:
+        environment: The environment (staging/production)
+
+    Returns:
+        The shared DatabaseConnectionPool for the environment
+    """
+    with _DB_POOLS_LOCK:
+        pool = _DB_POOLS.get(environment)
+        if pool is None:
+            pool = DatabaseConnectionPool(environment)
+            _DB_POOLS[environment] = pool
+        return pool
+
+
+def configure_db_pool(environment: str = "staging", max_workers: int = 3) -> DatabaseConnectionPool:
+    """
+    Size the environment's connection pool for the given number of concurrent workers.
+
+    The pool only grows here; a smaller batch never shrinks a pool that a concurrent
+    flow run in the same worker process may still be using.
+
+    Args:
+        environment: The environment (staging/production)
+        max_workers: Number of threads that may hold a connection at the same time
+
+    Returns:
+        The configured pool
+    """
+    pool = get_db_pool(environment)
+    desired_size = max_workers + DB_POOL_HEADROOM
+    if desired_size > pool.max_size:
+        pool.resize(desired_size)
+    return pool
+
+
+def get_db_pool_stats(environment: Optional[str] = None) -> Dict[str, Dict[str, Any]]:
+    """
+    Get connection pool statistics.
+
+    Args:
+        environment: Limit to a single environment (all pools if None)
+
+    Returns:
+        Dictionary of environment -> pool statistics
+    """
+    with _DB_POOLS_LOCK:
+        pools = dict(_DB_POOLS)
+    return {
+        env: pool.stats()
+        for env, pool in pools.items()
+        if environment is None or env == environment
+    }
+
+
+def get_db_connection(environment: str = "staging"):
+    """
+    Get a pooled database connection using cached credentials.
+
+    Calling close() on the returned connection returns it to the pool.
+
+    Args:
+        environment: The environment (staging/production)
+
+    Returns:
+        psycopg2 connection proxy (PooledConnection)
+    """
+    pool = get_db_pool(environment)
+    return PooledConnection(pool, pool.acquire())
+
+
 # Utility functions
 def extract_clean_blob_url(url: str) -> str:
     """
@@ -115,6 +841,26 @@ def extract_clean_blob_url(url: str) -> str:
     return f"{parsed.scheme}://{parsed.netloc}{normalized_path}"
 
 
+def parse_blob_url(url: str) -> Tuple[str, str]:
+    """
+    Split a blob URL into container name and URL-decoded blob name.
+
+    Args:
+        url: Blob URL, with or without SAS token
+
+    Returns:
+        Tuple of (container_name, blob_name)
+
+    Example:
+        Input:  "https://storage.blob.core.windows.net/document-repo/document-repo/t/My%20File.pdf?sp=r"
+        Output: ("document-repo", "document-repo/t/My File.pdf")
+    """
+    path_parts = urlparse(url).path.lstrip('/').split('/', 1)
+    if len(path_parts) != 2 or not path_parts[1]:
+        raise ValueError(f"Cannot extract container/blob from URL: {sanitize_url_for_logging(url)}")
+    return path_parts[0], unquote(path_parts[1])
+
+
 def sanitize_url_for_logging(url: str, max_length: int = 100) -> str:
     """
     Sanitize URL for logging by removing SAS token but keeping the blob path.
@@ -179,50 +925,735 @@ def uuid_to_ulid(uuid_str: str) -> str:
     return time_part + rand_part[-16:]  # Take last 16 chars of rand_part
 
 
-@task
-def split_pdf_to_pages(
-    pdf_url: str, 
-    user_id: str,
-    tenant_id: str,
-    process_instance_id: str,
-    environment: str = "staging"
-) -> List[str]:
+# Blob annotation writer
+# Tag and metadata updates are queued per blob, coalesced while they wait, and applied
+# on a small thread pool so storage round trips stay off the document workers' path.
+BLOB_ANNOTATION_MAX_CONCURRENCY = 8
+KNOWN_BLOB_STATE_MAX_ENTRIES = 50000
+
+# Tags/metadata/ETag this process last wrote or read for a blob, keyed by (container, blob_name).
+# Lets a later update be a single conditional write instead of read + write.
+_KNOWN_BLOB_STATE: "OrderedDict[Tuple[str, str], Dict[str, Any]]" = OrderedDict()
+_KNOWN_BLOB_STATE_LOCK = threading.Lock()
+
+
+def remember_blob_state(
+    container_name: str,
+    blob_name: str,
+    tags: Optional[Dict[str, str]] = None,
+    metadata: Optional[Dict[str, str]] = None,
+    etag: Optional[str] = None
+) -> None:
     """
-    Download a PDF, split it into individual pages, upload each page to blob storage,
-    and return URLs for each page.
-    
+    Record the tags/metadata/ETag a blob is known to have (e.g. right after uploading it).
+
+    Passing None leaves that part of the known state unchanged.
+    """
+    key = (container_name, blob_name)
+    with _KNOWN_BLOB_STATE_LOCK:
+        state = _KNOWN_BLOB_STATE.pop(key, {})
+        if tags is not None:
+            state["tags"] = dict(tags)
+        if metadata is not None:
+            state["metadata"] = dict(metadata)
+            state["etag"] = etag
+        elif etag is not None:
+            # The blob changed but we don't know its new metadata
+            state.pop("metadata", None)
+            state["etag"] = etag
+        _KNOWN_BLOB_STATE[key] = state
+        while len(_KNOWN_BLOB_STATE) > KNOWN_BLOB_STATE_MAX_ENTRIES:
+            _KNOWN_BLOB_STATE.popitem(last=False)
+
+
+def get_known_blob_state(container_name: str, blob_name: str) -> Dict[str, Any]:
+    """Return a copy of the known state for a blob (empty dict if unknown)."""
+    with _KNOWN_BLOB_STATE_LOCK:
+        return dict(_KNOWN_BLOB_STATE.get((container_name, blob_name), {}))
+
+
+def forget_blob_state(container_name: str, blob_name: str) -> None:
+    """Drop the known state for a blob (e.g. after deleting it)."""
+    with _KNOWN_BLOB_STATE_LOCK:
+        _KNOWN_BLOB_STATE.pop((container_name, blob_name), None)
+
+
+def _is_precondition_failure(error: Exception) -> bool:
+    return getattr(error, 'status_code', None) == 412
+
+
+def _tags_match_condition(tags: Dict[str, str]) -> str:
+    """Build an if_tags_match_condition expression requiring exactly these tag values."""
+    return ' AND '.join(
+        f"\"{name}\" = '{str(value).replace(chr(39), chr(39) * 2)}'" for name, value in sorted(tags.items())
+    )
+
+
+@trace_stage("tag")
+def apply_blob_annotations(
+    blob_client,
+    tags: Optional[Dict[str, str]] = None,
+    metadata: Optional[Dict[str, str]] = None,
+    content_settings: Optional[ContentSettings] = None,
+    container_name: Optional[str] = None,
+    blob_name: Optional[str] = None
+) -> int:
+    """
+    Merge tag/metadata updates into a blob and optionally set its HTTP headers.
+
+    When the blob's current tags/metadata are known (see remember_blob_state) the
+    merged values are written in one conditional call; if the blob changed meanwhile
+    (HTTP 412) the current values are read and the write is retried unconditionally.
+    A blob known to have no tags is read first instead: a tag condition cannot express
+    "no tags", and an unconditional write could wipe tags another writer just added.
+
     Args:
-        pdf_url: URL to the PDF file (with SAS token)
-        user_id: User ID who uploaded the file
-        tenant_id: Tenant ID
-        process_instance_id: Process instance ID
-        environment: Environment (staging/production)
-        
+        blob_client: BlobClient for the blob
+        tags: Tags to add/overwrite
+        metadata: Metadata entries to add/overwrite
+        content_settings: HTTP headers to set
+        container_name: Container name (for the known-state cache)
+        blob_name: Blob name (for the known-state cache)
+
     Returns:
-        List of URLs for each split page
+        Number of storage calls made
     """
-    logger = get_run_logger()
-    
-    if PdfReader is None or PdfWriter is None:
-        logger.error("PDF library not available. Install pypdf or PyPDF2 to enable PDF splitting.")
-        raise ImportError("PDF library (pypdf or PyPDF2) required for splitting")
-    
-    try:
-        # Validate and regenerate SAS token if needed before downloading
-        logger.info(f"Validating SAS token before splitting: {sanitize_url_for_logging(pdf_url)}")
-        validated_url = generate_sas_url(pdf_url, environment)
-        
+    container_name = container_name or blob_client.container_name
+    blob_name = blob_name or blob_client.blob_name
+    known = get_known_blob_state(container_name, blob_name)
+    calls = 0
+
+    if tags:
+        merged_tags = None
+        if known.get("tags"):
+            merged_tags = {**known["tags"], **tags}
+            try:
+                calls += 1
+                blob_client.set_blob_tags(tags=merged_tags, if_tags_match_condition=_tags_match_condition(known["tags"]))
+            except Exception as e:
+                if not _is_precondition_failure(e):
+                    raise
+                merged_tags = None
+        if merged_tags is None:
+            try:
+                calls += 1
+                current_tags = blob_client.get_blob_tags()
+            except Exception:
+                current_tags = {}
+            merged_tags = {**current_tags, **tags}
+            calls += 1
+            blob_client.set_blob_tags(tags=merged_tags)
+        remember_blob_state(container_name, blob_name, tags=merged_tags)
+
+    if metadata:
+        merged_metadata = None
+        if known.get("metadata") is not None and known.get("etag"):
+            merged_metadata = {**known["metadata"], **metadata}
+            try:
+                calls += 1
+                result = blob_client.set_blob_metadata(
+                    metadata=merged_metadata,
+                    etag=known["etag"],
+                    match_condition=MatchConditions.IfNotModified
+                )
+            except Exception as e:
+                if not _is_precondition_failure(e):
+                    raise
+                merged_metadata = None
+        if merged_metadata is None:
+            calls += 1
+            properties = blob_client.get_blob_properties()
+            merged_metadata = {**(properties.metadata or {}), **metadata}
+            calls += 1
+            result = blob_client.set_blob_metadata(metadata=merged_metadata)
+        remember_blob_state(container_name, blob_name, metadata=merged_metadata, etag=(result or {}).get('etag'))
+
+    if content_settings is not None:
+        calls += 1
+        result = blob_client.set_http_headers(content_settings=content_settings)
+        # Setting headers changes the ETag but not the metadata
+        remember_blob_state(
+            container_name,
+            blob_name,
+            metadata=get_known_blob_state(container_name, blob_name).get("metadata"),
+            etag=(result or {}).get('etag')
+        )
+
+    return calls
+
+
+class BlobAnnotationWriter:
+    """
+    Queues tag, metadata and HTTP header updates per blob and applies them in parallel.
+
+    Updates for a blob that are still waiting are merged into one mutation, and at most
+    one mutation per blob is in flight, so read-merge-write updates never race.
+    Call flush() (or close()) to wait until everything queued has been applied.
+    """
+
+    def __init__(self, environment: str = "staging", max_concurrency: int = BLOB_ANNOTATION_MAX_CONCURRENCY, logger=None):
+        self.environment = environment
+        self.logger = logger or get_run_logger()
+        self.stats = {"updates_queued": 0, "updates_coalesced": 0, "mutations_applied": 0, "storage_calls": 0, "failures": 0}
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="blob-annotations")
+        self._pending: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        self._running = set()
+        self._outstanding = 0
+        self._condition = threading.Condition()
+
+    def update_tags(self, container_name: str, blob_name: str, tags: Dict[str, str]) -> None:
+        """Queue tags to merge into the blob's tag set."""
+        self._enqueue(container_name, blob_name, "tags", tags)
+
+    def update_metadata(self, container_name: str, blob_name: str, metadata: Dict[str, str]) -> None:
+        """Queue metadata entries to merge into the blob's metadata."""
+        self._enqueue(container_name, blob_name, "metadata", metadata)
+
+    def set_content_settings(self, container_name: str, blob_name: str, content_settings: ContentSettings) -> None:
+        """Queue HTTP headers to set on the blob."""
+        self._enqueue(container_name, blob_name, "content_settings", content_settings)
+
+    def flush(self) -> Dict[str, int]:
+        """Block until every queued update has been applied. Returns writer statistics."""
+        with self._condition:
+            while self._outstanding:
+                self._condition.wait()
+        return dict(self.stats)
+
+    def close(self) -> Dict[str, int]:
+        """Flush and shut down the worker threads."""
+        stats = self.flush()
+        self._executor.shutdown(wait=True)
+        return stats
+
+    def _enqueue(self, container_name: str, blob_name: str, kind: str, value) -> None:
+        key = (container_name, blob_name)
+        with self._condition:
+            self.stats["updates_queued"] += 1
+            mutation = self._pending.get(key)
+            if mutation is not None:
+                self.stats["updates_coalesced"] += 1
+            else:
+                mutation = {}
+                self._pending[key] = mutation
+                self._outstanding += 1
+                if key not in self._running:
+                    self._running.add(key)
+                    self._executor.submit(contextvars.copy_context().run, self._apply, key)
+                # Otherwise the running mutation for this blob resubmits when it finishes
+
+            if kind == "content_settings":
+                mutation[kind] = value
+            else:
+                mutation.setdefault(kind, {}).update(value)
+
+    def _apply(self, key: Tuple[str, str]) -> None:
+        with self._condition:
+            mutation = self._pending.pop(key)
+
+        container_name, blob_name = key
+        try:
+            blob_client = get_blob_storage_client(self.environment).get_blob_client(container=container_name, blob=blob_name)
+            calls = apply_blob_annotations(
+                blob_client,
+                tags=mutation.get("tags"),
+                metadata=mutation.get("metadata"),
+                content_settings=mutation.get("content_settings"),
+                container_name=container_name,
+                blob_name=blob_name
+            )
+            with self._condition:
+                self.stats["mutations_applied"] += 1
+                self.stats["storage_calls"] += calls
+        except Exception as e:
+            with self._condition:
+                self.stats["failures"] += 1
+            self.logger.warning(f"Failed to update annotations for blob '{blob_name}': {str(e)}")
+        finally:
+            with self._condition:
+                self._outstanding -= 1
+                if key in self._pending:
+                    self._executor.submit(contextvars.copy_context().run, self._apply, key)
+                else:
+                    self._running.discard(key)
+                self._condition.notify_all()
+
+
+_BLOB_ANNOTATION_WRITERS: Dict[Tuple[str, Optional[str]], BlobAnnotationWriter] = {}
+_BLOB_ANNOTATION_WRITERS_LOCK = threading.Lock()
+
+
+def open_blob_annotation_writer(environment: str, message_id: Optional[str]) -> BlobAnnotationWriter:
+    """Get (or create) the blob annotation writer for a batch."""
+    with _BLOB_ANNOTATION_WRITERS_LOCK:
+        writer = _BLOB_ANNOTATION_WRITERS.get((environment, message_id))
+        if writer is None:
+            writer = BlobAnnotationWriter(environment)
+            _BLOB_ANNOTATION_WRITERS[(environment, message_id)] = writer
+        return writer
+
+
+def get_blob_annotation_writer(environment: str, message_id: Optional[str]) -> Optional[BlobAnnotationWriter]:
+    """Return the batch's open blob annotation writer, if any."""
+    with _BLOB_ANNOTATION_WRITERS_LOCK:
+        return _BLOB_ANNOTATION_WRITERS.get((environment, message_id))
+
+
+def close_blob_annotation_writer(environment: str, message_id: Optional[str]) -> Optional[Dict[str, int]]:
+    """Apply everything queued for a batch and close its writer. Returns its statistics."""
+    with _BLOB_ANNOTATION_WRITERS_LOCK:
+        writer = _BLOB_ANNOTATION_WRITERS.pop((environment, message_id), None)
+    return writer.close() if writer is not None else None
+
+
+# Streaming split: parallel ranged download into a spooled temp file and bounded parallel page uploads
+SPLIT_DOWNLOAD_CONCURRENCY = 8  # Parallel range requests when downloading the source PDF
+SPLIT_SPOOL_MAX_MEMORY = 32 * 1024 * 1024  # Larger downloads spill from memory to a temp file
+SPLIT_UPLOAD_CONCURRENCY = 8
+SPLIT_MAX_PENDING_UPLOADS = 16  # Pages produced but not yet uploaded (bounds memory)
+SPLIT_PROGRESS_LOG_INTERVAL = 50  # Pages between progress log lines in streaming mode
+
+
+def download_blob_to_spool(blob_url: str, environment: str = "staging", max_concurrency: int = SPLIT_DOWNLOAD_CONCURRENCY):
+    """
+    Download a blob with parallel ranged GETs into a spooled temporary file.
+    
+    Small files stay in memory; anything above SPLIT_SPOOL_MAX_MEMORY spills to disk,
+    so memory use is bounded regardless of the file size. The caller closes the file.
+    
+    Returns:
+        The spooled file, positioned at the start
+    """
+    container_name, blob_name = parse_blob_url(blob_url)
+    blob_client = get_blob_storage_client(environment).get_blob_client(container=container_name, blob=blob_name)
+    
+    spool = tempfile.SpooledTemporaryFile(max_size=SPLIT_SPOOL_MAX_MEMORY)
+    try:
+        blob_client.download_blob(max_concurrency=max_concurrency).readinto(spool)
+        spool.seek(0)
+    except Exception:
+        spool.close()
+        raise
+    return spool
+
+
+class BoundedParallelUploader:
+    """
+    Runs uploads on a thread pool while the producer keeps going.
+    
+    submit() blocks once max_pending uploads are waiting, so at most that many page
+    buffers are held at a time. results() returns upload results in submission order
+    and raises the first upload error.
+    """
+
+    def __init__(self, upload, max_workers: int = SPLIT_UPLOAD_CONCURRENCY, max_pending: int = SPLIT_MAX_PENDING_UPLOADS):
+        self._upload = upload
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="split-upload")
+        self._slots = threading.BoundedSemaphore(max(max_pending, max_workers))
+        self._futures: List[Future] = []
+        self._failed = threading.Event()
+
+    def submit(self, *args) -> Future:
+        """Queue an upload; stops accepting work as soon as an earlier upload has failed."""
+        if self._failed.is_set():
+            self.results()  # Raises the upload error
+        self._slots.acquire()
+        # Carry the Prefect run context over to the upload thread
+        future = self._executor.submit(contextvars.copy_context().run, self._run, *args)
+        self._futures.append(future)
+        return future
+
+    def results(self) -> List[Any]:
+        """Wait for all uploads. Returns their results in submission order."""
+        try:
+            return [future.result() for future in self._futures]
+        finally:
+            self._executor.shutdown(wait=True)
+
+    def detach(self) -> None:
+        """Stop accepting work but let queued uploads finish in the background (use their futures)."""
+        self._executor.shutdown(wait=False)
+
+    def _run(self, *args):
+        try:
+            return self._upload(*args)
+        except Exception:
+            self._failed.set()
+            raise
+        finally:
+            self._slots.release()
+
+
+def upload_split_page(
+    blob_service_client,
+    sas_service: "SasService",
+    container_name: str,
+    split_blob_path: str,
+    page_stream,
+    file_size: int,
+    page_number: int,
+    num_pages: int,
+    original_filename: str,
+    split_filename: str,
+    user_id: str,
+    tenant_id: str,
+    process_instance_id: str
+) -> Tuple[str, Dict[str, Any]]:
+    """
+    Upload one split page with its metadata and tags and generate a read SAS URL for it.
+    
+    Args:
+        page_stream: File-like object with the page content (file_size bytes)
+        
+    Returns:
+        (SAS URL of the page, upload result)
+    """
+    logger = get_run_logger()
+    
+    # Upload to blob storage with metadata and tags
+    try:
+        blob_client = blob_service_client.get_blob_client(container=container_name, blob=split_blob_path)
+        
+        # Prepare metadata (will be updated with matched filename later during rename)
+        metadata = {
+            'source_filename': original_filename,
+            'page_number': str(page_number),
+            'total_pages': str(num_pages),
+            'original_file_name': quote(split_filename),  # Will be updated to matched filename
+            'file_size': str(file_size),
+            'file_type': 'application/pdf',
+            'user': user_id,
+            'file_name': quote(split_filename),  # Will be updated to matched filename
+            'created_at': datetime.utcnow().isoformat() + 'Z',
+            'file_object_type': 'PAYSLIP'
+        }
+        
+        # Prepare tags (convert UUIDs to ULIDs to match frontend format)
+        tags = {
+            'process': uuid_to_ulid(process_instance_id),
+            'tenant': uuid_to_ulid(tenant_id),
+            'isPublic': 'false'
+        }
+        
+        upload_result = blob_client.upload_blob(
+            page_stream, 
+            length=file_size,
+            overwrite=True,
+            content_settings=ContentSettings(content_type='application/pdf'),
+            metadata=metadata,
+            tags=tags
+        )
+        remember_blob_state(container_name, split_blob_path, tags=tags, metadata=metadata, etag=upload_result.get('etag'))
+    except Exception as upload_error:
+        logger.error(f"Failed to upload page {page_number}: {str(upload_error)}")
+        logger.error(f"Blob path attempted: {split_blob_path}")
+        logger.error(f"Container: {container_name}")
+        raise
+    
+    return sas_service.sign_blob(container_name, split_blob_path), upload_result
+
+
+# In-memory split pages
+# When pages are analyzed from memory, split_pdf_to_pages keeps each page's bytes here (keyed by
+# clean blob URL) together with the future of its upload. Document Intelligence gets the bytes
+# directly while the upload runs; anything that reads the blob waits for the upload first.
+SPLIT_IN_MEMORY_BUDGET_BYTES = 256 * 1024 * 1024  # Page bytes held at once; later pages go via URL
+
+
+class SplitPageBuffer:
+    """Bytes of a split page still being uploaded, plus the upload's future."""
+
+    def __init__(self, data: Optional[bytes], upload: Future):
+        self.data = data
+        self.upload = upload
+
+    def wait_for_upload(self) -> None:
+        """Block until the page blob exists (raises the upload error if it failed)."""
+        self.upload.result()
+
+
+_SPLIT_PAGE_BUFFERS: Dict[str, SplitPageBuffer] = {}
+_SPLIT_PAGE_BYTES_HELD = 0
+_SPLIT_PAGE_BUFFERS_LOCK = threading.Lock()
+
+
+def hold_split_page(page_url: str, data: bytes, upload: Future) -> bool:
+    """
+    Register a split page whose upload is in flight.
+    
+    The bytes are kept only while the in-memory budget allows; otherwise just the upload
+    future is kept, so the page is analyzed from its URL once uploaded.
+    
+    Returns:
+        True if the bytes are held for in-memory analysis
+    """
+    global _SPLIT_PAGE_BYTES_HELD
+    with _SPLIT_PAGE_BUFFERS_LOCK:
+        keep = _SPLIT_PAGE_BYTES_HELD + len(data) <= SPLIT_IN_MEMORY_BUDGET_BYTES
+        if keep:
+            _SPLIT_PAGE_BYTES_HELD += len(data)
+        _SPLIT_PAGE_BUFFERS[extract_clean_blob_url(page_url)] = SplitPageBuffer(data if keep else None, upload)
+        return keep
+
+
+def get_split_page(document_url: str) -> Optional[SplitPageBuffer]:
+    """Return the in-flight split page for a document URL, if any."""
+    with _SPLIT_PAGE_BUFFERS_LOCK:
+        return _SPLIT_PAGE_BUFFERS.get(extract_clean_blob_url(document_url))
+
+
+def release_split_page_data(page: SplitPageBuffer) -> None:
+    """Drop a page's bytes once analyzed (its upload future stays registered)."""
+    global _SPLIT_PAGE_BYTES_HELD
+    with _SPLIT_PAGE_BUFFERS_LOCK:
+        if page.data is not None:
+            _SPLIT_PAGE_BYTES_HELD -= len(page.data)
+            page.data = None
+
+
+def forget_split_page(document_url: str) -> None:
+    """Remove a split page from the registry, releasing its bytes."""
+    global _SPLIT_PAGE_BYTES_HELD
+    with _SPLIT_PAGE_BUFFERS_LOCK:
+        page = _SPLIT_PAGE_BUFFERS.pop(extract_clean_blob_url(document_url), None)
+        if page is not None and page.data is not None:
+            _SPLIT_PAGE_BYTES_HELD -= len(page.data)
+            page.data = None
+
+
+def split_file_names(pdf_url: str) -> Tuple[str, str, str]:
+    """
+    Names used for the split files of a PDF.
+    
+    Returns:
+        (original filename, base filename without extension, blob directory of the split files)
+    """
+    # Extract original blob path info from URL
+    parsed_url = urlparse(pdf_url)
+    original_blob_path = parsed_url.path.lstrip('/')
+    
+    # Remove container name from path if present
+    # Note: There's a folder "document-repo" inside the container "document-repo"
+    # The path format is: "container-name/folder-name/path/file.pdf"  
+    # We only remove the first part (container), keeping the folder and rest of path
+    path_parts = original_blob_path.split('/', 1)
+    if len(path_parts) > 1:
+        original_blob_path = path_parts[1]
+    
+    # Generate base name for split files
+    # Handle URL-encoded filenames (e.g., Test%20in%20Bulk.pdf)
+    original_filename = unquote(original_blob_path.split('/')[-1])
+    base_filename = original_filename.rsplit('.', 1)[0]  # Remove .pdf extension
+    blob_dir = '/'.join(original_blob_path.split('/')[:-1])  # Directory path
+    return original_filename, base_filename, blob_dir
+
+
+# PDF page-count probe
+# Splitting needs the whole PDF, but deciding whether to split only needs its page count.
+# The probe reads the trailer, cross-reference and page tree root with a few ranged reads, so
+# single-page files are never downloaded to be split. Counts are kept in process, keyed by the
+# blob's ETag; the source blob itself is never written (that would change its Last-Modified,
+# which is saved as the payslip's upload time).
+PDF_PROBE_BLOCK_SIZE = 64 * 1024  # Bytes per ranged read
+PDF_PROBE_MAX_READS = 6           # Larger reads mean a layout the probe can't shortcut; download instead
+PDF_PAGE_COUNTS_MAX_ENTRIES = 50000
+
+_PDF_PAGE_COUNTS: "OrderedDict[Tuple[str, str, str], int]" = OrderedDict()
+_PDF_PAGE_COUNTS_LOCK = threading.Lock()
+
+
+class PdfProbeBudgetExceeded(Exception):
+    """The probe needed more ranged reads than PDF_PROBE_MAX_READS."""
+
+
+class RangedBlobReader(io.RawIOBase):
+    """
+    Seekable read-only file over a blob that fetches fixed-size blocks with ranged reads on demand.
+    
+    Reads are pinned to the blob's ETag, so a blob replaced mid-probe fails instead of mixing versions.
+    """
+
+    def __init__(self, blob_client, size: int, etag: Optional[str] = None,
+                 block_size: int = PDF_PROBE_BLOCK_SIZE, max_reads: int = PDF_PROBE_MAX_READS):
+        super().__init__()
+        self.blob_client = blob_client
+        self.size = size
+        self.etag = etag
+        self.block_size = block_size
+        self.max_reads = max_reads
+        self.reads = 0
+        self.bytes_read = 0
+        self._blocks: Dict[int, bytes] = {}
+        self._position = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += self.size
+        self._position = max(0, offset)
+        return self._position
+
+    def readinto(self, buffer) -> int:
+        # pypdf does not retry short reads, so fill the whole buffer even across block boundaries
+        view = memoryview(buffer).cast('B')
+        filled = 0
+        while filled < len(view) and self._position < self.size:
+            index, start = divmod(self._position, self.block_size)
+            block = self._block(index)[start:start + len(view) - filled]
+            view[filled:filled + len(block)] = block
+            filled += len(block)
+            self._position += len(block)
+        return filled
+
+    def _block(self, index: int) -> bytes:
+        block = self._blocks.get(index)
+        if block is None:
+            if self.reads >= self.max_reads:
+                raise PdfProbeBudgetExceeded(f"more than {self.max_reads} ranged reads")
+            offset = index * self.block_size
+            length = min(self.block_size, self.size - offset)
+            kwargs = {"etag": self.etag, "match_condition": MatchConditions.IfNotModified} if self.etag else {}
+            with trace_stage("pdf_probe_read"):
+                block = self.blob_client.download_blob(offset=offset, length=length, **kwargs).readall()
+            self.reads += 1
+            self.bytes_read += len(block)
+            self._blocks[index] = block
+        return block
+
+
+def probe_pdf_page_count(pdf_url: str, environment: str = "staging") -> Optional[int]:
+    """
+    Page count of a PDF blob without downloading it.
+    
+    Uses the count probed earlier in this process for the same blob version if there is one
+    (listed properties need no request at all); otherwise reads only what pypdf needs to reach
+    the page tree root, with ranged reads.
+    
+    Returns:
+        The page count, or None if it could not be determined cheaply (the caller downloads the file)
+    """
+    logger = get_run_logger()
+    try:
+        container_name, blob_name = parse_blob_url(pdf_url)
+        blob_client = get_blob_storage_client(environment).get_blob_client(container=container_name, blob=blob_name)
+        properties = get_listed_blob_properties(pdf_url)
+        if properties is None:
+            with trace_stage("blob_properties"):
+                properties = blob_client.get_blob_properties()
+    except Exception as e:
+        logger.warning(f"Could not read PDF properties for the page-count probe: {str(e)}")
+        return None
+    
+    cache_key = (container_name, blob_name, properties.etag)
+    with _PDF_PAGE_COUNTS_LOCK:
+        cached_count = _PDF_PAGE_COUNTS.get(cache_key)
+    if cached_count is not None:
+        return cached_count
+    if PdfReader is None:
+        return None
+    
+    stream = RangedBlobReader(blob_client, properties.size, etag=properties.etag)
+    try:
+        with trace_stage("pdf_probe"):
+            pdf_reader = PdfReader(stream)
+            try:
+                page_count = int(pdf_reader.trailer["/Root"]["/Pages"]["/Count"])
+            except Exception:
+                page_count = len(pdf_reader.pages)
+    except Exception as e:
+        logger.info(f"Page-count probe gave up after {stream.reads} ranged read(s) ({str(e)}), downloading the PDF")
+        return None
+    
+    logger.info(f"Probed PDF page count: {page_count} page(s) from {stream.bytes_read} of {properties.size} bytes "
+                f"in {stream.reads} ranged read(s)")
+    with _PDF_PAGE_COUNTS_LOCK:
+        _PDF_PAGE_COUNTS[cache_key] = page_count
+        while len(_PDF_PAGE_COUNTS) > PDF_PAGE_COUNTS_MAX_ENTRIES:
+            _PDF_PAGE_COUNTS.popitem(last=False)
+    return page_count
+
+
+@task
+@trace_stage("split")
+def split_pdf_to_pages(
+    pdf_url: str, 
+    user_id: str,
+    tenant_id: str,
+    process_instance_id: str,
+    environment: str = "staging",
+    streaming: bool = False,
+    analyze_from_memory: bool = False
+) -> List[str]:
+    """
+    Download a PDF, split it into individual pages, upload each page to blob storage,
+    and return URLs for each page.
+    
+    The page count is probed first (see probe_pdf_page_count); single-page files are returned
+    as they are without being downloaded.
+    
+    Args:
+        pdf_url: URL to the PDF file (with SAS token)
+        user_id: User ID who uploaded the file
+        tenant_id: Tenant ID
+        process_instance_id: Process instance ID
+        environment: Environment (staging/production)
+        streaming: Download with parallel ranged GETs into a spooled temp file and upload
+            each page as soon as it is produced, on a bounded pool of uploaders
+        analyze_from_memory: Keep each page's bytes for analysis (see hold_split_page) and
+            return without waiting for the uploads; implies streaming
+        
+    Returns:
+        List of URLs for each split page
+    """
+    logger = get_run_logger()
+    
+    if PdfReader is None or PdfWriter is None:
+        logger.error("PDF library not available. Install pypdf or PyPDF2 to enable PDF splitting.")
+        raise ImportError("PDF library (pypdf or PyPDF2) required for splitting")
+    
+    streaming = streaming or analyze_from_memory
+    pdf_source = None
+    uploader = None
+    split_urls = []
+    try:
+        # Validate and regenerate SAS token if needed before downloading
+        logger.info(f"Validating SAS token before splitting: {sanitize_url_for_logging(pdf_url)}")
+        validated_url = get_sas_service(environment).ensure_read_url(pdf_url, logger)
+        
+        # Single-page files need no download: their page count comes from metadata or a few ranged reads
+        if probe_pdf_page_count(pdf_url, environment) == 1:
+            logger.info("PDF has only 1 page (probed without downloading), no splitting needed")
+            return [validated_url]
+        
         logger.info(f"Downloading PDF from URL for splitting...")
         
         # Download the PDF
-        response = requests.get(validated_url, timeout=60)
-        response.raise_for_status()
-        pdf_bytes = response.content
-        
-        logger.info(f"Downloaded PDF, size: {len(pdf_bytes)} bytes")
+        if streaming:
+            download_start = time.time()
+            pdf_source = download_blob_to_spool(pdf_url, environment)
+            pdf_size = pdf_source.seek(0, io.SEEK_END)
+            pdf_source.seek(0)
+            logger.info(f"Downloaded PDF, size: {pdf_size} bytes in {time.time() - download_start:.2f}s "
+                        f"({SPLIT_DOWNLOAD_CONCURRENCY} parallel ranges)")
+        else:
+            response = get_http_session(environment).get(validated_url, timeout=60)
+            response.raise_for_status()
+            pdf_bytes = response.content
+            pdf_source = io.BytesIO(pdf_bytes)
+            logger.info(f"Downloaded PDF, size: {len(pdf_bytes)} bytes")
         
         # Read the PDF
-        pdf_reader = PdfReader(io.BytesIO(pdf_bytes))
+        pdf_reader = PdfReader(pdf_source)
         num_pages = len(pdf_reader.pages)
         
         logger.info(f"PDF has {num_pages} page(s). Splitting into individual pages...")
@@ -231,41 +1662,23 @@ def split_pdf_to_pages(
             logger.info("PDF has only 1 page, no splitting needed")
             return [validated_url]  # Return validated URL, not original
         
-        # Extract original blob path info from URL
-        parsed_url = urlparse(pdf_url)
-        original_blob_path = parsed_url.path.lstrip('/')
-        
-        # Remove container name from path if present
-        # Note: There's a folder "document-repo" inside the container "document-repo"
-        # The path format is: "container-name/folder-name/path/file.pdf"  
-        # We only remove the first part (container), keeping the folder and rest of path
-        path_parts = original_blob_path.split('/', 1)
-        if len(path_parts) > 1:
-            original_blob_path = path_parts[1]
-        
-        logger.info(f"Extracted blob path from URL: {original_blob_path}")
-        
-        # Generate base name for split files
-        # Handle URL-encoded filenames (e.g., Test%20in%20Bulk.pdf)
-        original_filename = unquote(original_blob_path.split('/')[-1])
-        base_filename = original_filename.rsplit('.', 1)[0]  # Remove .pdf extension
-        blob_dir = '/'.join(original_blob_path.split('/')[:-1])  # Directory path
+        original_filename, base_filename, blob_dir = split_file_names(pdf_url)
         
         logger.info(f"Original file: {original_filename}, will create split files in: {blob_dir}")
         
         # Get blob service client
         blob_service_client = get_blob_storage_client(environment)
         container_name = "document-repo"
-        container_client = blob_service_client.get_container_client(container_name)
         
         logger.info(f"Split files will be uploaded to container '{container_name}' with blob path prefix: {blob_dir}/")
         
-        # Validate that we have account key for SAS generation
-        if not hasattr(blob_service_client.credential, 'account_key'):
-            logger.error("Blob storage client does not have account_key. Cannot generate SAS tokens for split pages.")
-            raise ValueError("PDF splitting requires storage account key for SAS token generation. Managed identity authentication is not supported for this operation.")
+        # Split pages are signed locally (account key, or a user delegation key under managed identity)
+        sas_service = get_sas_service(environment)
         
         split_urls = []
+        if streaming:
+            uploader = BoundedParallelUploader(lambda *args: upload_split_page(blob_service_client, sas_service, container_name, *args)[0])
+        split_start = time.time()
         
         # Split and upload each page
         for page_num in range(num_pages):
@@ -276,263 +1689,610 @@ def split_pdf_to_pages(
             # Write to bytes
             page_bytes = io.BytesIO()
             pdf_writer.write(page_bytes)
+            file_size = page_bytes.tell()
             page_bytes.seek(0)
             
             # Create blob name for this page
             split_filename = f"{base_filename}_page{page_num + 1}.pdf"
             split_blob_path = f"{blob_dir}/{split_filename}"
+            page_args = (split_blob_path, page_bytes, file_size, page_num + 1, num_pages, original_filename,
+                         split_filename, user_id, tenant_id, process_instance_id)
+            
+            if analyze_from_memory:
+                # One immutable copy of the page, shared by the upload and the analysis
+                page_data = page_bytes.getvalue()
+                page_args = (split_blob_path, io.BytesIO(page_data)) + page_args[2:]
+                split_url = sas_service.sign_blob(container_name, split_blob_path)
+                hold_split_page(split_url, page_data, uploader.submit(*page_args))
+                split_urls.append(split_url)
+            elif uploader:
+                uploader.submit(*page_args)
+            if uploader:
+                if (page_num + 1) % SPLIT_PROGRESS_LOG_INTERVAL == 0:
+                    logger.info(f"Split {page_num + 1}/{num_pages} pages ({time.time() - split_start:.1f}s)")
+                continue
             
             logger.info(f"Uploading page {page_num + 1}/{num_pages} as: {split_filename}")
             logger.info(f"Full blob path: {split_blob_path}")
             
-            # Get file size
-            page_bytes_value = page_bytes.getvalue()
-            file_size = len(page_bytes_value)
-            page_bytes.seek(0)
-            
-            # Upload to blob storage with metadata and tags
-            try:
-                blob_client = container_client.get_blob_client(split_blob_path)
-                
-                # Prepare metadata (will be updated with matched filename later during rename)
-                metadata = {
-                    'source_filename': original_filename,
-                    'page_number': str(page_num + 1),
-                    'total_pages': str(num_pages),
-                    'original_file_name': quote(split_filename),  # Will be updated to matched filename
-                    'file_size': str(file_size),
-                    'file_type': 'application/pdf',
-                    'user': user_id,
-                    'file_name': quote(split_filename),  # Will be updated to matched filename
-                    'created_at': datetime.utcnow().isoformat() + 'Z',
-                    'file_object_type': 'PAYSLIP'
-                }
-                
-                # Prepare tags (convert UUIDs to ULIDs to match frontend format)
-                tags = {
-                    'process': uuid_to_ulid(process_instance_id),
-                    'tenant': uuid_to_ulid(tenant_id),
-                    'isPublic': 'false'
-                }
-                
-                upload_result = blob_client.upload_blob(
-                    page_bytes, 
-                    overwrite=True,
-                    content_settings=ContentSettings(content_type='application/pdf'),
-                    metadata=metadata,
-                    tags=tags
-                )
-                logger.info(f"Upload result - ETag: {upload_result.get('etag', 'N/A')}, Last Modified: {upload_result.get('last_modified', 'N/A')}")
-            except Exception as upload_error:
-                logger.error(f"Failed to upload page {page_num + 1}: {str(upload_error)}")
-                logger.error(f"Blob path attempted: {split_blob_path}")
-                logger.error(f"Container: {container_name}")
-                raise
-            
-            # Generate SAS URL for the split page
-            blob_url = blob_client.url
-            sas_token = generate_blob_sas(
-                account_name=blob_service_client.account_name,
-                container_name=container_name,
-                blob_name=split_blob_path,
-                account_key=blob_service_client.credential.account_key,
-                permission=BlobSasPermissions(read=True),
-                expiry=datetime.utcnow() + timedelta(days=1)
-            )
-            
-            split_url = f"{blob_url}?{sas_token}"
+            split_url, upload_result = upload_split_page(blob_service_client, sas_service, container_name, *page_args)
+            logger.info(f"Upload result - ETag: {upload_result.get('etag', 'N/A')}, Last Modified: {upload_result.get('last_modified', 'N/A')}")
             split_urls.append(split_url)
             
             logger.info(f"Page {page_num + 1} uploaded successfully to: {sanitize_url_for_logging(split_url)}")
         
-        logger.info(f"Successfully split PDF into {len(split_urls)} pages")
+        if analyze_from_memory:
+            # Uploads finish in the background; readers of each page wait on its future
+            uploader.detach()
+            uploader = None
+        elif uploader:
+            split_urls = uploader.results()
+            uploader = None
+        
+        logger.info(f"Successfully split PDF into {len(split_urls)} pages in {time.time() - split_start:.2f}s")
         return split_urls
         
     except Exception as e:
         logger.error(f"Failed to split PDF: {str(e)}")
+        if analyze_from_memory:
+            for split_url in split_urls:
+                forget_split_page(split_url)
         raise
+    finally:
+        if uploader:
+            # Wait for uploads still running after a failure; their errors are already moot
+            try:
+                uploader.results()
+            except Exception:
+                pass
+        if pdf_source is not None:
+            pdf_source.close()
 
 
-@task
-def get_blob_storage_client(environment: str = "staging") -> BlobServiceClient:
-    """
-    Get an authenticated Azure Blob Storage client.
+# Multipage analysis
+# A multipage PDF is analyzed in one Document Intelligence call; each payslip the model
+# detects is mapped back to its page range and only those ranges become blobs. The
+# extraction is held per blob URL so process_document_urls does not analyze it again.
+MULTIPAGE_PAGE_ANALYSIS_CONCURRENCY = 8  # Per-page range analyses when the model does not separate payslips
+
+_PREANALYZED_DOCUMENTS: Dict[str, Dict[str, Any]] = {}
+_PREANALYZED_DOCUMENTS_LOCK = threading.Lock()
+
+
+def hold_preanalyzed_document(document_url: str, extracted_data: Dict[str, Any]) -> None:
+    """Keep the extraction of a document that was already analyzed (keyed by clean blob URL)."""
+    with _PREANALYZED_DOCUMENTS_LOCK:
+        _PREANALYZED_DOCUMENTS[extract_clean_blob_url(document_url)] = extracted_data
+
+
+def peek_preanalyzed_document(document_url: str) -> Optional[Dict[str, Any]]:
+    """Return the held extraction for a document without removing it."""
+    with _PREANALYZED_DOCUMENTS_LOCK:
+        return _PREANALYZED_DOCUMENTS.get(extract_clean_blob_url(document_url))
+
+
+def take_preanalyzed_document(document_url: str) -> Optional[Dict[str, Any]]:
+    """Remove and return the held extraction for a document, if any."""
+    with _PREANALYZED_DOCUMENTS_LOCK:
+        return _PREANALYZED_DOCUMENTS.pop(extract_clean_blob_url(document_url), None)
+
+
+def map_documents_to_page_ranges(result) -> List[Tuple[int, int, int]]:
     """
-    logger = get_run_logger()
+    Page range of each analyzed document, from its bounding regions.
     
-    try:
-        # Try to use connection string from Secret (cached)
-        connection_string = get_cached_secret(f"azure-storage-connection-string-{environment}")
-        logger.info("Using connection string from Secret block")
-        return BlobServiceClient.from_connection_string(connection_string)
-    except Exception as e:
-        logger.info(f"Connection string not found in Secret block: {str(e)}")
-        
-        # Fall back to DefaultAzureCredential
-        logger.info("Falling back to DefaultAzureCredential")
-        account_url = f"https://{Secret.load(f'azure-storage-account-name-{environment}').get()}.blob.core.windows.net"
-        # TODO: In the future, use managed identity for authentication
-        return BlobServiceClient(account_url=account_url, credential=DefaultAzureCredential())
+    Returns:
+        (first page, last page, document index) tuples ordered by first page; documents
+        without bounding regions are left out
+    """
+    ranges = []
+    for index, document in enumerate(getattr(result, 'documents', None) or []):
+        page_numbers = [region.page_number for region in (getattr(document, 'bounding_regions', None) or [])]
+        if page_numbers:
+            ranges.append((min(page_numbers), max(page_numbers), index))
+    return sorted(ranges)
 
 
 @task
-def generate_sas_url(blob_path_or_url: str, environment: str = "staging") -> str:
+@trace_stage("split")
+def split_pdf_by_analysis(
+    pdf_url: str,
+    user_id: str,
+    tenant_id: str,
+    process_instance_id: str,
+    environment: str = "staging",
+    message_id: Optional[str] = None
+) -> List[str]:
     """
-    Generate a SAS URL for a blob if it doesn't already have one.
+    Analyze a multipage PDF in one call and create one blob per detected payslip.
     
-    Args:
-        blob_path_or_url: The path to the blob (container/path) or a URL that may already have a SAS token
+    Documents returned by the model are mapped to page ranges via their bounding regions.
+    A single document spanning every page is one (multi-page) payslip: the original is kept
+    and its extraction reused. Only when a single document doesn't cover the whole file (or
+    has no page ranges) is each page of the original analyzed separately by page range
+    (still without uploading anything first). Pages that belong to no payslip get no blob,
+    and a payslip spanning several pages gets one.
     
-    Returns:
-        str: The SAS URL
-    
-    Note:
-        This implementation uses SAS tokens for authentication. In a production environment,
-        it's recommended to use Azure Managed Identity for enhanced security.
+    Args:
+        pdf_url: URL to the PDF file (with SAS token)
+        user_id: User ID who uploaded the file
+        tenant_id: Tenant ID
+        process_instance_id: Process instance ID
+        environment: Environment (staging/production)
+        message_id: Batch ID (for the adaptive concurrency controller, if any)
         
-        Future Implementation Plan:
-        1. Update the Document Intelligence client to use DefaultAzureCredential
-        2. Configure RBAC permissions for the managed identity to access blob storage
-        3. Remove the SAS token generation and use blob URLs directly
-        4. Update the Azure Function App's identity configuration
+    Returns:
+        URLs of the payslip blobs (or the validated original URL if the file is one payslip);
+        their extractions are held for process_document_urls
     """
     logger = get_run_logger()
     
-    # Check if the input is already a URL with a SAS token
-    if blob_path_or_url.startswith('http') and '?' in blob_path_or_url:
-        logger.debug(f"Validating existing SAS token in URL: {sanitize_url_for_logging(blob_path_or_url)}")
-        # Validate SAS has read permission; otherwise regenerate
-        try:
-            parsed = urlparse(blob_path_or_url)
-            qs = parse_qs(parsed.query)
-            sp = (qs.get('sp', [''])[0] or '').lower()
-            sr = (qs.get('sr', [''])[0] or '').lower()
-            se = qs.get('se', [''])[0]  # Expiry time for logging
-            
-            logger.debug(f"SAS token details - Permissions (sp): '{sp}', Resource (sr): '{sr}', Expiry (se): '{se}'")
-            
-            # Check if SAS token is expired
-            is_expired = False
-            if se:
-                try:
-                    # Parse expiry time (format: 2025-09-26T11%3A13%3A23Z)
-                    expiry_str = unquote(se).replace('Z', '+00:00')
-                    expiry_time = datetime.fromisoformat(expiry_str)
-                    current_time = datetime.now(expiry_time.tzinfo)
-                    
-                    if current_time >= expiry_time:
-                        is_expired = True
-                        logger.warning(f"SAS token has expired (expiry: {expiry_str}, current: {current_time.isoformat()}). Regenerating SAS token.")
-                    else:
-                        time_remaining = expiry_time - current_time
-                        logger.debug(f"SAS token expires in {time_remaining} (at {expiry_str})")
-                except Exception as e:
-                    logger.warning(f"Could not parse SAS expiry time '{se}': {str(e)}. Will regenerate SAS to be safe.")
-                    is_expired = True
-            
-            # If SAS explicitly lacks read permission, is expired, or appears container-scoped without read, regenerate
-            if 'r' not in sp:
-                logger.warning(f"SAS token lacks read permission (sp='{sp}'). Document Intelligence requires read access. Regenerating blob-level SAS with read permission.")
-            elif is_expired:
-                logger.warning(f"SAS token is expired. Regenerating blob-level SAS with read permission.")
-            elif sr == 'c' and 'r' not in sp:
-                # Extra guard; covered by the condition above
-                logger.warning(f"SAS is container-scoped (sr='{sr}') without read permission (sp='{sp}'). Regenerating blob-level SAS with read permission.")
-            else:
-                logger.debug(f"SAS token is valid for Document Intelligence (has read permission and not expired). Using existing URL.")
-                return blob_path_or_url
-            # Fall-through to regenerate SAS below by extracting container/blob from URL
-        except Exception as e:
-            logger.error(f"Failed to validate existing SAS token: {str(e)}. Will attempt to regenerate SAS token.", exc_info=True)
+    if PdfReader is None or PdfWriter is None:
+        logger.error("PDF library not available. Install pypdf or PyPDF2 to enable PDF splitting.")
+        raise ImportError("PDF library (pypdf or PyPDF2) required for splitting")
     
-    # If it's a URL (with invalid SAS or without SAS), extract the blob path
-    if blob_path_or_url.startswith('http'):
-        # Extract account name and container/blob path from URL
-        try:
-            parsed_url = urlparse(blob_path_or_url)
-            # Format: https://<account>.blob.core.windows.net/<container>/<blob>
-            path_parts = parsed_url.path.strip('/').split('/')
-            if len(path_parts) < 2:
-                raise ValueError(f"Cannot extract container/blob from URL: {blob_path_or_url}")
-            container_name = path_parts[0]
-            # URL decode the blob name to handle spaces and special characters
-            blob_name = unquote('/'.join(path_parts[1:]))
-            blob_path = f"{container_name}/{blob_name}"
-            logger.debug(f"Extracted blob path from URL: {blob_path}")
-        except Exception as e:
-            logger.error(f"Failed to parse URL: {str(e)}")
-            raise ValueError(f"Invalid blob URL: {blob_path_or_url}") from e
+    validated_url = get_sas_service(environment).ensure_read_url(pdf_url, logger)
+    client = get_document_intelligence_client(environment)
+    model_id = get_document_intelligence_model_id(environment)
+    
+    analysis_start = time.time()
+    body_args, body_kwargs = analyze_request_args(validated_url)
+    result = run_document_analysis(client, model_id, body_args, body_kwargs, environment, message_id)
+    total_pages = len(getattr(result, 'pages', None) or []) or 1
+    ranges = map_documents_to_page_ranges(result)
+    logger.info(f"Analyzed {total_pages} page(s) in one call in {time.time() - analysis_start:.2f}s: "
+                f"{len(ranges)} payslip document(s) detected")
+    
+    if len(ranges) > 1:
+        segments = [(first, last, result, index) for first, last, index in ranges]
+    elif ranges and ranges[0][:2] == (1, total_pages):
+        # One payslip spanning the whole file (possibly several pages): keep the original as it is
+        segments = [(1, total_pages, result, ranges[0][2])]
+    elif total_pages > 1:
+        # The single document doesn't account for every page: analyze each page of the original by page range
+        logger.info(f"Model returned a single document not covering all {total_pages} pages; analyzing them individually by page range")
+        with ThreadPoolExecutor(max_workers=MULTIPAGE_PAGE_ANALYSIS_CONCURRENCY) as executor:
+            futures = [
+                executor.submit(
+                    contextvars.copy_context().run, run_document_analysis,
+                    client, model_id, body_args, dict(body_kwargs, pages=str(page_number)), environment, message_id
+                )
+                for page_number in range(1, total_pages + 1)
+            ]
+            page_results = [future.result() for future in futures]
+        segments = [
+            (page_number, page_number, page_result, 0)
+            for page_number, page_result in enumerate(page_results, 1)
+            if getattr(page_result, 'documents', None)
+        ]
+        logger.info(f"Page range analysis found payslips on {len(segments)} of {total_pages} page(s) "
+                    f"in {time.time() - analysis_start:.2f}s")
     else:
-        # It's already a blob path
-        blob_path = blob_path_or_url
+        segments = [(1, 1, result, 0)]
+    
+    # A single payslip covering the whole file needs no new blob
+    if len(segments) <= 1 and (not segments or segments[0][:2] == (1, total_pages)):
+        segment_result, document_index = (segments[0][2], segments[0][3]) if segments else (result, 0)
+        hold_preanalyzed_document(validated_url, extract_payslip_fields(segment_result, document_index))
+        return [validated_url]
+    
+    original_filename, base_filename, blob_dir = split_file_names(pdf_url)
+    blob_service_client = get_blob_storage_client(environment)
+    container_name = "document-repo"
+    sas_service = get_sas_service(environment)
+    
+    pdf_source = download_blob_to_spool(pdf_url, environment)
+    uploader = BoundedParallelUploader(lambda *args: upload_split_page(blob_service_client, sas_service, container_name, *args)[0])
+    extractions = []
+    try:
+        pdf_reader = PdfReader(pdf_source)
+        for first, last, segment_result, document_index in segments:
+            pdf_writer = PdfWriter()
+            for page_number in range(first, last + 1):
+                pdf_writer.add_page(pdf_reader.pages[page_number - 1])
+            page_bytes = io.BytesIO()
+            pdf_writer.write(page_bytes)
+            file_size = page_bytes.tell()
+            page_bytes.seek(0)
+            
+            split_filename = f"{base_filename}_page{first}.pdf" if first == last else f"{base_filename}_pages{first}-{last}.pdf"
+            uploader.submit(f"{blob_dir}/{split_filename}", page_bytes, file_size, first, total_pages, original_filename,
+                            split_filename, user_id, tenant_id, process_instance_id)
+            extractions.append(extract_payslip_fields(segment_result, document_index))
+        page_urls = uploader.results()
+    finally:
+        pdf_source.close()
+    
+    for page_url, extracted_data in zip(page_urls, extractions):
+        hold_preanalyzed_document(page_url, extracted_data)
+    
+    covered_pages = sum(last - first + 1 for first, last, _, _ in segments)
+    logger.info(f"Created {len(page_urls)} payslip blob(s) covering {covered_pages} of {total_pages} page(s) "
+                f"in {time.time() - analysis_start:.2f}s")
+    return page_urls
+
+
+# Process-wide client registry
+# Blob, Document Intelligence and HTTP clients are created once per environment and shared
+# by all threads. Each keeps a connection pool, so reusing them avoids a TLS handshake and
+# secret lookups per document.
+HTTP_POOL_MAXSIZE = 64  # Pooled connections kept per host
+
+_SHARED_CLIENTS: Dict[Tuple[str, str], Any] = {}
+_SHARED_CLIENT_STATS: Dict[Tuple[str, str], Dict[str, int]] = {}
+_SHARED_CLIENT_CREATION_LOCKS: Dict[Tuple[str, str], threading.Lock] = {}
+_SHARED_CLIENTS_LOCK = threading.Lock()
+
+
+def get_shared_client(kind: str, environment: str, factory):
+    """
+    Return the shared client of a kind for an environment, creating it with factory() once.
+    
+    factory() runs under a lock of its own key only, so a slow secret load or credential setup
+    for one client never blocks threads fetching another.
+    
+    Args:
+        kind: Client kind, e.g. "blob", "document-intelligence", "http"
+        environment: The environment (staging/production)
+        factory: Zero-argument callable that creates the client
+    """
+    key = (kind, environment)
+    with _SHARED_CLIENTS_LOCK:
+        client = _SHARED_CLIENTS.get(key)
+        if client is not None:
+            _SHARED_CLIENT_STATS.setdefault(key, {"created": 0, "reused": 0})["reused"] += 1
+            return client
+        creation_lock = _SHARED_CLIENT_CREATION_LOCKS.setdefault(key, threading.Lock())
     
-    logger.debug(f"Generating new SAS URL for blob: {blob_path}")
+    with creation_lock:
+        # Another thread may have created it while this one waited
+        with _SHARED_CLIENTS_LOCK:
+            client = _SHARED_CLIENTS.get(key)
+            if client is not None:
+                _SHARED_CLIENT_STATS.setdefault(key, {"created": 0, "reused": 0})["reused"] += 1
+                return client
+        client = factory()
+        with _SHARED_CLIENTS_LOCK:
+            _SHARED_CLIENTS[key] = client
+            _SHARED_CLIENT_STATS.setdefault(key, {"created": 0, "reused": 0})["created"] += 1
+        return client
+
+
+def get_shared_client_stats() -> Dict[str, Dict[str, int]]:
+    """Creation and reuse counts per shared client ("kind:environment")."""
+    with _SHARED_CLIENTS_LOCK:
+        return {f"{kind}:{environment}": dict(stats) for (kind, environment), stats in _SHARED_CLIENT_STATS.items()}
+
+
+def reset_shared_clients(environment: Optional[str] = None) -> None:
+    """Close and forget shared clients and their statistics (e.g. after rotating credentials), optionally for one environment."""
+    with _SHARED_CLIENTS_LOCK:
+        keys = [key for key in _SHARED_CLIENTS if environment is None or key[1] == environment]
+        clients = [_SHARED_CLIENTS.pop(key) for key in keys]
+        for key in [key for key in _SHARED_CLIENT_STATS if environment is None or key[1] == environment]:
+            del _SHARED_CLIENT_STATS[key]
+    for client in clients:
+        try:
+            client.close()
+        except Exception:
+            pass
+
+
+def create_http_session() -> requests.Session:
+    """Create a requests session whose pool holds enough connections for all worker threads."""
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=HTTP_POOL_MAXSIZE, pool_maxsize=HTTP_POOL_MAXSIZE)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def get_http_session(environment: str = "staging") -> requests.Session:
+    """Shared HTTP session for an environment (also the transport of the shared Azure clients)."""
+    return get_shared_client("http", environment, create_http_session)
+
+
+def _shared_transport(environment: str) -> RequestsTransport:
+    # session_owner=False: closing one client must not close the session the others use
+    return RequestsTransport(session=get_http_session(environment), session_owner=False)
+
+
+def create_blob_storage_client(environment: str = "staging") -> BlobServiceClient:
+    """
+    Create an authenticated Azure Blob Storage client.
+    """
+    logger = get_run_logger()
     
     try:
-        # Get connection string from Secret block (cached)
+        # Try to use connection string from Secret (cached)
         connection_string = get_cached_secret(f"azure-storage-connection-string-{environment}")
-        logger.debug(f"Retrieved storage connection string for environment: {environment}")
-        
-        # Parse the connection string
-        account_name = None
-        account_key = None
-        for part in connection_string.split(';'):
-            if part.startswith('AccountName='):
-                account_name = part.split('=', 1)[1]
-            elif part.startswith('AccountKey='):
-                account_key = part.split('=', 1)[1]
-        
-        if not account_name or not account_key:
-            logger.error("Failed to parse storage account name or key from connection string")
-            raise ValueError("Could not parse connection string")
-        
-        logger.debug(f"Parsed storage account: {account_name}")
-        
-        # Split the blob path into container and blob name
-        parts = blob_path.split('/', 1)
-        if len(parts) != 2:
-            logger.error(f"Invalid blob path format: {blob_path}. Expected format: container/blob")
-            raise ValueError(f"Invalid blob path: {blob_path}")
-        
-        container_name, blob_name = parts
-        logger.debug(f"Container: {container_name}, Blob: {blob_name}")
+        logger.info("Using connection string from Secret block")
+        return BlobServiceClient.from_connection_string(connection_string, transport=_shared_transport(environment))
+    except Exception as e:
+        logger.info(f"Connection string not found in Secret block: {str(e)}")
         
-        # Create a BlobServiceClient
-        blob_service_client = BlobServiceClient.from_connection_string(connection_string)
+        # Fall back to DefaultAzureCredential
+        logger.info("Falling back to DefaultAzureCredential")
+        account_url = f"https://{get_cached_secret(f'azure-storage-account-name-{environment}')}.blob.core.windows.net"
+        # TODO: In the future, use managed identity for authentication
+        return BlobServiceClient(account_url=account_url, credential=DefaultAzureCredential(), transport=_shared_transport(environment))
+
+
+@hot_path_task
+def get_blob_storage_client(environment: str = "staging") -> BlobServiceClient:
+    """
+    Get the shared, authenticated Azure Blob Storage client for an environment.
+    
+    The client is created on first use and reused afterwards (it is thread-safe).
+    """
+    return get_shared_client("blob", environment, lambda: create_blob_storage_client(environment))
+
+
+# SAS service
+# Credentials are parsed once per environment, validated and minted URLs are memoized until
+# shortly before they expire, and signing is local HMAC, so thousands of paths can be signed
+# in one call. Without an account key, user delegation keys are used instead.
+SAS_EXPIRY = timedelta(hours=24)
+SAS_REUSE_MARGIN = timedelta(minutes=15)  # Memoized URLs are not handed out closer than this to expiry
+SAS_MEMO_MAX_ENTRIES = 50000
+
+
+def parse_storage_connection_string(connection_string: str) -> Dict[str, str]:
+    """Split an Azure Storage connection string into its key/value parts."""
+    parts = {}
+    for part in connection_string.split(';'):
+        if '=' in part:
+            name, value = part.split('=', 1)
+            parts[name] = value
+    return parts
+
+
+def check_read_sas(url: str, margin: timedelta = timedelta(0)) -> Tuple[Optional[str], Optional[datetime]]:
+    """
+    Check whether a URL's SAS token grants read access for at least `margin` more.
+    
+    Returns:
+        (reason the SAS is unusable or None, expiry as naive UTC or None if the token has no se)
+    """
+    qs = parse_qs(urlparse(url).query)
+    sp = (qs.get('sp', [''])[0] or '').lower()
+    se = qs.get('se', [''])[0]
+    
+    if 'r' not in sp:
+        return f"SAS token lacks read permission (sp='{sp}')", None
+    if not se:
+        return None, None
+    try:
+        expiry_time = datetime.fromisoformat(unquote(se).replace('Z', '+00:00'))
+    except ValueError:
+        return f"Could not parse SAS expiry time '{se}'", None
+    if expiry_time.tzinfo is not None:
+        expiry_time = expiry_time.astimezone(timezone.utc).replace(tzinfo=None)
+    if datetime.utcnow() + margin >= expiry_time:
+        return f"SAS token has expired or expires within {margin} (expiry: {expiry_time.isoformat()}Z)", expiry_time
+    return None, expiry_time
+
+
+class SasService:
+    """
+    Mints read SAS URLs for one storage account.
+    
+    Signs with the account key when the connection string has one, otherwise with a
+    (cached) user delegation key. Thread-safe; get one with get_sas_service().
+    """
+
+    def __init__(self, blob_service_client, account_name: str, account_key: Optional[str] = None):
+        self.blob_service_client = blob_service_client
+        self.account_name = account_name
+        self.account_key = account_key
+        self.service_url = blob_service_client.url.rstrip('/')
+        self.stats = {"signed": 0, "memo_hits": 0, "validated": 0, "delegation_keys": 0}
+        self._memo: "OrderedDict[Tuple, Tuple[str, Optional[datetime]]]" = OrderedDict()
+        self._delegation_key = None
+        self._delegation_key_expiry = datetime.min
+        self._lock = threading.Lock()
+
+    @classmethod
+    def for_environment(cls, environment: str = "staging") -> "SasService":
+        """Create the service from the environment's storage secrets (parsed once)."""
+        blob_service_client = get_blob_storage_client(environment)
+        try:
+            parts = parse_storage_connection_string(get_cached_secret(f"azure-storage-connection-string-{environment}"))
+        except Exception:
+            parts = {}
+        account_name = parts.get('AccountName') or blob_service_client.account_name
+        return cls(blob_service_client, account_name, parts.get('AccountKey'))
+
+    def close(self) -> None:
+        """Nothing to release (the blob client is shared); present for the client registry."""
+
+    def blob_url(self, container_name: str, blob_name: str) -> str:
+        """Unsigned URL of a blob, encoded the same way BlobClient.url is."""
+        return f"{self.service_url}/{container_name}/{quote(blob_name, safe='~/')}"
+
+    def sign_blob(self, container_name: str, blob_name: str, expiry: Optional[datetime] = None) -> str:
+        """
+        Read SAS URL for one blob (memoized until SAS_REUSE_MARGIN before its expiry).
         
-        # Get a BlobClient
-        blob_client = blob_service_client.get_blob_client(container=container_name, blob=blob_name)
+        A URL with an explicit expiry is always signed fresh: a memoized one has another lifetime.
+        """
+        if expiry is not None:
+            return self._sign_blob(container_name, blob_name, expiry)[0]
+        return self._memoized(("blob", container_name, blob_name), lambda: self._sign_blob(container_name, blob_name, None))
+
+    def container_token(self, container_name: str) -> str:
+        """Container-scoped read/list SAS token, shared by every blob in the container."""
+        url = self._memoized(("container", container_name, ""), lambda: self._sign_container(container_name))
+        return url.split('?', 1)[1]
+
+    @trace_stage("sas")
+    def sign_blob_paths(self, blob_paths: List[str], scope: str = "blob") -> List[str]:
+        """
+        Read SAS URLs for many "container/blob" paths in one call.
         
-        # Generate SAS token with 24-hour expiry
-        expiry_time = datetime.utcnow() + timedelta(hours=24)
-        logger.debug(f"Generating SAS token with read permission, expires at: {expiry_time.isoformat()}Z")
+        Args:
+            blob_paths: Paths in container/blob form
+            scope: "blob" signs each blob; "container" appends one container SAS per container
+        """
+        signed = []
+        for blob_path in blob_paths:
+            container_name, blob_name = split_blob_path(blob_path)
+            if scope == "container":
+                signed.append(f"{self.blob_url(container_name, blob_name)}?{self.container_token(container_name)}")
+            else:
+                signed.append(self.sign_blob(container_name, blob_name))
+        return signed
+
+    @trace_stage("sas")
+    def ensure_read_url(self, blob_path_or_url: str, logger=None) -> str:
+        """
+        Return a URL Document Intelligence can read: the input itself if its SAS grants read
+        access and is not about to expire, otherwise a freshly signed blob URL.
+        """
+        if blob_path_or_url.startswith('http') and '?' in blob_path_or_url:
+            with self._lock:
+                memo = self._memo.get(("url", blob_path_or_url, ""))
+            if memo and (memo[1] is None or datetime.utcnow() + SAS_REUSE_MARGIN < memo[1]):
+                with self._lock:
+                    self.stats["memo_hits"] += 1
+                return memo[0]
+            
+            reason, expiry_time = check_read_sas(blob_path_or_url, SAS_REUSE_MARGIN)
+            with self._lock:
+                self.stats["validated"] += 1
+            if reason is None:
+                self._remember(("url", blob_path_or_url, ""), blob_path_or_url, expiry_time)
+                return blob_path_or_url
+            if logger:
+                logger.warning(f"{reason}. Regenerating blob-level SAS with read permission.")
         
-        # TODO: In the future, replace this with managed identity authentication
+        if blob_path_or_url.startswith('http'):
+            path_parts = urlparse(blob_path_or_url).path.strip('/').split('/')
+            if len(path_parts) < 2:
+                raise ValueError(f"Invalid blob URL: {blob_path_or_url}")
+            container_name, blob_name = path_parts[0], unquote('/'.join(path_parts[1:]))
+        else:
+            container_name, blob_name = split_blob_path(blob_path_or_url)
+        return self.sign_blob(container_name, blob_name)
+
+    def ensure_read_urls(self, urls: List[str], logger=None) -> List[Any]:
+        """ensure_read_url for many URLs; failures are returned in place as exceptions."""
+        results = []
+        for url in urls:
+            try:
+                results.append(self.ensure_read_url(url, logger))
+            except Exception as e:
+                results.append(e)
+        return results
+
+    def _memoized(self, key: Tuple, sign) -> str:
+        with self._lock:
+            memo = self._memo.get(key)
+            if memo and datetime.utcnow() + SAS_REUSE_MARGIN < memo[1]:
+                self._memo.move_to_end(key)
+                self.stats["memo_hits"] += 1
+                return memo[0]
+        url, expiry_time = sign()
+        self._remember(key, url, expiry_time)
+        return url
+
+    def _remember(self, key: Tuple, url: str, expiry_time: Optional[datetime]) -> None:
+        with self._lock:
+            self._memo[key] = (url, expiry_time)
+            self._memo.move_to_end(key)
+            while len(self._memo) > SAS_MEMO_MAX_ENTRIES:
+                self._memo.popitem(last=False)
+
+    def _signing_credential(self, expiry_time: datetime) -> Dict[str, Any]:
+        if self.account_key:
+            return {"account_key": self.account_key}
+        with self._lock:
+            if self._delegation_key is None or self._delegation_key_expiry < expiry_time:
+                # Managed identity: one user delegation key covers every SAS until it expires
+                key_expiry = expiry_time + SAS_EXPIRY
+                self._delegation_key = self.blob_service_client.get_user_delegation_key(
+                    key_start_time=datetime.utcnow() - timedelta(minutes=5),
+                    key_expiry_time=key_expiry
+                )
+                self._delegation_key_expiry = key_expiry
+                self.stats["delegation_keys"] += 1
+            return {"user_delegation_key": self._delegation_key}
+
+    def _sign_blob(self, container_name: str, blob_name: str, expiry: Optional[datetime]) -> Tuple[str, datetime]:
+        expiry_time = expiry or datetime.utcnow() + SAS_EXPIRY
         sas_token = generate_blob_sas(
-            account_name=account_name,
+            account_name=self.account_name,
             container_name=container_name,
             blob_name=blob_name,
-            account_key=account_key,
             permission=BlobSasPermissions(read=True),
-            expiry=expiry_time
+            expiry=expiry_time,
+            **self._signing_credential(expiry_time)
         )
+        with self._lock:
+            self.stats["signed"] += 1
+        return f"{self.blob_url(container_name, blob_name)}?{sas_token}", expiry_time
+
+    def _sign_container(self, container_name: str) -> Tuple[str, datetime]:
+        expiry_time = datetime.utcnow() + SAS_EXPIRY
+        sas_token = generate_container_sas(
+            account_name=self.account_name,
+            container_name=container_name,
+            permission=ContainerSasPermissions(read=True, list=True),
+            expiry=expiry_time,
+            **self._signing_credential(expiry_time)
+        )
+        with self._lock:
+            self.stats["signed"] += 1
+        return f"{self.service_url}/{container_name}?{sas_token}", expiry_time
+
+
+def split_blob_path(blob_path: str) -> Tuple[str, str]:
+    """Split "container/blob" into its parts."""
+    parts = blob_path.split('/', 1)
+    if len(parts) != 2:
+        raise ValueError(f"Invalid blob path: {blob_path}")
+    return parts[0], parts[1]
+
+
+def get_sas_service(environment: str = "staging") -> SasService:
+    """Shared SAS service for an environment."""
+    return get_shared_client("sas", environment, lambda: SasService.for_environment(environment))
+
+
+@hot_path_task
+def generate_sas_url(blob_path_or_url: str, environment: str = "staging") -> str:
+    """
+    Generate a SAS URL for a blob if it doesn't already have one.
+    
+    Args:
+        blob_path_or_url: The path to the blob (container/path) or a URL that may already have a SAS token
+    
+    Returns:
+        str: The SAS URL
+    
+    Note:
+        Thin wrapper around the environment's SasService: an existing SAS is reused while it
+        grants read access and is not about to expire, otherwise a blob-level read SAS is
+        generated. Results are memoized, so validating the same URL again is free.
         
-        # Create the SAS URL
-        sas_url = f"{blob_client.url}?{sas_token}"
-        
-        logger.debug(f"Successfully generated SAS URL: {sanitize_url_for_logging(sas_url)}")
-        logger.debug(f"SAS token permissions: read=True, expiry: {expiry_time.isoformat()}Z")
-        return sas_url
-        
+        Future Implementation Plan:
+        1. Update the Document Intelligence client to use DefaultAzureCredential
+        2. Configure RBAC permissions for the managed identity to access blob storage
+        3. Remove the SAS token generation and use blob URLs directly
+        4. Update the Azure Function App's identity configuration
+    """
+    logger = get_run_logger()
+    
+    try:
+        return get_sas_service(environment).ensure_read_url(blob_path_or_url, logger)
     except Exception as e:
-        logger.error(f"Failed to generate SAS URL for blob '{blob_path}': {str(e)}", exc_info=True)
+        logger.error(f"Failed to generate SAS URL for '{sanitize_url_for_logging(blob_path_or_url)}': {str(e)}", exc_info=True)
         raise
 
 
-@task
-def get_document_intelligence_client(environment: str = "staging") -> DocumentIntelligenceClient:
+def create_document_intelligence_client(environment: str = "staging") -> DocumentIntelligenceClient:
     """
-    Get an authenticated Microsoft Document Intelligence client.
+    Create an authenticated Microsoft Document Intelligence client.
     
     Returns:
         DocumentIntelligenceClient: Authenticated client for Document Intelligence API
@@ -550,17 +2310,31 @@ def get_document_intelligence_client(environment: str = "staging") -> DocumentIn
     logger = get_run_logger()
     
     try:
-        # Try to use endpoint and key from Secret blocks
-        endpoint = Secret.load(f"document-intelligence-endpoint-{environment}").get()
-        key = Secret.load(f"document-intelligence-key-{environment}").get()
+        # Try to use endpoint and key from Secret blocks (cached)
+        endpoint = get_cached_secret(f"document-intelligence-endpoint-{environment}")
+        key = get_cached_secret(f"document-intelligence-key-{environment}")
         logger.info(f"Using Document Intelligence endpoint: {endpoint}")
-        return DocumentIntelligenceClient(endpoint=endpoint, credential=AzureKeyCredential(key))
+        return DocumentIntelligenceClient(endpoint=endpoint, credential=AzureKeyCredential(key), transport=_shared_transport(environment))
     except Exception as e:
         logger.error(f"Failed to create Document Intelligence client: {str(e)}")
         raise
 
 
-@task
+@hot_path_task
+def get_document_intelligence_client(environment: str = "staging") -> DocumentIntelligenceClient:
+    """
+    Get the shared, authenticated Document Intelligence client for an environment.
+    
+    The client is created on first use and reused afterwards (it is thread-safe).
+    """
+    return get_shared_client("document-intelligence", environment, lambda: create_document_intelligence_client(environment))
+
+
+# Resolved model ID per environment, so the Secret lookup (or its fallback) happens once
+_DOCUMENT_INTELLIGENCE_MODEL_IDS: Dict[str, str] = {}
+
+
+@hot_path_task
 def get_document_intelligence_model_id(environment: str = "staging") -> str:
     """
     Get the Document Intelligence model ID to use for analysis.
@@ -568,121 +2342,608 @@ def get_document_intelligence_model_id(environment: str = "staging") -> str:
     Returns:
         The model ID to use (custom model or fallback to prebuilt)
     """
+    if environment in _DOCUMENT_INTELLIGENCE_MODEL_IDS:
+        return _DOCUMENT_INTELLIGENCE_MODEL_IDS[environment]
+    
     logger = get_run_logger()
     
     try:
         # Try to get custom model ID from Secret
-        model_id = Secret.load(f"document-intelligence-model-id-{environment}").get()
+        model_id = get_cached_secret(f"document-intelligence-model-id-{environment}")
         logger.info(f"Using custom Document Intelligence model: {model_id}")
-        return model_id
     except Exception as e:
         # Fall back to default custom model ID
         model_id = "HSP_payslips_beta_03"  # Default custom model for payslips
         logger.info(f"Custom model ID not found in Secret, using default: {model_id}")
-        return model_id
+    _DOCUMENT_INTELLIGENCE_MODEL_IDS[environment] = model_id
+    return model_id
 
 
-@task
-def list_blobs(blob_location: str, environment: str = "staging") -> List[str]:
+# Blob listing
+# Listing pages carry each blob's properties, metadata and index tags (include=metadata,tags),
+# so documents found by listing need no get_blob_properties call later: the listed properties
+# are held here, keyed by (container, blob name), until the document's batch is finalized.
+# Large prefixes are sharded across concurrent walkers, one per top-level virtual directory.
+LISTING_INCLUDE = ["metadata", "tags"]
+LISTING_PAGE_SIZE = 5000     # Results per listing page (the service maximum)
+LISTING_MAX_WALKERS = 8      # Default concurrent walkers when a listing is sharded
+LISTED_BLOBS_MAX_ENTRIES = 50000
+
+_LISTED_BLOBS: "OrderedDict[Tuple[str, str], Any]" = OrderedDict()
+_LISTED_BLOBS_LOCK = threading.Lock()
+_LISTING_DONE = object()
+
+
+def remember_listed_blob(container_name: str, blob) -> None:
+    """Hold a listed blob's properties (and record its tags/metadata/ETag as known state)."""
+    with _LISTED_BLOBS_LOCK:
+        _LISTED_BLOBS[(container_name, blob.name)] = blob
+        while len(_LISTED_BLOBS) > LISTED_BLOBS_MAX_ENTRIES:
+            _LISTED_BLOBS.popitem(last=False)
+    remember_blob_state(container_name, blob.name, tags=getattr(blob, "tags", None), metadata=blob.metadata or {}, etag=blob.etag)
+
+
+def get_listed_blob_properties(document_url: str):
+    """Properties of the blob behind a URL as returned by the listing, or None if it was not listed."""
+    try:
+        key = parse_blob_url(document_url)
+    except ValueError:
+        return None
+    with _LISTED_BLOBS_LOCK:
+        return _LISTED_BLOBS.get(key)
+
+
+def forget_listed_blob(document_url: str) -> None:
+    """Release the listed properties of a document once its batch is done with it."""
+    try:
+        key = parse_blob_url(document_url)
+    except ValueError:
+        return
+    with _LISTED_BLOBS_LOCK:
+        _LISTED_BLOBS.pop(key, None)
+
+
+def iter_listed_blobs(blob_location: str, environment: str = "staging", walkers: int = 1):
     """
-    List all blobs in the specified location.
+    Yield ("container/blob" path, blob properties) for every blob under blob_location as the
+    listing pages arrive. Each blob's properties are also held for later lookup by URL.
+    
+    With walkers > 1 the prefix is walked as a directory, one level deep: blobs directly under it are yielded
+    by the first walker, and each virtual directory is listed by its own concurrent walker.
+    Order across directories is not preserved. A walker's error is raised by the generator.
     
     Args:
-        blob_location: The Azure Blob Storage location (container/path)
-        
-    Returns:
-        List of blob names
+        blob_location: Container/path to list
+        walkers: Concurrent walkers (1 lists the prefix flat, in one sequence of pages)
     """
-    logger = get_run_logger()
-    
-    # Parse container and path from blob_location
     parts = blob_location.strip("/").split("/", 1)
     container_name = parts[0]
     prefix = parts[1] if len(parts) > 1 else ""
+    container_client = get_blob_storage_client(environment).get_container_client(container_name)
     
-    logger.info(f"Listing blobs in container '{container_name}' with prefix '{prefix}'")
+    if walkers <= 1:
+        for blob in container_client.list_blobs(name_starts_with=prefix or None, include=LISTING_INCLUDE, results_per_page=LISTING_PAGE_SIZE):
+            remember_listed_blob(container_name, blob)
+            yield f"{container_name}/{blob.name}", blob
+        return
     
-    blob_service_client = get_blob_storage_client(environment)
-    container_client = blob_service_client.get_container_client(container_name)
+    # Walk the prefix as a directory, so its subdirectories (not the prefix itself) are the shards
+    if prefix and not prefix.endswith("/"):
+        prefix += "/"
+    results = queue.Queue()
+    stop = threading.Event()
+    pending = [1]  # Walkers that have not finished yet (the top-level walker first)
+    pending_lock = threading.Lock()
     
-    blobs = [blob.name for blob in container_client.list_blobs(name_starts_with=prefix)]
-    logger.info(f"Found {len(blobs)} blobs")
+    def finish():
+        with pending_lock:
+            pending[0] -= 1
+            if pending[0] == 0:
+                results.put(_LISTING_DONE)
     
-    return blobs
+    def walk_directory(directory: str):
+        try:
+            for blob in container_client.list_blobs(name_starts_with=directory, include=LISTING_INCLUDE, results_per_page=LISTING_PAGE_SIZE):
+                if stop.is_set():
+                    return
+                results.put(blob)
+        except Exception as e:
+            results.put(e)
+        finally:
+            finish()
+    
+    def walk_top_level(executor: ThreadPoolExecutor):
+        try:
+            for item in container_client.walk_blobs(name_starts_with=prefix or None, include=LISTING_INCLUDE, delimiter="/", results_per_page=LISTING_PAGE_SIZE):
+                if stop.is_set():
+                    return
+                if isinstance(item, BlobPrefix):
+                    with pending_lock:
+                        pending[0] += 1
+                    executor.submit(contextvars.copy_context().run, walk_directory, item.name)
+                else:
+                    results.put(item)
+        except Exception as e:
+            results.put(e)
+        finally:
+            finish()
+    
+    executor = ThreadPoolExecutor(max_workers=walkers, thread_name_prefix="list")
+    try:
+        threading.Thread(target=contextvars.copy_context().run, args=(walk_top_level, executor), daemon=True).start()
+        while True:
+            item = results.get()
+            if item is _LISTING_DONE:
+                return
+            if isinstance(item, Exception):
+                raise item
+            remember_listed_blob(container_name, item)
+            yield f"{container_name}/{item.name}", item
+    finally:
+        stop.set()
+        executor.shutdown(wait=False, cancel_futures=True)
 
 
 @task
-def analyze_document_from_url(document_url: str, environment: str = "staging") -> Dict[str, Any]:
+def list_blobs(blob_location: str, environment: str = "staging", walkers: int = 1) -> List[str]:
     """
-    Analyze a document using Microsoft Document Intelligence directly from a URL.
+    List all blobs in the specified location.
+    
+    Their listed properties are held for the documents' processing (see iter_listed_blobs).
     
     Args:
-        document_url: URL to the document (with SAS token if needed)
+        blob_location: The Azure Blob Storage location (container/path)
+        walkers: Concurrent listing walkers for large prefixes
         
     Returns:
-        Dictionary with extracted fields and confidence scores
-        
-    Note:
-        This implementation uses Document Intelligence with direct URL analysis.
-        Currently, the document URL requires a SAS token for authentication.
-        
-        Future Implementation Plan:
-        1. Update to use Azure Managed Identity for Document Intelligence client authentication
-        2. Configure RBAC permissions for the managed identity to access Document Intelligence
-        3. Configure RBAC permissions for Document Intelligence to access blob storage
-        4. Remove SAS token generation and pass direct blob URLs
+        List of "container/blob" paths
     """
     logger = get_run_logger()
-    logger.info(f"Starting document analysis from URL: {sanitize_url_for_logging(document_url)}")
+    logger.info(f"Listing blobs in '{blob_location}'" + (f" with {walkers} walkers" if walkers > 1 else ""))
+    
+    blobs = [path for path, _ in iter_listed_blobs(blob_location, environment, walkers)]
+    logger.info(f"Found {len(blobs)} blobs")
+    
+    return blobs
+
+
+# Adaptive (AIMD) concurrency for Document Intelligence analyses
+ADAPTIVE_MAX_CONCURRENCY = 32  # Upper bound on in-flight analyses (threaded mode sizes its pool to this)
+ADAPTIVE_DECREASE_FACTOR = 0.5  # Multiplicative cut on throttling or latency spikes
+ADAPTIVE_LATENCY_SPIKE_RATIO = 3.0  # Latency above this multiple of the baseline counts as a spike
+ADAPTIVE_LATENCY_SMOOTHING = 0.2  # Weight of each new sample in the latency baseline (EWMA)
+ADAPTIVE_MIN_LATENCY_SAMPLES = 5  # Samples needed before latency spikes are acted on
+ADAPTIVE_DEFAULT_RETRY_AFTER_SECONDS = 1.0  # Pause when a throttled response carries no Retry-After
+ADAPTIVE_MAX_RETRY_AFTER_SECONDS = 60.0
+THROTTLING_STATUS_CODES = (429, 503)
+
+
+def parse_retry_after(headers) -> Optional[float]:
+    """
+    Read the retry delay in seconds from response headers.
+    
+    Supports the millisecond variants Azure sends (retry-after-ms, x-ms-retry-after-ms)
+    and Retry-After as delta-seconds or an HTTP date.
+    """
+    if not headers:
+        return None
+    
+    for name in ("retry-after-ms", "x-ms-retry-after-ms"):
+        value = headers.get(name)
+        if value:
+            try:
+                return max(0.0, float(value) / 1000)
+            except ValueError:
+                pass
+    
+    value = headers.get("Retry-After") or headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, (retry_at - datetime.now(retry_at.tzinfo)).total_seconds())
+
+
+def get_throttle_details(error: Exception) -> Tuple[Optional[int], Optional[float]]:
+    """Return (HTTP status code, Retry-After seconds) for an Azure error, where available."""
+    status_code = getattr(error, 'status_code', None)
+    response = getattr(error, 'response', None)
+    return status_code, parse_retry_after(getattr(response, 'headers', None))
+
+
+class AdaptiveConcurrencyController:
+    """
+    AIMD limit on concurrent Document Intelligence analyses.
+    
+    While the limit is saturated and latency is healthy it grows by one per round trip
+    (1/limit per completion). HTTP 429/503 or a latency spike cuts it multiplicatively,
+    at most once per round: completions of analyses started before the last cut do not
+    cut again. A Retry-After on a throttled response pauses new acquisitions until it elapses.
+    
+    acquire() blocks a thread (threaded mode); acquire_async() awaits on the event loop
+    (asyncio mode). Every acquire must be paired with release().
+    """
+
+    def __init__(
+        self,
+        initial_limit: int = 3,
+        min_limit: int = 1,
+        max_limit: int = ADAPTIVE_MAX_CONCURRENCY,
+        decrease_factor: float = ADAPTIVE_DECREASE_FACTOR,
+        latency_spike_ratio: float = ADAPTIVE_LATENCY_SPIKE_RATIO,
+        logger=None
+    ):
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit)
+        self.decrease_factor = decrease_factor
+        self.latency_spike_ratio = latency_spike_ratio
+        self.logger = logger
+        self._limit = float(min(max(initial_limit, self.min_limit), self.max_limit))
+        self._in_flight = 0
+        self._round_peak = 0  # Highest in-flight count since the limit last changed
+        self._blocked_until = 0.0
+        self._last_decrease_at = 0.0
+        self._latency_baseline: Optional[float] = None
+        self._latency_samples = 0
+        self._decisions = deque(maxlen=100)
+        self._async_waiters = deque()  # (event loop, future) of coroutines waiting for a slot
+        self._condition = threading.Condition()
+        self._stats = {
+            "acquired": 0, "completed": 0, "errors": 0,
+            "throttled_responses": 0, "throttled_analyses": 0, "latency_spikes": 0,
+            "increases": 0, "decreases": 0, "retry_after_pauses": 0,
+            "wait_seconds": 0.0, "peak_in_flight": 0
+        }
+
+    @property
+    def limit(self) -> int:
+        """Current number of analyses allowed in flight."""
+        return int(self._limit)
+
+    @property
+    def stats(self) -> Dict[str, Any]:
+        """Counters, the current limit and the most recent limit decisions."""
+        with self._condition:
+            stats = dict(self._stats)
+            stats.update(
+                limit=int(self._limit),
+                in_flight=self._in_flight,
+                latency_baseline=self._latency_baseline,
+                decisions=list(self._decisions)
+            )
+            return stats
+
+    def acquire(self) -> float:
+        """Block until a slot is free. Returns the start time to pass to release()."""
+        wait_start = time.time()
+        with self._condition:
+            while True:
+                acquired, timeout = self._try_acquire(time.time())
+                if acquired:
+                    break
+                self._condition.wait(timeout)
+            self._stats["wait_seconds"] += time.time() - wait_start
+        return time.time()
+
+    async def acquire_async(self) -> float:
+        """Wait on the running event loop until a slot is free. Returns the start time."""
+        loop = asyncio.get_running_loop()
+        wait_start = time.time()
+        while True:
+            with self._condition:
+                acquired, timeout = self._try_acquire(time.time())
+                if acquired:
+                    self._stats["wait_seconds"] += time.time() - wait_start
+                    return time.time()
+                waiter = loop.create_future()
+                self._async_waiters.append((loop, waiter))
+            try:
+                await asyncio.wait_for(waiter, timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def release(self, started_at: float, error: Optional[Exception] = None) -> None:
+        """
+        Free a slot and adapt the limit to how the analysis went.
+        
+        Args:
+            started_at: Value returned by acquire()/acquire_async()
+            error: The exception the analysis failed with, if any. Only throttling errors
+                affect the limit; other failures (bad SAS, unreadable document) say nothing
+                about service capacity.
+        """
+        now = time.time()
+        latency = now - started_at
+        status_code, retry_after = get_throttle_details(error) if error is not None else (None, None)
+        
+        with self._condition:
+            self._in_flight -= 1
+            self._stats["completed"] += 1
+            if status_code in THROTTLING_STATUS_CODES:
+                self._stats["throttled_analyses"] += 1
+                delay = self._pause(now, retry_after)
+                self._decrease(started_at, f"HTTP {status_code}, retry after {delay:.1f}s")
+            elif error is not None:
+                self._stats["errors"] += 1
+            else:
+                baseline = self._latency_baseline
+                if (baseline and self._latency_samples >= ADAPTIVE_MIN_LATENCY_SAMPLES
+                        and latency > baseline * self.latency_spike_ratio):
+                    self._stats["latency_spikes"] += 1
+                    self._decrease(started_at, f"latency {latency:.1f}s vs baseline {baseline:.1f}s")
+                else:
+                    self._increase()
+                # Spikes feed the baseline too, so a lasting slowdown becomes the new normal
+                self._record_latency(latency)
+            self._wake_waiters()
+
+    def observe_response(self, pipeline_response) -> None:
+        """
+        raw_response_hook for Azure SDK calls.
+        
+        Sees every HTTP attempt, including 429/503 responses the SDK retries internally
+        and which therefore never reach release() as errors.
+        """
+        http_response = getattr(pipeline_response, 'http_response', None)
+        status_code = getattr(http_response, 'status_code', None)
+        if status_code not in THROTTLING_STATUS_CODES:
+            return
+        
+        now = time.time()
+        with self._condition:
+            self._stats["throttled_responses"] += 1
+            delay = self._pause(now, parse_retry_after(getattr(http_response, 'headers', None)))
+            # The throttled request started roughly one round trip ago
+            self._decrease(now - (self._latency_baseline or 1.0), f"HTTP {status_code} (SDK retry), retry after {delay:.1f}s")
+
+    def _try_acquire(self, now: float) -> Tuple[bool, Optional[float]]:
+        """Take a slot if one is free (lock held). Otherwise return how long to wait (None: until woken)."""
+        if now < self._blocked_until:
+            return False, self._blocked_until - now
+        if self._in_flight >= int(self._limit):
+            return False, None
+        self._in_flight += 1
+        self._stats["acquired"] += 1
+        self._stats["peak_in_flight"] = max(self._stats["peak_in_flight"], self._in_flight)
+        self._round_peak = max(self._round_peak, self._in_flight)
+        return True, None
+
+    def _pause(self, now: float, retry_after: Optional[float]) -> float:
+        delay = min(ADAPTIVE_MAX_RETRY_AFTER_SECONDS, retry_after if retry_after is not None else ADAPTIVE_DEFAULT_RETRY_AFTER_SECONDS)
+        if now + delay > self._blocked_until:
+            self._blocked_until = now + delay
+            self._stats["retry_after_pauses"] += 1
+        return delay
+
+    def _decrease(self, started_at: float, reason: str) -> None:
+        if started_at < self._last_decrease_at:
+            return  # Already cut for this round
+        self._last_decrease_at = time.time()
+        self._limit = max(float(self.min_limit), self._limit * self.decrease_factor)
+        self._round_peak = self._in_flight
+        self._stats["decreases"] += 1
+        self._record_decision("decrease", reason)
+
+    def _increase(self) -> None:
+        previous = int(self._limit)
+        if self._round_peak < previous or self._limit >= self.max_limit:
+            return  # Only grow a limit that is actually being used
+        self._limit = min(float(self.max_limit), self._limit + 1.0 / previous)
+        if int(self._limit) > previous:
+            self._round_peak = self._in_flight
+            self._stats["increases"] += 1
+            self._record_decision("increase", f"healthy latency ({self._latency_baseline or 0:.1f}s baseline)")
+
+    def _record_latency(self, latency: float) -> None:
+        if self._latency_baseline is None:
+            self._latency_baseline = latency
+        else:
+            self._latency_baseline += ADAPTIVE_LATENCY_SMOOTHING * (latency - self._latency_baseline)
+        self._latency_samples += 1
+
+    def _record_decision(self, action: str, reason: str) -> None:
+        self._decisions.append({
+            "time": time.time(),
+            "action": action,
+            "limit": int(self._limit),
+            "in_flight": self._in_flight,
+            "reason": reason
+        })
+        if self.logger:
+            self.logger.info(f"Analysis concurrency {action}d to {int(self._limit)}: {reason}")
+
+    def _wake_waiters(self) -> None:
+        """Wake waiting threads and as many waiting coroutines as there are free slots (lock held)."""
+        self._condition.notify_all()
+        free_slots = int(self._limit) - self._in_flight
+        while free_slots > 0 and self._async_waiters:
+            loop, waiter = self._async_waiters.popleft()
+            if waiter.done():
+                continue  # Timed out waiting for a Retry-After pause
+            loop.call_soon_threadsafe(_resolve_waiter, waiter)
+            free_slots -= 1
+
+
+def _resolve_waiter(waiter) -> None:
+    if not waiter.done():
+        waiter.set_result(None)
+
+
+_CONCURRENCY_CONTROLLERS: Dict[Tuple[str, Optional[str]], AdaptiveConcurrencyController] = {}
+_CONCURRENCY_CONTROLLERS_LOCK = threading.Lock()
+
+
+def open_concurrency_controller(environment: str, message_id: Optional[str], **kwargs) -> AdaptiveConcurrencyController:
+    """Get (or create) the adaptive concurrency controller for a batch."""
+    with _CONCURRENCY_CONTROLLERS_LOCK:
+        controller = _CONCURRENCY_CONTROLLERS.get((environment, message_id))
+        if controller is None:
+            controller = AdaptiveConcurrencyController(**kwargs)
+            _CONCURRENCY_CONTROLLERS[(environment, message_id)] = controller
+        return controller
+
+
+def get_concurrency_controller(environment: str, message_id: Optional[str]) -> Optional[AdaptiveConcurrencyController]:
+    """Return the batch's adaptive concurrency controller, if any."""
+    with _CONCURRENCY_CONTROLLERS_LOCK:
+        return _CONCURRENCY_CONTROLLERS.get((environment, message_id))
+
+
+def close_concurrency_controller(environment: str, message_id: Optional[str]) -> Optional[Dict[str, Any]]:
+    """Remove a batch's controller. Returns its final statistics."""
+    with _CONCURRENCY_CONTROLLERS_LOCK:
+        controller = _CONCURRENCY_CONTROLLERS.pop((environment, message_id), None)
+    return controller.stats if controller is not None else None
+
+
+def analyze_request_args(document_url: str, content: Optional[bytes] = None) -> Tuple[Tuple, Dict[str, Any]]:
+    """
+    Body arguments (positional, keyword) for begin_analyze_document.
+    
+    With content, the bytes are sent as a binary body (a read-only view of the page, with no
+    base64 copy); otherwise Document Intelligence fetches the document from its URL.
+    """
+    if content is not None:
+        return (io.BytesIO(content),), {"content_type": "application/octet-stream"}
+    return (AnalyzeDocumentRequest(url_source=document_url),), {}
+
+
+def analysis_response_hook(controller: Optional["AdaptiveConcurrencyController"] = None):
+    """raw_response_hook for analyses: counts responses (and throttling) and feeds the controller, if any."""
+    def hook(response) -> None:
+        count_http_response("document_intelligence", response)
+        if controller:
+            controller.observe_response(response)
+    return hook
+
+
+def run_document_analysis(
+    client,
+    model_id: str,
+    body_args: Tuple,
+    body_kwargs: Dict[str, Any],
+    environment: str = "staging",
+    message_id: Optional[str] = None
+):
+    """
+    Submit one analysis and wait for its result.
+    
+    Holds a slot of the batch's adaptive concurrency controller (if any) for the duration
+    and reports the outcome to it.
+    """
+    controller = get_concurrency_controller(environment, message_id)
+    started_at = controller.acquire() if controller else None
+    try:
+        body_kwargs = dict(body_kwargs, raw_response_hook=analysis_response_hook(controller))
+        with trace_stage("di_submit", model=model_id):
+            poller = client.begin_analyze_document(model_id, *body_args, **body_kwargs)
+        with trace_stage("di_poll", model=model_id):
+            result = poller.result()
+    except Exception as e:
+        if controller:
+            controller.release(started_at, error=e)
+        raise
+    if controller:
+        controller.release(started_at)
+    return result
+
+
+@hot_path_task
+def analyze_document_from_url(document_url: str, environment: str = "staging", message_id: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Analyze a document using Microsoft Document Intelligence directly from a URL.
+    
+    Args:
+        document_url: URL to the document (with SAS token if needed)
+        message_id: Batch ID; when the batch has an adaptive concurrency controller the
+            analysis waits for one of its slots and reports throttling back to it
+        
+    Returns:
+        Dictionary with extracted fields and confidence scores
+        
+    Note:
+        This implementation uses Document Intelligence with direct URL analysis.
+        Currently, the document URL requires a SAS token for authentication.
+        
+        Future Implementation Plan:
+        1. Update to use Azure Managed Identity for Document Intelligence client authentication
+        2. Configure RBAC permissions for the managed identity to access Document Intelligence
+        3. Configure RBAC permissions for Document Intelligence to access blob storage
+        4. Remove SAS token generation and pass direct blob URLs
+    """
+    logger = get_run_logger()
+    event_log = get_document_event_log(environment, message_id)
+    verbose = event_log.verbose
+    if verbose:
+        logger.info(f"Starting document analysis from URL: {sanitize_url_for_logging(document_url)}")
     
     try:
         client = get_document_intelligence_client(environment)
         model_id = get_document_intelligence_model_id(environment)
         
-        logger.info(f"Using Document Intelligence model: {model_id}")
-        logger.info(f"Document Intelligence environment: {environment}")
-        
-        # Analyze the document directly from URL
-        logger.info("Initiating Document Intelligence analysis...")
-        poller = client.begin_analyze_document(
-            model_id,
-            AnalyzeDocumentRequest(url_source=document_url)
-        )
+        if verbose:
+            logger.info(f"Using Document Intelligence model: {model_id}")
+            logger.info(f"Document Intelligence environment: {environment}")
         
-        logger.info("Waiting for Document Intelligence analysis to complete...")
-        result = poller.result()
+        # Split pages still in memory are sent as bytes; otherwise analyze directly from URL
+        page = get_split_page(document_url)
+        page_data = page.data if page else None
+        if page and page_data is None:
+            page.wait_for_upload()
         
-        logger.info(f"Document Intelligence analysis completed successfully with model: {model_id}")
+        if verbose:
+            logger.info("Initiating Document Intelligence analysis..." + (" (from memory)" if page_data is not None else ""))
+        body_args, body_kwargs = analyze_request_args(document_url, page_data)
+        result = run_document_analysis(client, model_id, body_args, body_kwargs, environment, message_id)
+        if page:
+            release_split_page_data(page)
         
         # Log raw Document Intelligence result structure for debugging
-        logger.info("Document Intelligence analysis result received")
+        if verbose:
+            logger.info(f"Document Intelligence analysis completed successfully with model: {model_id}")
+            logger.info("Document Intelligence analysis result received")
         if hasattr(result, 'documents') and result.documents:
-            logger.info(f"Number of documents detected: {len(result.documents)}")
             doc = result.documents[0]
             if hasattr(doc, 'fields'):
-                raw_fields = list(doc.fields.keys()) if doc.fields else []
-                logger.info(f"Raw fields detected by Document Intelligence: {raw_fields}")
+                if verbose:
+                    logger.info(f"Number of documents detected: {len(result.documents)}")
+                    raw_fields = list(doc.fields.keys()) if doc.fields else []
+                    logger.info(f"Raw fields detected by Document Intelligence: {raw_fields}")
             else:
                 logger.warning("No fields attribute found in document result")
         else:
             logger.warning("No documents found in Document Intelligence result")
         
         # Extract payslip fields from the result
-        logger.info("Extracting payslip fields from analysis result...")
-        extracted_data = extract_payslip_fields(result)
-        
-        # Enhanced extraction summary with field details
-        extracted_fields = [k for k, v in extracted_data.items() if v is not None and not k.endswith('_confidence')]
-        logger.info(f"Successfully extracted {len(extracted_fields)} fields: {extracted_fields}")
-        
-        # Log each extracted field with its value and confidence
-        for field_name, value in extracted_data.items():
-            if not field_name.endswith('_confidence') and value is not None:
-                confidence_key = f"{field_name}_confidence"
-                confidence = extracted_data.get(confidence_key, 0.0)
-                logger.info(f"  {field_name}: '{value}' (confidence: {confidence:.2f})")
-        
-        logger.info(f"Complete extracted data: {extracted_data}")
+        if verbose:
+            logger.info("Extracting payslip fields from analysis result...")
+        extracted_data = extract_payslip_fields(result, verbose=verbose)
+        
+        if verbose:
+            # Enhanced extraction summary with field details
+            extracted_fields = [k for k, v in extracted_data.items() if v is not None and not k.endswith('_confidence')]
+            logger.info(f"Successfully extracted {len(extracted_fields)} fields: {extracted_fields}")
+            
+            # Log each extracted field with its value and confidence
+            for field_name, value in extracted_data.items():
+                if not field_name.endswith('_confidence') and value is not None:
+                    confidence_key = f"{field_name}_confidence"
+                    confidence = extracted_data.get(confidence_key, 0.0)
+                    logger.info(f"  {field_name}: '{value}' (confidence: {confidence:.2f})")
+            
+            logger.info(f"Complete extracted data: {extracted_data}")
+        else:
+            event_log.event(
+                logger, "document_analyzed", url=sanitize_url_for_logging(document_url), model_id=model_id,
+                from_memory=page_data is not None, documents=len(result.documents or []) if hasattr(result, 'documents') else 0,
+                confidences={k[:-len('_confidence')]: v for k, v in extracted_data.items() if k.endswith('_confidence')}
+            )
         
         return extracted_data
         
@@ -711,13 +2972,15 @@ def analyze_document_from_url(document_url: str, environment: str = "staging") -
         raise
 
 
-@task
-def extract_payslip_fields(result) -> Dict[str, Any]:
+@hot_path_task
+def extract_payslip_fields(result, document_index: int = 0, verbose: bool = True) -> Dict[str, Any]:
     """
     Extract payslip fields directly from the custom model's analysis result.
     
     Args:
         result: The Document Intelligence analysis result
+        document_index: Which analyzed document to read (multipage results hold one per payslip)
+        verbose: Log each field (False in the structured log mode; warnings are still logged)
         
     Returns:
         Dictionary with extracted fields and confidence scores
@@ -735,13 +2998,16 @@ def extract_payslip_fields(result) -> Dict[str, Any]:
     }
     
     # Extract fields directly from the custom model result
-    logger.info("Starting field extraction from Document Intelligence result")
-    if hasattr(result, 'documents') and result.documents:
-        doc = result.documents[0]  # Get the first document
-        logger.info(f"Processing document 1 of {len(result.documents)}")
+    if verbose:
+        logger.info("Starting field extraction from Document Intelligence result")
+    if hasattr(result, 'documents') and len(result.documents or []) > document_index:
+        doc = result.documents[document_index]
+        if verbose:
+            logger.info(f"Processing document {document_index + 1} of {len(result.documents)}")
         if hasattr(doc, 'fields'):
             fields = doc.fields
-            logger.info(f"Document has {len(fields)} fields available for extraction")
+            if verbose:
+                logger.info(f"Document has {len(fields)} fields available for extraction")
             
             # Standardized field mapping between Document Intelligence model and application
             # Model fields -> Application fields
@@ -755,28 +3021,32 @@ def extract_payslip_fields(result) -> Dict[str, Any]:
                 "pay_cycle": "pay_cycle"
             }
             
-            logger.info("Processing field mappings...")
+            if verbose:
+                logger.info("Processing field mappings...")
             for model_field, payslip_field in field_mapping.items():
                 if model_field in fields and fields[model_field] is not None:
                     field = fields[model_field]
-                    logger.info(f"Found field '{model_field}' in Document Intelligence result")
+                    if verbose:
+                        logger.info(f"Found field '{model_field}' in Document Intelligence result")
                     if hasattr(field, 'content') and field.content:
                         payslip_data[payslip_field]["value"] = field.content
                         # Use the confidence from the model if available
                         if hasattr(field, 'confidence'):
                             payslip_data[payslip_field]["confidence"] = field.confidence
-                            logger.info(f"  Extracted {payslip_field}: '{field.content}' (confidence: {field.confidence:.2f})")
-                        else:
+                            if verbose:
+                                logger.info(f"  Extracted {payslip_field}: '{field.content}' (confidence: {field.confidence:.2f})")
+                        elif verbose:
                             logger.info(f"  Extracted {payslip_field}: '{field.content}' (no confidence score)")
-                    else:
+                    elif verbose:
                         logger.info(f"  Field '{model_field}' found but has no content")
-                else:
+                elif verbose:
                     logger.debug(f"Field '{model_field}' not found in Document Intelligence result")
             
             # Log any additional fields that weren't in our mapping
-            unmapped_fields = [f for f in fields.keys() if f not in field_mapping.keys()]
-            if unmapped_fields:
-                logger.info(f"Additional unmapped fields found in Document Intelligence result: {unmapped_fields}")
+            if verbose:
+                unmapped_fields = [f for f in fields.keys() if f not in field_mapping.keys()]
+                if unmapped_fields:
+                    logger.info(f"Additional unmapped fields found in Document Intelligence result: {unmapped_fields}")
         else:
             logger.warning("Document has no fields attribute - extraction failed")
     else:
@@ -791,128 +3061,1388 @@ def extract_payslip_fields(result) -> Dict[str, Any]:
     return flat_data
 
 
-@task
-def find_matching_employees(employee_name: str, employee_id: Optional[str], tenant_id: str, environment: str = "staging") -> List[Dict[str, Any]]:
+# Document Intelligence result cache
+# Extracted fields are cached per (model, blob content hash), so reprocessed or re-uploaded
+# payslips skip the analysis. Content-MD5 is used when the blob has one; otherwise the key is
+# the blob's path, ETag and size (any overwrite changes the ETag), so keying a document never
+# downloads it.
+DOCUMENT_RESULT_CACHE_TTL_SECONDS = 30 * 24 * 3600
+DOCUMENT_RESULT_CACHE_MAX_BYTES = 256 * 1024 * 1024  # Disk backend
+DOCUMENT_RESULT_CACHE_MAX_ROWS = 100000  # Postgres backend
+DOCUMENT_RESULT_CACHE_EVICTION_INTERVAL = 200  # Writes between eviction passes
+DOCUMENT_RESULT_CACHE_EVICTION_BATCH = 1000  # Rows deleted per eviction statement (Postgres backend)
+
+
+def blob_content_digest(blob_properties, blob_reference: Optional[str] = None) -> Optional[str]:
     """
-    Find matching employees in the database using optimized query with CTE.
+    Content key of a blob from its properties alone: its Content-MD5, or its path, ETag and size.
     
     Args:
-        employee_name: The employee name to match
-        employee_id: The employee ID to match (optional)
-        tenant_id: The tenant ID
-        environment: The environment (staging/production)
+        blob_properties: Properties from get_blob_properties() (or the listing)
+        blob_reference: "container/blob" path, used when there is no Content-MD5
         
     Returns:
-        List of matching employee records
-        
-    Performance Notes:
-        - Uses CTE to compute name variations once
-        - Leverages index on (tenant_id, employee_identifier, name)
-        - Returns only essential fields to caller
-        - Exact match optimization for employee_identifier
+        "md5:<hex>" / "etag:<path>:<etag>:<size>", or None if neither is available
     """
-    logger = get_run_logger()
+    content_settings = getattr(blob_properties, 'content_settings', None)
+    content_md5 = getattr(content_settings, 'content_md5', None)
+    if content_md5:
+        return f"md5:{bytes(content_md5).hex()}"
+    etag = (getattr(blob_properties, 'etag', None) or '').strip('"')
+    if blob_reference is None or not etag:
+        return None
+    return f"etag:{blob_reference}:{etag}:{getattr(blob_properties, 'size', '')}"
+
+
+def split_page_digest(page) -> str:
+    """
+    Content digest of an in-memory split page.
     
-    conn = get_db_connection(environment)
-    cursor = conn.cursor()
+    MD5, so it matches the Content-MD5 storage records for the uploaded page blob and the
+    same cache entry is found whether the page is analyzed from memory or from its URL.
+    """
+    return f"md5:{hashlib.md5(page.data).hexdigest()}"
+
+
+class DiskResultCacheBackend:
+    """
+    Stores cached results as JSON files, evicting expired then least recently used entries.
     
-    try:
-        if employee_id:
-            # Optimized: employee_identifier match uses index (tenant_id, employee_identifier)
-            logger.info(f"Searching for employee with ID '{employee_id}' in tenant '{tenant_id}'")
-            query = """
-            SELECT id, name, last_name, other_name, preferred_name, employee_identifier
-            FROM employee_profiles
-            WHERE tenant_id = %s 
-              AND employee_identifier = %s 
-              AND "deletedAt" IS NULL
+    Reads touch the file's mtime, so eviction order follows last use. The directory must be
+    given explicitly: the cache is meant to outlive the process, which a temp directory
+    does not guarantee.
+    """
+
+    def __init__(self, directory: str, max_bytes: int = DOCUMENT_RESULT_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._writes = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        name = hashlib.sha256(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, name[:2], f"{name}.json")
+
+    def get(self, key: str, ttl_seconds: float) -> Optional[Dict[str, Any]]:
+        path = self._path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if entry.get("key") != key or time.time() - entry.get("created_at", 0) > ttl_seconds:
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return entry.get("data")
+
+    def put(self, key: str, data: Dict[str, Any], ttl_seconds: float) -> None:
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write to a temporary file first so concurrent readers never see a partial entry
+        temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump({"key": key, "created_at": time.time(), "data": data}, f)
+        os.replace(temp_path, path)
+        
+        with self._lock:
+            self._writes += 1
+            evict = self._writes % DOCUMENT_RESULT_CACHE_EVICTION_INTERVAL == 1
+        if evict:
+            self.evict(ttl_seconds)
+
+    def evict(self, ttl_seconds: float) -> int:
+        """Remove expired entries, then the least recently used until under max_bytes."""
+        now = time.time()
+        entries = []
+        removed = 0
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                # Hits touch the mtime, so an entry untouched for a whole TTL has certainly expired
+                if now - stat.st_mtime > ttl_seconds or name.endswith('.tmp') and now - stat.st_mtime > 3600:
+                    removed += self._remove(path)
+                else:
+                    entries.append((stat.st_mtime, stat.st_size, path))
+        
+        total_bytes = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total_bytes <= self.max_bytes:
+                break
+            removed += self._remove(path)
+            total_bytes -= size
+        return removed
+
+    @staticmethod
+    def _remove(path: str) -> int:
+        try:
+            os.remove(path)
+            return 1
+        except OSError:
+            return 0
+
+
+class PostgresResultCacheBackend:
+    """
+    Stores cached results in the document_analysis_cache table (migrations/document_analysis_cache.sql),
+    evicting expired then least recently used rows.
+    """
+
+    def __init__(self, environment: str = "staging", max_rows: int = DOCUMENT_RESULT_CACHE_MAX_ROWS):
+        self.environment = environment
+        self.max_rows = max_rows
+        self._writes = 0
+        self._lock = threading.Lock()
+
+    def _execute(self, query: str, params: Tuple = (), fetch: bool = False):
+        """Run one statement in its own transaction. Returns the first row if fetch, else the row count."""
+        conn = get_db_connection(self.environment)
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(query, params)
+                result = cursor.fetchone() if fetch else cursor.rowcount
+            conn.commit()
+            return result
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+    def get(self, key: str, ttl_seconds: float) -> Optional[Dict[str, Any]]:
+        row = self._execute(
             """
-            cursor.execute(query, (tenant_id, employee_id))
-            
-            columns = [col[0] for col in cursor.description]
-            results = [dict(zip(columns, row)) for row in cursor.fetchall()]
-            
-            if results:
-                logger.info(f"Found {len(results)} employee(s) matching ID '{employee_id}'")
-                return results
+            UPDATE document_analysis_cache SET "lastHitAt" = CURRENT_TIMESTAMP
+            WHERE cache_key = %s AND "createdAt" > CURRENT_TIMESTAMP - make_interval(secs => %s)
+            RETURNING extracted_data
+            """,
+            (key, ttl_seconds),
+            fetch=True
+        )
+        return row[0] if row else None
+
+    def put(self, key: str, data: Dict[str, Any], ttl_seconds: float) -> None:
+        self._execute(
+            """
+            INSERT INTO document_analysis_cache (cache_key, extracted_data)
+            VALUES (%s, %s::jsonb)
+            ON CONFLICT (cache_key) DO UPDATE SET
+                extracted_data = EXCLUDED.extracted_data,
+                "createdAt" = CURRENT_TIMESTAMP,
+                "lastHitAt" = CURRENT_TIMESTAMP
+            """,
+            (key, json.dumps(data))
+        )
         
-        # If no employee ID or no match by ID, try to match by name
-        if not employee_name or not employee_name.strip():
-            logger.warning("No employee name provided for matching")
-            return []
-            
-        logger.info(f"Searching for employee with name '{employee_name}' in tenant '{tenant_id}'")
+        with self._lock:
+            self._writes += 1
+            evict = self._writes % DOCUMENT_RESULT_CACHE_EVICTION_INTERVAL == 1
+        if evict:
+            self.evict(ttl_seconds)
+
+    def evict(self, ttl_seconds: float) -> int:
+        """
+        Delete expired rows, then the least recently used beyond max_rows.
         
-        # Prepare search pattern - normalize to lowercase for consistent matching
-        search_pattern = employee_name.strip().lower()
-        logger.info(f"Normalized search pattern: '{search_pattern}'")
+        Each statement deletes at most DOCUMENT_RESULT_CACHE_EVICTION_BATCH rows found through
+        the "lastHitAt" index, so a pass never sorts or locks the whole table; anything left
+        over is picked up by the next pass.
+        """
+        # A row not hit for a whole TTL has certainly expired ("createdAt" <= "lastHitAt")
+        removed = self._execute(
+            """
+            DELETE FROM document_analysis_cache
+            WHERE cache_key IN (
+                SELECT cache_key FROM document_analysis_cache
+                WHERE "lastHitAt" < CURRENT_TIMESTAMP - make_interval(secs => %s)
+                LIMIT %s
+            )
+            """,
+            (ttl_seconds, DOCUMENT_RESULT_CACHE_EVICTION_BATCH)
+        )
         
-        # Optimized query using CTE to compute name variations once
-        # This avoids redundant CONCAT operations in WHERE and ORDER BY
-        query = """
-        WITH name_variants AS (
-            SELECT 
-                id, 
-                name, 
-                last_name, 
-                other_name, 
-                preferred_name, 
-                employee_identifier,
-                -- Compute all name variations once in CTE
-                LOWER(TRIM(CONCAT(COALESCE(name, ''), ' ', COALESCE(other_name, ''), ' ', COALESCE(last_name, '')))) as name_western,
-                LOWER(TRIM(CONCAT(COALESCE(last_name, ''), ' ', COALESCE(name, ''), ' ', COALESCE(other_name, '')))) as name_reverse,
-                LOWER(TRIM(CONCAT(COALESCE(last_name, ''), ', ', COALESCE(name, ''), ' ', COALESCE(other_name, '')))) as name_comma,
-                LOWER(TRIM(CONCAT(COALESCE(name, ''), ' ', COALESCE(last_name, '')))) as name_simple,
-                -- Add variations WITHOUT middle name (other_name) for payslips that don't include middle names
-                LOWER(TRIM(CONCAT(COALESCE(name, ''), ' ', COALESCE(last_name, '')))) as name_western_no_middle,
-                LOWER(TRIM(CONCAT(COALESCE(last_name, ''), ' ', COALESCE(name, '')))) as name_reverse_no_middle,
-                LOWER(COALESCE(preferred_name, '')) as name_preferred,
-                LOWER(COALESCE(name, '')) as name_first,
-                LOWER(COALESCE(last_name, '')) as name_last,
-                LOWER(COALESCE(other_name, '')) as name_other
-            FROM employee_profiles
-            WHERE tenant_id = %s 
-              AND "deletedAt" IS NULL
+        # The planner's row estimate is free; only an apparently full table looks up the cutoff
+        estimate = self._execute(
+            "SELECT reltuples::bigint FROM pg_class WHERE oid = 'document_analysis_cache'::regclass",
+            fetch=True
         )
-        SELECT 
-            id, 
-            name, 
-            last_name, 
-            other_name, 
-            preferred_name, 
-            employee_identifier
-        FROM name_variants
-        WHERE 
-            -- Exact matches (no wildcards = faster comparison)
-            name_western = %s
-            OR name_reverse = %s
-            OR name_comma = %s
-            OR name_simple = %s
-            OR name_western_no_middle = %s
-            OR name_reverse_no_middle = %s
-            OR (name_preferred != '' AND name_preferred = %s)
-            -- Partial matches as fallback
-            OR name_first = %s
-            OR name_last = %s
-            OR name_other = %s
-        ORDER BY 
-            CASE 
-                -- Prioritize exact full name matches (with or without middle name)
-                WHEN name_western = %s THEN 1
-                WHEN name_reverse = %s THEN 1
-                WHEN name_comma = %s THEN 1
-                WHEN name_simple = %s THEN 1
-                WHEN name_western_no_middle = %s THEN 1
-                WHEN name_reverse_no_middle = %s THEN 1
-                -- Then preferred name
-                WHEN name_preferred = %s THEN 2
-                -- Then partial matches
-                WHEN name_first = %s THEN 3
-                WHEN name_last = %s THEN 3
-                WHEN name_other = %s THEN 3
-                ELSE 4
-            END,
-            name
+        if not estimate or estimate[0] <= self.max_rows:
+            return removed
+        removed += self._execute(
+            """
+            DELETE FROM document_analysis_cache
+            WHERE cache_key IN (
+                SELECT cache_key FROM document_analysis_cache
+                WHERE "lastHitAt" < (
+                    SELECT "lastHitAt" FROM document_analysis_cache
+                    ORDER BY "lastHitAt" DESC
+                    OFFSET %s LIMIT 1
+                )
+                LIMIT %s
+            )
+            """,
+            (self.max_rows, DOCUMENT_RESULT_CACHE_EVICTION_BATCH)
+        )
+        return removed
+
+
+class DocumentResultCache:
+    """
+    Caches extract_payslip_fields output per (model ID, content digest) for one batch.
+    
+    Identical files within the batch are analyzed once: the first document to claim()
+    a key analyzes it, and the others wait for its result instead of calling
+    Document Intelligence themselves.
+    """
+
+    def __init__(self, backend, model_id: str, ttl_seconds: float = DOCUMENT_RESULT_CACHE_TTL_SECONDS, logger=None):
+        self.backend = backend
+        self.model_id = model_id
+        self.ttl_seconds = ttl_seconds
+        self.logger = logger or get_run_logger()
+        self.stats = {"hits": 0, "misses": 0, "deduplicated": 0, "stores": 0, "errors": 0}
+        self._in_flight: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+
+    def key_for(self, content_digest: Optional[str]) -> Optional[str]:
+        """Cache key for a content digest (None when the content could not be hashed)."""
+        return f"{self.model_id}:{content_digest}" if content_digest else None
+
+    def claim(self, key: str) -> Tuple[bool, Future]:
+        """
+        Register interest in a key.
+        
+        Returns:
+            (True, future) if the caller owns the key and must call resolve() with the
+            result or error; (False, future) if another document is already producing it
+        """
+        with self._lock:
+            future = self._in_flight.get(key)
+            if future is not None:
+                self.stats["deduplicated"] += 1
+                return False, future
+            future = Future()
+            self._in_flight[key] = future
+            return True, future
+
+    def resolve(self, key: str, extracted_data: Optional[Dict[str, Any]] = None, error: Optional[Exception] = None) -> None:
+        """Publish the owner's result (or failure) to documents waiting on the key."""
+        with self._lock:
+            future = self._in_flight.pop(key, None)
+        if future is None:
+            return
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(dict(extracted_data))
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Stored extraction for a key, or None. Backend errors count as misses."""
+        try:
+            extracted_data = self.backend.get(key, self.ttl_seconds)
+        except Exception as e:
+            extracted_data = None
+            with self._lock:
+                self.stats["errors"] += 1
+            self.logger.warning(f"Analysis cache lookup failed: {str(e)}")
+        with self._lock:
+            self.stats["hits" if extracted_data is not None else "misses"] += 1
+        return extracted_data
+
+    def put(self, key: str, extracted_data: Dict[str, Any]) -> None:
+        """Store an extraction. Failures are logged and otherwise ignored."""
+        try:
+            self.backend.put(key, extracted_data, self.ttl_seconds)
+            with self._lock:
+                self.stats["stores"] += 1
+        except Exception as e:
+            with self._lock:
+                self.stats["errors"] += 1
+            self.logger.warning(f"Analysis cache store failed: {str(e)}")
+
+
+def create_result_cache_backend(backend: str, environment: str = "staging"):
+    """Create a cache backend from its spec ("disk:<directory>" or "postgres")."""
+    if backend == "postgres":
+        return PostgresResultCacheBackend(environment)
+    if backend.startswith("disk"):
+        directory = backend[len("disk:"):] if backend.startswith("disk:") else ""
+        if not directory:
+            raise ValueError("The disk result cache needs an explicit directory: result_cache='disk:<directory>'")
+        return DiskResultCacheBackend(directory)
+    raise ValueError(f"Unknown result cache backend '{backend}' (expected 'disk:<directory>' or 'postgres')")
+
+
+_DOCUMENT_RESULT_CACHES: Dict[Tuple[str, Optional[str]], DocumentResultCache] = {}
+_DOCUMENT_RESULT_CACHES_LOCK = threading.Lock()
+
+
+def open_document_result_cache(environment: str, message_id: Optional[str], backend: str, model_id: str) -> DocumentResultCache:
+    """Get (or create) the analysis result cache for a batch."""
+    with _DOCUMENT_RESULT_CACHES_LOCK:
+        cache = _DOCUMENT_RESULT_CACHES.get((environment, message_id))
+        if cache is None:
+            cache = DocumentResultCache(create_result_cache_backend(backend, environment), model_id)
+            _DOCUMENT_RESULT_CACHES[(environment, message_id)] = cache
+        return cache
+
+
+def get_document_result_cache(environment: str, message_id: Optional[str]) -> Optional[DocumentResultCache]:
+    """Return the batch's analysis result cache, if any."""
+    with _DOCUMENT_RESULT_CACHES_LOCK:
+        return _DOCUMENT_RESULT_CACHES.get((environment, message_id))
+
+
+def close_document_result_cache(environment: str, message_id: Optional[str]) -> Optional[Dict[str, int]]:
+    """Remove a batch's result cache. Returns its statistics."""
+    with _DOCUMENT_RESULT_CACHES_LOCK:
+        cache = _DOCUMENT_RESULT_CACHES.pop((environment, message_id), None)
+    return dict(cache.stats) if cache is not None else None
+
+
+def analyze_with_result_cache(cache: DocumentResultCache, cache_key: str, analyze) -> Dict[str, Any]:
+    """
+    Return the cached extraction for cache_key, or run analyze() and cache its result.
+    
+    Identical documents in the batch wait for the first one's analysis instead of
+    starting their own.
+    """
+    owner, future = cache.claim(cache_key)
+    if not owner:
+        return dict(future.result())
+    
+    try:
+        extracted_data = cache.get(cache_key)
+        if extracted_data is None:
+            extracted_data = analyze()
+            cache.put(cache_key, extracted_data)
+    except Exception as e:
+        cache.resolve(cache_key, error=e)
+        raise
+    cache.resolve(cache_key, extracted_data)
+    return extracted_data
+
+
+# Batch progress ledger
+# With checkpoint=True every document's completed stages (split, analyzed, matched, saved,
+# renamed) are recorded per message_id, keyed by clean blob URL and the blob's ETag. A rerun
+# of the same batch loads the ledger and resumes: split PDFs are not downloaded or split again,
+# analyzed documents reuse their recorded extraction, and saved documents return their recorded
+# result without any Document Intelligence call. A changed ETag (re-uploaded file) discards the
+# document's earlier stages. Records are written behind, like matching results: queued, and
+# flushed in multi-row upserts when LEDGER_FLUSH_BATCH_SIZE are pending or the oldest has
+# waited LEDGER_FLUSH_INTERVAL_SECONDS. The table is created by migrations/payslip_batch_progress.sql.
+LEDGER_STAGES = ("split", "analyzed", "matched", "saved", "renamed")
+LEDGER_FLUSH_BATCH_SIZE = 200
+LEDGER_FLUSH_INTERVAL_SECONDS = 2.0
+
+
+class BatchProgressLedger:
+    """
+    Completed stages per document of one batch, stored in the payslip_batch_progress table
+    and mirrored in memory.
+    
+    Each entry holds the document's ETag, its completed stages and the data needed to skip
+    them (page URLs of a split source, the extraction, the saved record ID and match status).
+    record() updates the mirror at once and queues the write; a background thread flushes
+    the queue, and close() flushes what is left.
+    """
+
+    # A new ETag replaces the entry; the same (or an unknown) ETag adds stages and data
+    UPSERT_QUERY = """
+    INSERT INTO payslip_batch_progress (message_id, file_reference, etag, stages, data)
+    VALUES %s
+    ON CONFLICT (message_id, file_reference) DO UPDATE SET
+        etag = COALESCE(EXCLUDED.etag, payslip_batch_progress.etag),
+        stages = CASE
+            WHEN EXCLUDED.etag IS NOT NULL AND EXCLUDED.etag IS DISTINCT FROM payslip_batch_progress.etag THEN EXCLUDED.stages
+            ELSE ARRAY(SELECT DISTINCT unnest(payslip_batch_progress.stages || EXCLUDED.stages))
+        END,
+        data = CASE
+            WHEN EXCLUDED.etag IS NOT NULL AND EXCLUDED.etag IS DISTINCT FROM payslip_batch_progress.etag THEN EXCLUDED.data
+            ELSE payslip_batch_progress.data || EXCLUDED.data
+        END,
+        "updatedAt" = CURRENT_TIMESTAMP
+    """
+    ROW_TEMPLATE = "(%s, %s, %s, %s, %s::jsonb)"
+
+    def __init__(self, environment: str, message_id: str, logger=None,
+                 batch_size: int = LEDGER_FLUSH_BATCH_SIZE, flush_interval: float = LEDGER_FLUSH_INTERVAL_SECONDS):
+        self.environment = environment
+        self.message_id = message_id
+        self.logger = logger or get_run_logger()
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.entries: Dict[str, Dict[str, Any]] = {}
+        self.stats = {"loaded": 0, "recorded": 0, "resumed": 0, "failures": 0, "flushes": 0}
+        self._lock = threading.Lock()
+        # file_reference -> queued deltas ({"etag", "stages", "data"}), applied in order
+        self._pending: "OrderedDict[str, List[Dict[str, Any]]]" = OrderedDict()
+        self._pending_count = 0
+        self._oldest_pending: Optional[float] = None
+        self._condition = threading.Condition(self._lock)
+        self._flush_lock = threading.Lock()
+        self._closed = False
+        
+        conn = get_db_connection(environment)
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(
+                    "SELECT file_reference, etag, stages, data FROM payslip_batch_progress WHERE message_id = %s",
+                    (message_id,)
+                )
+                for file_reference, etag, stages, data in cursor.fetchall():
+                    self.entries[file_reference] = {"etag": etag, "stages": set(stages), "data": data or {}}
+        finally:
+            conn.close()
+        self.stats["loaded"] = len(self.entries)
+        self._thread = threading.Thread(target=self._run, name="batch-ledger-writer", daemon=True)
+        self._thread.start()
+
+    def get(self, file_reference: str, etag: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """The entry for a document, if any (and, when etag is given, only if it still matches)."""
+        with self._lock:
+            entry = self.entries.get(file_reference)
+        if entry is None or (etag is not None and entry["etag"] != etag):
+            return None
+        return entry
+
+    def has(self, file_reference: str, etag: Optional[str], stage: str) -> bool:
+        entry = self.get(file_reference, etag)
+        return entry is not None and stage in entry["stages"]
+
+    def record(self, file_reference: str, etag: Optional[str], stages: Tuple[str, ...], **data) -> None:
+        """
+        Record completed stages of a document. etag=None keeps the recorded ETag.
+        
+        The write is queued; failures are logged and counted when it is flushed, never
+        raised: the ledger only saves work on a rerun.
+        """
+        with self._condition:
+            entry = self.entries.get(file_reference)
+            if entry is None or (etag is not None and entry["etag"] != etag):
+                entry = self.entries[file_reference] = {"etag": etag, "stages": set(), "data": {}}
+            entry["stages"].update(stages)
+            entry["data"].update(data)
+            
+            deltas = self._pending.setdefault(file_reference, [])
+            last = deltas[-1] if deltas else None
+            if last is not None and (etag is None or etag == last["etag"]):
+                # Same outcome as applying both upserts in turn
+                last["stages"].update(stages)
+                last["data"].update(data)
+            else:
+                # A (possibly) new ETag depends on the stored one: written in a later statement
+                deltas.append({"etag": etag, "stages": set(stages), "data": dict(data)})
+                self._pending_count += 1
+            if self._oldest_pending is None:
+                self._oldest_pending = time.monotonic()
+                self._condition.notify()
+            elif self._pending_count >= self.batch_size:
+                self._condition.notify()
+
+    def mark_resumed(self) -> None:
+        with self._lock:
+            self.stats["resumed"] += 1
+
+    def flush(self) -> int:
+        """Synchronously write all queued records. Returns the number of rows written."""
+        with self._flush_lock:
+            with self._condition:
+                pending, self._pending = self._pending, OrderedDict()
+                self._pending_count = 0
+                self._oldest_pending = None
+            if not pending:
+                return 0
+            
+            # Statements in rounds: the n-th queued delta of every document goes in round n,
+            # since one statement cannot update the same row twice
+            rounds = []
+            for file_reference, deltas in pending.items():
+                for position, delta in enumerate(deltas):
+                    if position == len(rounds):
+                        rounds.append([])
+                    rounds[position].append((
+                        self.message_id, file_reference, delta["etag"], sorted(delta["stages"]),
+                        json.dumps(delta["data"], default=str)
+                    ))
+            row_count = sum(len(rows) for rows in rounds)
+            try:
+                conn = get_db_connection(self.environment)
+                try:
+                    with conn.cursor() as cursor:
+                        for rows in rounds:
+                            psycopg2.extras.execute_values(cursor, self.UPSERT_QUERY, rows, template=self.ROW_TEMPLATE, page_size=len(rows))
+                    conn.commit()
+                except Exception:
+                    conn.rollback()
+                    raise
+                finally:
+                    conn.close()
+            except Exception as e:
+                self.logger.warning(f"Could not write {row_count} batch ledger record(s): {str(e)}")
+                with self._lock:
+                    self.stats["failures"] += row_count
+                return 0
+            
+            with self._lock:
+                self.stats["recorded"] += row_count
+                self.stats["flushes"] += 1
+            return row_count
+
+    def close(self) -> None:
+        """Flush queued records and stop the background thread."""
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        self._thread.join()
+        self.flush()
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                while not self._closed:
+                    if self._pending_count >= self.batch_size:
+                        break
+                    if self._oldest_pending is not None:
+                        oldest_age = time.monotonic() - self._oldest_pending
+                        if oldest_age >= self.flush_interval:
+                            break
+                        self._condition.wait(self.flush_interval - oldest_age)
+                    else:
+                        self._condition.wait()
+                if self._closed:
+                    return
+            self.flush()
+
+
+_BATCH_LEDGERS: Dict[Tuple[str, Optional[str]], BatchProgressLedger] = {}
+_BATCH_LEDGERS_LOCK = threading.Lock()
+
+
+def open_batch_ledger(environment: str, message_id: str) -> BatchProgressLedger:
+    """Load (or create) the progress ledger of a batch."""
+    with _BATCH_LEDGERS_LOCK:
+        ledger = _BATCH_LEDGERS.get((environment, message_id))
+        if ledger is None:
+            ledger = BatchProgressLedger(environment, message_id, get_run_logger())
+            _BATCH_LEDGERS[(environment, message_id)] = ledger
+        return ledger
+
+
+def get_batch_ledger(environment: str, message_id: Optional[str]) -> Optional[BatchProgressLedger]:
+    """Return the batch's progress ledger, if checkpointing is enabled."""
+    with _BATCH_LEDGERS_LOCK:
+        return _BATCH_LEDGERS.get((environment, message_id))
+
+
+def close_batch_ledger(environment: str, message_id: Optional[str]) -> Optional[Dict[str, int]]:
+    """Flush and forget a batch's ledger (its rows stay for later reruns). Returns its statistics."""
+    with _BATCH_LEDGERS_LOCK:
+        ledger = _BATCH_LEDGERS.pop((environment, message_id), None)
+    if ledger is None:
+        return None
+    ledger.close()
+    return ledger.stats
+
+
+def log_batch_ledger_close(environment: str, message_id: Optional[str], logger) -> None:
+    """Close the batch's ledger (if checkpointing) and log what it saved."""
+    ledger_stats = close_batch_ledger(environment, message_id)
+    if ledger_stats:
+        logger.info(f"Batch ledger: {ledger_stats['resumed']} stage(s) resumed from earlier runs, "
+                    f"{ledger_stats['recorded']} checkpoint(s) recorded, {ledger_stats['failures']} failed")
+
+
+def get_blob_etag(document_url: str, environment: str = "staging") -> Optional[str]:
+    """Current ETag of the blob behind a URL (as listed, if it was), or None if it cannot be read."""
+    listed = get_listed_blob_properties(document_url)
+    if listed is not None:
+        return listed.etag
+    try:
+        container_name, blob_path = parse_blob_url(document_url)
+        return get_blob_storage_client(environment).get_blob_client(container=container_name, blob=blob_path).get_blob_properties().etag
+    except Exception:
+        return None
+
+
+def split_with_checkpoint(pdf_url: str, environment: str, message_id: Optional[str], split_document) -> List[str]:
+    """
+    Split a PDF with split_document(), or return its recorded page URLs (re-signed) when the
+    batch ledger shows the same file was already split. Without a ledger this just splits.
+    
+    Extractions held for the pages by a multipage analysis are recorded with the split, so a
+    rerun does not analyze those pages again either.
+    """
+    ledger = get_batch_ledger(environment, message_id)
+    if ledger is None:
+        return split_document()
+    
+    source_reference = extract_clean_blob_url(pdf_url)
+    etag = get_blob_etag(pdf_url, environment)
+    entry = ledger.get(source_reference, etag) if etag else None
+    if entry and "split" in entry["stages"]:
+        ledger.mark_resumed()
+        get_run_logger().info(f"Resuming split of {source_reference}: {len(entry['data']['pages'])} page(s) recorded by an earlier run")
+        for page_reference, extracted_data in (entry["data"].get("page_extractions") or {}).items():
+            hold_preanalyzed_document(page_reference, extracted_data)
+        page_urls = get_sas_service(environment).ensure_read_urls(entry["data"]["pages"], get_run_logger())
+        if not any(isinstance(page_url, Exception) for page_url in page_urls):
+            return page_urls
+        get_run_logger().warning(f"Could not sign recorded pages of {source_reference}, splitting it again")
+    
+    page_urls = split_document()
+    if etag:
+        pages = [extract_clean_blob_url(page_url) for page_url in page_urls]
+        page_extractions = {page: peek_preanalyzed_document(page) for page in pages}
+        ledger.record(source_reference, etag, ("split",), pages=pages,
+                      page_extractions={page: data for page, data in page_extractions.items() if data is not None})
+    return page_urls
+
+
+def resume_document_checkpoint(document_url: str, environment: str, message_id: Optional[str]) -> Optional[Tuple[Dict[str, Any], Any]]:
+    """
+    The ledger entry of a document analyzed by an earlier run of the batch, if its blob is unchanged.
+    
+    Returns:
+        (entry, blob properties) or None. Properties are None for documents already renamed
+        (their original blob may be gone)
+    """
+    ledger = get_batch_ledger(environment, message_id)
+    if ledger is None:
+        return None
+    entry = ledger.get(extract_clean_blob_url(document_url))
+    if entry is None or "analyzed" not in entry["stages"]:
+        return None
+    if "renamed" in entry["stages"]:
+        return entry, None
+    try:
+        blob_properties = get_listed_blob_properties(document_url)
+        if blob_properties is None:
+            container_name, blob_path = parse_blob_url(document_url)
+            blob_client = get_blob_storage_client(environment).get_blob_client(container=container_name, blob=blob_path)
+            with trace_stage("blob_properties"):
+                blob_properties = blob_client.get_blob_properties()
+    except Exception:
+        return None
+    if blob_properties.etag != entry["etag"]:
+        return None
+    return entry, blob_properties
+
+
+def completed_document_result(document_url: str, environment: str, message_id: Optional[str], blob_properties) -> Optional[Dict[str, Any]]:
+    """The recorded processing result of a document an earlier run of the batch already saved, if unchanged."""
+    ledger = get_batch_ledger(environment, message_id)
+    if ledger is None:
+        return None
+    file_reference = extract_clean_blob_url(document_url)
+    entry = ledger.get(file_reference)
+    if entry is None or "saved" not in entry["stages"] or not entry["data"].get("record_id"):
+        return None
+    if "renamed" not in entry["stages"] and (blob_properties is None or blob_properties.etag != entry["etag"]):
+        return None
+    ledger.mark_resumed()
+    return {
+        "success": True,
+        "id": entry["data"]["record_id"],
+        "file_reference": file_reference,
+        "file": entry["data"].get("file"),
+        "match_status": entry["data"].get("match_status"),
+        "resumed": True,
+        "performance": {"extraction_time_seconds": 0.0, "matching_time_seconds": 0.0, "save_time_seconds": 0.0, "total_time_seconds": 0.0}
+    }
+
+
+# Employee roster index
+# Loads a tenant's active employees once and precomputes the same normalized name
+# variants that the find_matching_employees CTE builds, so lookups are in-process.
+ROSTER_WATERMARK_CHECK_INTERVAL_SECONDS = 30
+ROSTER_MATCH_LIMIT = 10
+
+# Rank of each name variant, mirroring the ORDER BY CASE in find_matching_employees
+ROSTER_FULL_NAME_RANK = 1
+ROSTER_PREFERRED_NAME_RANK = 2
+ROSTER_PARTIAL_NAME_RANK = 3
+
+
+def _sql_trim_lower(text: str) -> str:
+    """Equivalent of LOWER(TRIM(...)) in Postgres (TRIM only strips spaces)."""
+    return text.strip(' ').lower()
+
+
+def build_employee_name_keys(employee: Dict[str, Any]) -> Dict[str, int]:
+    """
+    Build the normalized name variants for an employee profile.
+
+    Mirrors the name_variants CTE in find_matching_employees, including its
+    COALESCE/CONCAT spacing, so in-process matching returns the same rows.
+
+    Args:
+        employee: Employee profile row (name, last_name, other_name, preferred_name)
+
+    Returns:
+        Dictionary of normalized name key -> match rank (lower is better)
+    """
+    name = employee.get('name') or ''
+    last_name = employee.get('last_name') or ''
+    other_name = employee.get('other_name') or ''
+    preferred_name = employee.get('preferred_name') or ''
+
+    full_name_variants = [
+        _sql_trim_lower(f"{name} {other_name} {last_name}"),    # name_western
+        _sql_trim_lower(f"{last_name} {name} {other_name}"),    # name_reverse
+        _sql_trim_lower(f"{last_name}, {name} {other_name}"),   # name_comma
+        _sql_trim_lower(f"{name} {last_name}"),                 # name_simple / name_western_no_middle
+        _sql_trim_lower(f"{last_name} {name}"),                 # name_reverse_no_middle
+    ]
+
+    keys = {}
+    for key, rank in (
+        [(variant, ROSTER_FULL_NAME_RANK) for variant in full_name_variants]
+        + [(preferred_name.lower(), ROSTER_PREFERRED_NAME_RANK)]
+        + [(part.lower(), ROSTER_PARTIAL_NAME_RANK) for part in (name, last_name, other_name)]
+    ):
+        if key and (key not in keys or rank < keys[key]):
+            keys[key] = rank
+    return keys
+
+
+class EmployeeRosterIndex:
+    """
+    In-memory index of a tenant's active employee profiles.
+
+    Lookups by normalized name key or employee_identifier are dictionary lookups.
+    The index is immutable once built; a changed roster produces a new index.
+    """
+
+    def __init__(self, tenant_id: str, employees: List[Dict[str, Any]], watermark: Tuple = ()):
+        self.tenant_id = tenant_id
+        self.watermark = watermark
+        self.loaded_at = time.time()
+        self.checked_at = time.monotonic()
+        self.employees = {employee['id']: employee for employee in employees}
+        self._by_identifier: Dict[str, List[Dict[str, Any]]] = {}
+        self._by_name_key: Dict[str, Dict[Any, int]] = {}
+        self._fuzzy_matcher: Optional['FuzzyNameMatcher'] = None
+        self._fuzzy_matcher_lock = threading.Lock()
+
+        for employee in employees:
+            identifier = employee.get('employee_identifier')
+            if identifier is not None:
+                self._by_identifier.setdefault(identifier, []).append(employee)
+            for key, rank in build_employee_name_keys(employee).items():
+                self._by_name_key.setdefault(key, {})[employee['id']] = rank
+
+    def __len__(self) -> int:
+        return len(self.employees)
+
+    def get_fuzzy_matcher(self) -> 'FuzzyNameMatcher':
+        """Return the fuzzy matcher for this roster, building it on first use."""
+        with self._fuzzy_matcher_lock:
+            if self._fuzzy_matcher is None:
+                self._fuzzy_matcher = FuzzyNameMatcher(self)
+            return self._fuzzy_matcher
+
+    def find_by_identifier(self, employee_identifier: str) -> List[Dict[str, Any]]:
+        """Return copies of the active employees with this exact employee_identifier."""
+        return [dict(employee) for employee in self._by_identifier.get(employee_identifier, [])]
+
+    def find_by_name(self, employee_name: str, limit: int = ROSTER_MATCH_LIMIT) -> List[Dict[str, Any]]:
+        """
+        Return copies of employees whose name variants equal the normalized name.
+
+        Results are ordered like the SQL query: by match rank, then by first name.
+        """
+        search_key = employee_name.strip().lower()
+        matches = self._by_name_key.get(search_key, {})
+        ordered = sorted(
+            matches.items(),
+            key=lambda item: (item[1], self.employees[item[0]].get('name') is None, self.employees[item[0]].get('name') or '')
+        )
+        return [dict(self.employees[employee_pk]) for employee_pk, _ in ordered[:limit]]
+
+
+_ROSTER_CACHE: Dict[Tuple[str, str], EmployeeRosterIndex] = {}
+_ROSTER_CACHE_LOCK = threading.Lock()
+_ROSTER_LOAD_LOCKS: Dict[Tuple[str, str], threading.Lock] = {}
+
+
+def _query_roster_watermark(cursor, tenant_id: str) -> Tuple:
+    """Fetch the change watermark for a tenant's employee_profiles rows."""
+    cursor.execute("""
+        SELECT COUNT(*), MAX("updatedAt"), MAX("deletedAt")
+        FROM employee_profiles
+        WHERE tenant_id = %s
+    """, (tenant_id,))
+    return tuple(cursor.fetchone())
+
+
+def load_employee_roster_index(tenant_id: str, environment: str = "staging") -> EmployeeRosterIndex:
+    """
+    Load a tenant's active employees from the database and build a roster index.
+
+    Args:
+        tenant_id: The tenant ID
+        environment: The environment (staging/production)
+
+    Returns:
+        A freshly built EmployeeRosterIndex
+    """
+    conn = get_db_connection(environment)
+    cursor = conn.cursor()
+
+    try:
+        # Read the watermark first: a change made during the load bumps it and
+        # triggers a reload on the next check instead of being missed.
+        watermark = _query_roster_watermark(cursor, tenant_id)
+        cursor.execute("""
+            SELECT id, name, last_name, other_name, preferred_name, employee_identifier
+            FROM employee_profiles
+            WHERE tenant_id = %s
+              AND "deletedAt" IS NULL
+        """, (tenant_id,))
+        columns = [col[0] for col in cursor.description]
+        employees = [dict(zip(columns, row)) for row in cursor.fetchall()]
+        conn.rollback()
+    finally:
+        cursor.close()
+        conn.close()
+
+    return EmployeeRosterIndex(tenant_id, employees, watermark)
+
+
+def get_employee_roster_index(
+    tenant_id: str,
+    environment: str = "staging",
+    max_staleness_seconds: float = ROSTER_WATERMARK_CHECK_INTERVAL_SECONDS
+) -> EmployeeRosterIndex:
+    """
+    Get the cached roster index for a tenant, reloading it if the roster changed.
+
+    The index is shared across flow runs in the same worker process. At most once per
+    max_staleness_seconds a cheap watermark query (row count, MAX updatedAt/deletedAt)
+    decides whether the cached index is still current.
+
+    Args:
+        tenant_id: The tenant ID
+        environment: The environment (staging/production)
+        max_staleness_seconds: How long a cached index is trusted without a watermark check
+
+    Returns:
+        The current EmployeeRosterIndex for the tenant
+    """
+    cache_key = (environment, str(tenant_id))
+
+    with _ROSTER_CACHE_LOCK:
+        index = _ROSTER_CACHE.get(cache_key)
+        if index is not None and time.monotonic() - index.checked_at < max_staleness_seconds:
+            return index
+        load_lock = _ROSTER_LOAD_LOCKS.setdefault(cache_key, threading.Lock())
+
+    # Only one thread per tenant checks/reloads; the others wait and reuse its result
+    with load_lock:
+        with _ROSTER_CACHE_LOCK:
+            index = _ROSTER_CACHE.get(cache_key)
+        if index is not None and time.monotonic() - index.checked_at < max_staleness_seconds:
+            return index
+
+        if index is not None:
+            conn = get_db_connection(environment)
+            cursor = conn.cursor()
+            try:
+                watermark = _query_roster_watermark(cursor, tenant_id)
+                conn.rollback()
+            finally:
+                cursor.close()
+                conn.close()
+
+            if watermark == index.watermark:
+                index.checked_at = time.monotonic()
+                return index
+
+        index = load_employee_roster_index(tenant_id, environment)
+        with _ROSTER_CACHE_LOCK:
+            _ROSTER_CACHE[cache_key] = index
+        return index
+
+
+def invalidate_employee_roster_index(tenant_id: Optional[str] = None, environment: Optional[str] = None) -> None:
+    """
+    Drop cached roster indexes.
+
+    Args:
+        tenant_id: Only drop this tenant's index (all tenants if None)
+        environment: Only drop indexes for this environment (all environments if None)
+    """
+    with _ROSTER_CACHE_LOCK:
+        for cache_key in list(_ROSTER_CACHE):
+            env, tenant = cache_key
+            if (environment is None or env == environment) and (tenant_id is None or tenant == str(tenant_id)):
+                del _ROSTER_CACHE[cache_key]
+
+
+# Fuzzy employee name matching
+# Tolerates OCR noise and accent differences that exact key lookups miss. A blocking
+# index (token prefixes, Soundex codes, accent-folded tokens, and the same keys combined
+# for token pairs) narrows the roster to a small candidate set, which is then scored in
+# one batch with Jaro-Winkler similarity. Blocks for very common keys are skipped at
+# lookup time, the way a rare term outweighs a common one in IDF weighting; a name made only
+# of common keys (e.g. a lone "maria") falls back to its smallest block, narrowed to the
+# strings containing all of its tokens.
+FUZZY_MATCH_THRESHOLD = 0.92  # Minimum similarity for a fuzzy candidate
+FUZZY_MATCH_MARGIN = 0.03     # Required lead of the best candidate to count as a single match
+FUZZY_MAX_CANDIDATES = 200    # Candidate name strings scored per lookup
+FUZZY_MAX_BLOCK_SIZE = 1000   # Blocks with more name strings than this are too common to narrow a lookup
+FUZZY_PREFIX_LENGTH = 3
+
+# Characters OCR commonly substitutes for letters inside names
+_OCR_NAME_SUBSTITUTIONS = str.maketrans({'0': 'o', '1': 'l', '5': 's', '8': 'b', '|': 'l'})
+
+_SOUNDEX_CODES = {
+    letter: digit
+    for letters, digit in (('bfpv', '1'), ('cgjkqsxz', '2'), ('dt', '3'), ('l', '4'), ('mn', '5'), ('r', '6'))
+    for letter in letters
+}
+
+
+def fold_name(text: Optional[str]) -> str:
+    """
+    Normalize a name for fuzzy comparison.
+
+    Lowercases, strips accents (é -> e), maps common OCR digit/letter confusions
+    and collapses punctuation and whitespace to single spaces.
+
+    Args:
+        text: Name text (may be None)
+
+    Returns:
+        Folded name, e.g. "Zoë  O'Neil-Brown," -> "zoe o neil brown"
+    """
+    if not text:
+        return ''
+    decomposed = unicodedata.normalize('NFKD', text)
+    without_accents = ''.join(ch for ch in decomposed if not unicodedata.combining(ch))
+    cleaned = re.sub(r'[^a-z]+', ' ', without_accents.lower().translate(_OCR_NAME_SUBSTITUTIONS))
+    return cleaned.strip()
+
+
+def soundex(token: str) -> str:
+    """
+    American Soundex code for a folded token (e.g. "robert" -> "r163").
+
+    Args:
+        token: Lowercase ASCII token
+
+    Returns:
+        Four character Soundex code, or '' for an empty token
+    """
+    if not token:
+        return ''
+    codes = _SOUNDEX_CODES
+    result = token[0]
+    previous = codes.get(token[0], '')
+    for ch in token[1:]:
+        digit = codes.get(ch, '')
+        if digit and digit != previous:
+            result += digit
+        if ch not in 'hw':
+            previous = digit
+    return (result + '000')[:4]
+
+
+def jaro_winkler_similarity(first: str, second: str, prefix_weight: float = 0.1) -> float:
+    """
+    Jaro-Winkler similarity between two strings (pure Python fallback for rapidfuzz).
+
+    Returns:
+        Similarity between 0.0 and 1.0
+    """
+    if first == second:
+        return 1.0
+    len_first, len_second = len(first), len(second)
+    if not len_first or not len_second:
+        return 0.0
+
+    match_distance = max(max(len_first, len_second) // 2 - 1, 0)
+    first_matches = [False] * len_first
+    second_matches = [False] * len_second
+    matches = 0
+    for i, ch in enumerate(first):
+        for j in range(max(0, i - match_distance), min(i + match_distance + 1, len_second)):
+            if not second_matches[j] and second[j] == ch:
+                first_matches[i] = second_matches[j] = True
+                matches += 1
+                break
+    if not matches:
+        return 0.0
+
+    transpositions = 0
+    j = 0
+    for i, ch in enumerate(first):
+        if first_matches[i]:
+            while not second_matches[j]:
+                j += 1
+            if ch != second[j]:
+                transpositions += 1
+            j += 1
+
+    jaro = (matches / len_first + matches / len_second + (matches - transpositions / 2) / matches) / 3
+    prefix = 0
+    for ch_first, ch_second in zip(first[:4], second[:4]):
+        if ch_first != ch_second:
+            break
+        prefix += 1
+    return jaro + prefix * prefix_weight * (1 - jaro)
+
+
+def _blocking_keys(folded_name: str) -> List[str]:
+    keys = []
+    token_keys = []
+    for token in folded_name.split():
+        if len(token) < 2:
+            continue
+        keys.append(f"t:{token}")
+        prefix_key, soundex_key = f"p:{token[:FUZZY_PREFIX_LENGTH]}", f"s:{soundex(token)}"
+        keys.append(prefix_key)
+        keys.append(soundex_key)
+        token_keys.append((prefix_key, soundex_key))
+    # Combined keys for each token pair (e.g. first + last name) stay small even when
+    # both tokens are common; sorting makes them independent of name order, and mixing
+    # prefix with Soundex still pairs a token whose prefix was garbled by OCR.
+    for i, first_keys in enumerate(token_keys):
+        for second_keys in token_keys[i + 1:]:
+            for first_key in first_keys:
+                for second_key in second_keys:
+                    keys.append('+'.join(sorted((first_key, second_key))))
+    return keys
+
+
+class FuzzyNameMatcher:
+    """
+    Fuzzy name matcher over an EmployeeRosterIndex.
+
+    Each employee contributes several folded name strings (with and without middle
+    name, both name orders, preferred name). Lookups gather candidate strings from the
+    blocking index (skipping blocks larger than FUZZY_MAX_BLOCK_SIZE unless the query
+    has no other keys), keep those sharing the most blocking keys with the query, and
+    score them in a single batch.
+    """
+
+    def __init__(self, roster: 'EmployeeRosterIndex'):
+        self.roster = roster
+        self._choices: List[str] = []
+        self._owners: List[Any] = []
+        self._blocks: Dict[str, List[int]] = {}
+
+        for employee_pk, employee in roster.employees.items():
+            name = employee.get('name') or ''
+            last_name = employee.get('last_name') or ''
+            other_name = employee.get('other_name') or ''
+            variants = {
+                fold_name(f"{name} {other_name} {last_name}"),
+                fold_name(f"{name} {last_name}"),
+                fold_name(f"{last_name} {name} {other_name}"),
+                fold_name(f"{last_name} {name}"),
+                fold_name(employee.get('preferred_name')),
+            }
+            for variant in variants:
+                if not variant:
+                    continue
+                choice_index = len(self._choices)
+                self._choices.append(variant)
+                self._owners.append(employee_pk)
+                for key in set(_blocking_keys(variant)):
+                    self._blocks.setdefault(key, []).append(choice_index)
+
+    def _candidate_indexes(self, folded_query: str) -> List[int]:
+        hits: Dict[int, int] = {}
+        for key in set(_blocking_keys(folded_query)):
+            block = self._blocks.get(key, ())
+            # A key shared by much of the roster says little about who this is; counting
+            # its block would make every lookup score most of the roster.
+            if len(block) > FUZZY_MAX_BLOCK_SIZE:
+                continue
+            for choice_index in block:
+                hits[choice_index] = hits.get(choice_index, 0) + 1
+        if not hits:
+            return self._common_name_candidates(folded_query)
+        # Strings sharing far fewer blocking keys than the best candidate cannot
+        # plausibly be the same name; dropping them keeps the scored set small.
+        min_hits = max(hits.values()) // 2
+        candidates = [choice_index for choice_index, count in hits.items() if count >= min_hits]
+        if len(candidates) <= FUZZY_MAX_CANDIDATES:
+            return candidates
+        return sorted(candidates, key=hits.get, reverse=True)[:FUZZY_MAX_CANDIDATES]
+
+    def _common_name_candidates(self, folded_query: str) -> List[int]:
+        """
+        Candidates for a query whose blocking keys are all too common to count.
+        
+        Only a query made of tokens the roster knows (e.g. a lone "maria") falls back: a token
+        unknown to the roster is OCR noise that no common block can make up for. The smallest
+        of the query's blocks is narrowed to the strings containing every query token, and
+        what is left beyond FUZZY_MAX_CANDIDATES is cut to the strings closest in length to
+        the query, the only ones that can reach the similarity threshold.
+        """
+        keys = set(_blocking_keys(folded_query))
+        tokens = [key[2:] for key in keys if key.startswith("t:")]
+        if not tokens or any(f"t:{token}" not in self._blocks for token in tokens):
+            return []
+        smallest = min((self._blocks[key] for key in keys if key in self._blocks), key=len)
+        candidates = [
+            choice_index for choice_index in smallest
+            if all(f" {token} " in f" {self._choices[choice_index]} " for token in tokens)
+        ] or smallest
+        if len(candidates) <= FUZZY_MAX_CANDIDATES:
+            return list(candidates)
+        query_length = len(folded_query)
+        return heapq.nsmallest(FUZZY_MAX_CANDIDATES, candidates, key=lambda i: abs(len(self._choices[i]) - query_length))
+
+    def find(
+        self,
+        employee_name: str,
+        threshold: float = FUZZY_MATCH_THRESHOLD,
+        limit: int = ROSTER_MATCH_LIMIT
+    ) -> List[Dict[str, Any]]:
+        """
+        Return employees whose names are similar to employee_name, best first.
+
+        Each result is a copy of the employee profile row with an added
+        'match_score' (0.0-1.0) and 'match_method' = 'fuzzy'.
+        """
+        folded_query = fold_name(employee_name)
+        if not folded_query:
+            return []
+
+        candidate_indexes = self._candidate_indexes(folded_query)
+        if not candidate_indexes:
+            return []
+
+        candidate_choices = [self._choices[i] for i in candidate_indexes]
+        if RAPIDFUZZ_AVAILABLE:
+            scored = rapidfuzz_process.extract(
+                folded_query,
+                candidate_choices,
+                scorer=JaroWinkler.normalized_similarity,
+                score_cutoff=threshold,
+                limit=None
+            )
+            scores = [(candidate_indexes[position], score) for _, score, position in scored]
+        else:
+            scores = [
+                (choice_index, jaro_winkler_similarity(folded_query, choice))
+                for choice_index, choice in zip(candidate_indexes, candidate_choices)
+            ]
+
+        best_scores: Dict[Any, float] = {}
+        for choice_index, score in scores:
+            if score < threshold:
+                continue
+            employee_pk = self._owners[choice_index]
+            if score > best_scores.get(employee_pk, 0.0):
+                best_scores[employee_pk] = score
+
+        ranked = sorted(best_scores.items(), key=lambda item: item[1], reverse=True)[:limit]
+        results = []
+        for employee_pk, score in ranked:
+            employee = dict(self.roster.employees[employee_pk])
+            employee['match_score'] = round(score, 4)
+            employee['match_method'] = 'fuzzy'
+            results.append(employee)
+        return results
+
+
+def select_fuzzy_matches(candidates: List[Dict[str, Any]], margin: float = FUZZY_MATCH_MARGIN) -> List[Dict[str, Any]]:
+    """
+    Reduce ranked fuzzy candidates to the list find_matching_employees returns.
+
+    A single candidate, or a best candidate leading the runner-up by at least
+    margin, is returned alone (a match). Otherwise all candidates are returned
+    so the document is flagged as multiple_matches for review.
+    """
+    if len(candidates) <= 1:
+        return candidates
+    if candidates[0]['match_score'] - candidates[1]['match_score'] >= margin:
+        return candidates[:1]
+    return candidates
+
+
+@hot_path_task
+@trace_stage("match")
+def find_matching_employees(
+    employee_name: str,
+    employee_id: Optional[str],
+    tenant_id: str,
+    environment: str = "staging",
+    use_roster_index: bool = True,
+    fuzzy_matching: bool = False
+) -> List[Dict[str, Any]]:
+    """
+    Find matching employees in the database using optimized query with CTE.
+    
+    Args:
+        employee_name: The employee name to match
+        employee_id: The employee ID to match (optional)
+        tenant_id: The tenant ID
+        environment: The environment (staging/production)
+        use_roster_index: Match against the cached in-memory roster index instead of
+            querying employee_profiles (falls back to the query if the index can't be loaded)
+        fuzzy_matching: If no exact name match is found, fall back to fuzzy matching over
+            the roster index (tolerates OCR noise and accents; requires use_roster_index)
+        
+    Returns:
+        List of matching employee records
+        
+    Performance Notes:
+        - Uses CTE to compute name variations once
+        - Leverages index on (tenant_id, employee_identifier, name)
+        - Returns only essential fields to caller
+        - Exact match optimization for employee_identifier
+        - With use_roster_index, the tenant roster is loaded once per worker process
+          and re-validated with a watermark query instead of scanned per document
+    """
+    logger = get_run_logger()
+    
+    if use_roster_index:
+        try:
+            roster = get_employee_roster_index(tenant_id, environment)
+        except Exception as e:
+            logger.warning(f"Employee roster index unavailable, falling back to database query: {str(e)}")
+            roster = None
+        
+        if roster is not None:
+            if employee_id:
+                results = roster.find_by_identifier(employee_id)
+                if results:
+                    logger.info(f"Found {len(results)} employee(s) matching ID '{employee_id}'")
+                    return results
+            
+            if not employee_name or not employee_name.strip():
+                logger.warning("No employee name provided for matching")
+                return []
+            
+            results = roster.find_by_name(employee_name)
+            if not results and fuzzy_matching:
+                candidates = roster.get_fuzzy_matcher().find(employee_name)
+                results = select_fuzzy_matches(candidates)
+                if candidates:
+                    logger.info(f"Fuzzy candidates for '{employee_name}': "
+                                f"{[(c.get('name'), c.get('last_name'), c['match_score']) for c in candidates]}")
+            if results:
+                logger.info(f"Found {len(results)} employee(s) matching name '{employee_name}' (roster index: {len(roster)} employees)")
+                for result in results:
+                    logger.info(f"  Matched: {result.get('name', '')} {result.get('last_name', '')} (ID: {result.get('employee_identifier', '')})")
+            else:
+                logger.warning(f"No matches found for '{employee_name}' in tenant '{tenant_id}'")
+            return results
+    
+    conn = get_db_connection(environment)
+    cursor = conn.cursor()
+    
+    try:
+        if employee_id:
+            # Optimized: employee_identifier match uses index (tenant_id, employee_identifier)
+            logger.info(f"Searching for employee with ID '{employee_id}' in tenant '{tenant_id}'")
+            query = """
+            SELECT id, name, last_name, other_name, preferred_name, employee_identifier
+            FROM employee_profiles
+            WHERE tenant_id = %s 
+              AND employee_identifier = %s 
+              AND "deletedAt" IS NULL
+            """
+            cursor.execute(query, (tenant_id, employee_id))
+            
+            columns = [col[0] for col in cursor.description]
+            results = [dict(zip(columns, row)) for row in cursor.fetchall()]
+            
+            if results:
+                logger.info(f"Found {len(results)} employee(s) matching ID '{employee_id}'")
+                return results
+        
+        # If no employee ID or no match by ID, try to match by name
+        if not employee_name or not employee_name.strip():
+            logger.warning("No employee name provided for matching")
+            return []
+            
+        logger.info(f"Searching for employee with name '{employee_name}' in tenant '{tenant_id}'")
+        
+        # Prepare search pattern - normalize to lowercase for consistent matching
+        search_pattern = employee_name.strip().lower()
+        logger.info(f"Normalized search pattern: '{search_pattern}'")
+        
+        # Optimized query using CTE to compute name variations once
+        # This avoids redundant CONCAT operations in WHERE and ORDER BY
+        query = """
+        WITH name_variants AS (
+            SELECT 
+                id, 
+                name, 
+                last_name, 
+                other_name, 
+                preferred_name, 
+                employee_identifier,
+                -- Compute all name variations once in CTE
+                LOWER(TRIM(CONCAT(COALESCE(name, ''), ' ', COALESCE(other_name, ''), ' ', COALESCE(last_name, '')))) as name_western,
+                LOWER(TRIM(CONCAT(COALESCE(last_name, ''), ' ', COALESCE(name, ''), ' ', COALESCE(other_name, '')))) as name_reverse,
+                LOWER(TRIM(CONCAT(COALESCE(last_name, ''), ', ', COALESCE(name, ''), ' ', COALESCE(other_name, '')))) as name_comma,
+                LOWER(TRIM(CONCAT(COALESCE(name, ''), ' ', COALESCE(last_name, '')))) as name_simple,
+                -- Add variations WITHOUT middle name (other_name) for payslips that don't include middle names
+                LOWER(TRIM(CONCAT(COALESCE(name, ''), ' ', COALESCE(last_name, '')))) as name_western_no_middle,
+                LOWER(TRIM(CONCAT(COALESCE(last_name, ''), ' ', COALESCE(name, '')))) as name_reverse_no_middle,
+                LOWER(COALESCE(preferred_name, '')) as name_preferred,
+                LOWER(COALESCE(name, '')) as name_first,
+                LOWER(COALESCE(last_name, '')) as name_last,
+                LOWER(COALESCE(other_name, '')) as name_other
+            FROM employee_profiles
+            WHERE tenant_id = %s 
+              AND "deletedAt" IS NULL
+        )
+        SELECT 
+            id, 
+            name, 
+            last_name, 
+            other_name, 
+            preferred_name, 
+            employee_identifier
+        FROM name_variants
+        WHERE 
+            -- Exact matches (no wildcards = faster comparison)
+            name_western = %s
+            OR name_reverse = %s
+            OR name_comma = %s
+            OR name_simple = %s
+            OR name_western_no_middle = %s
+            OR name_reverse_no_middle = %s
+            OR (name_preferred != '' AND name_preferred = %s)
+            -- Partial matches as fallback
+            OR name_first = %s
+            OR name_last = %s
+            OR name_other = %s
+        ORDER BY 
+            CASE 
+                -- Prioritize exact full name matches (with or without middle name)
+                WHEN name_western = %s THEN 1
+                WHEN name_reverse = %s THEN 1
+                WHEN name_comma = %s THEN 1
+                WHEN name_simple = %s THEN 1
+                WHEN name_western_no_middle = %s THEN 1
+                WHEN name_reverse_no_middle = %s THEN 1
+                -- Then preferred name
+                WHEN name_preferred = %s THEN 2
+                -- Then partial matches
+                WHEN name_first = %s THEN 3
+                WHEN name_last = %s THEN 3
+                WHEN name_other = %s THEN 3
+                ELSE 4
+            END,
+            name
         LIMIT 10
         """
         
@@ -963,7 +4493,78 @@ def find_matching_employees(employee_name: str, employee_id: Optional[str], tena
 # Note: Pay cycle validation removed since we don't have recurring cycle support yet
 # Process instances include date/month only, no complex cycle matching needed
 
-@task
+def build_initial_match_audit_log(
+    match_status: str,
+    user_id: str,
+    extracted_data: Dict[str, Any],
+    employee_match: Optional[Dict[str, Any]],
+    performance_metrics: Optional[Dict[str, float]] = None
+) -> Dict[str, Any]:
+    """
+    Build the audit_log document stored with a new matching result.
+    """
+    return {
+        "events": [
+            {
+                "timestamp": datetime.utcnow().isoformat() + "Z",
+                "action": "initial_match",
+                "status": match_status,
+                "user_id": user_id,
+                "details": {
+                    "extracted_data": extracted_data,
+                    "employee_match": employee_match
+                },
+                "performance_metrics": performance_metrics or {}
+            }
+        ]
+    }
+
+
+@trace_stage("tag")
+def tag_blob_with_payslip_id(
+    clean_blob_url: str,
+    record_id: str,
+    environment: str = "staging",
+    logger=None,
+    message_id: Optional[str] = None
+) -> None:
+    """
+    Add the payslip tag (ULID of the matching result ID) to a document blob.
+    
+    If a blob annotation writer is open for the batch, the update is queued and applied
+    in the background; otherwise it is applied immediately. Failures are logged and
+    swallowed - the tag is not critical for the workflow.
+    
+    Args:
+        clean_blob_url: Blob URL without SAS token
+        record_id: The payslip_matching_results ID
+        environment: The environment (staging/production)
+        logger: Logger to use (defaults to the current run logger)
+        message_id: Batch ID whose annotation writer should be used, if open
+    """
+    logger = logger or get_run_logger()
+    
+    try:
+        container_name, blob_name = parse_blob_url(clean_blob_url)
+        payslip_tag = {'payslip': uuid_to_ulid(str(record_id))}
+        
+        writer = get_blob_annotation_writer(environment, message_id)
+        if writer is not None:
+            writer.update_tags(container_name, blob_name, payslip_tag)
+            logger.debug(f"Queued blob tag update with payslip ID: {record_id}")
+            return
+        
+        blob_service_client = get_blob_storage_client(environment)
+        blob_client = blob_service_client.get_blob_client(container=container_name, blob=blob_name)
+        apply_blob_annotations(blob_client, tags=payslip_tag, container_name=container_name, blob_name=blob_name)
+        logger.info(f"Updated blob tags with payslip ID: {record_id}")
+    except Exception as tag_error:
+        logger.warning(f"Failed to update blob tags with payslip ID: {str(tag_error)}")
+        # Continue anyway - tag update is not critical for workflow
+
+
+@hot_path_task
+@trace_stage("save")
 def save_matching_result(
     tenant_id: str,
     process_instance_id: str,
@@ -1001,21 +4602,7 @@ def save_matching_result(
     
     try:
         # Create audit log entry with performance metrics
-        audit_log = {
-            "events": [
-                {
-                    "timestamp": datetime.utcnow().isoformat() + "Z",
-                    "action": "initial_match",
-                    "status": match_status,
-                    "user_id": user_id,
-                    "details": {
-                        "extracted_data": extracted_data,
-                        "employee_match": employee_match
-                    },
-                    "performance_metrics": performance_metrics or {}
-                }
-            ]
-        }
+        audit_log = build_initial_match_audit_log(match_status, user_id, extracted_data, employee_match, performance_metrics)
         
         # Insert or update the record using UPSERT to handle reprocessing
         # This prevents duplicate records when the same document is processed multiple times
@@ -1074,32 +4661,7 @@ def save_matching_result(
         logger.info(f"Created matching result record with ID {record_id} (batch: {message_id})")
         
         # Update blob tags with payslip ID (now that we have the database record ID)
-        try:
-            blob_service_client = get_blob_storage_client(environment)
-            blob_client = blob_service_client.get_blob_client(
-                container="document-repo",
-                blob=clean_blob_url.split('/document-repo/')[-1]
-            )
-            
-            # Get existing tags
-            blob_properties = blob_client.get_blob_properties()
-            current_tags = blob_properties.metadata.get('tags', {}) if hasattr(blob_properties, 'metadata') else {}
-            
-            # Get blob tags (different from metadata)
-            try:
-                current_tags = blob_client.get_blob_tags()
-            except:
-                current_tags = {}
-            
-            # Add payslip ID tag
-            current_tags['payslip'] = uuid_to_ulid(record_id)
-            
-            # Update tags
-            blob_client.set_blob_tags(tags=current_tags)
-            logger.info(f"Updated blob tags with payslip ID: {record_id}")
-        except Exception as tag_error:
-            logger.warning(f"Failed to update blob tags with payslip ID: {str(tag_error)}")
-            # Continue anyway - tag update is not critical for workflow
+        tag_blob_with_payslip_id(clean_blob_url, record_id, environment, logger, message_id)
         
         return record_id
     
@@ -1113,6 +4675,343 @@ def save_matching_result(
         conn.close()
 
 
+# Write-behind batching for payslip_matching_results
+# Workers hand their results to a per-batch writer instead of doing one INSERT and
+# one commit each. The writer flushes multi-row upserts when batch_size rows are
+# pending or the oldest row has waited flush_interval seconds.
+WRITE_BEHIND_BATCH_SIZE = 500
+WRITE_BEHIND_FLUSH_INTERVAL_SECONDS = 2.0
+
+MATCHING_RESULT_BATCH_UPSERT_QUERY = """
+INSERT INTO payslip_matching_results (
+    tenant_id,
+    process_instance_id,
+    user_id,
+    file_reference,
+    extracted_data,
+    match_status,
+    audit_log,
+    message_id
+)
+VALUES %s
+ON CONFLICT (tenant_id, process_instance_id, user_id, file_reference, message_id)
+DO UPDATE SET
+    extracted_data = payslip_matching_results.extracted_data || EXCLUDED.extracted_data,
+    match_status = EXCLUDED.match_status,
+    audit_log = jsonb_set(
+        COALESCE(payslip_matching_results.audit_log, '{"events":[]}'::jsonb),
+        '{events}',
+        COALESCE(payslip_matching_results.audit_log->'events', '[]'::jsonb) || EXCLUDED.audit_log->'events'
+    ),
+    "updatedAt" = CURRENT_TIMESTAMP
+RETURNING id, tenant_id::text, process_instance_id::text, user_id::text, file_reference, message_id::text
+"""
+
+MATCHING_RESULT_ROW_TEMPLATE = "(%s, %s, %s, %s, %s::jsonb, %s, %s::jsonb, %s)"
+
+
+def _matching_result_key(tenant_id, process_instance_id, user_id, file_reference, message_id) -> Tuple:
+    """Conflict key of a payslip_matching_results row, normalized for comparison."""
+    return (
+        str(tenant_id).lower(),
+        str(process_instance_id).lower(),
+        str(user_id).lower(),
+        file_reference,
+        str(message_id).lower() if message_id is not None else None
+    )
+
+
+def upsert_matching_results(cursor, rows: List[Tuple], query: str = MATCHING_RESULT_BATCH_UPSERT_QUERY,
+                            template: str = MATCHING_RESULT_ROW_TEMPLATE) -> List[str]:
+    """
+    Upsert many payslip_matching_results rows with multi-row INSERT ... ON CONFLICT statements.
+
+    Rows sharing a conflict key are spread over separate statements, since one
+    statement cannot update the same row twice. The caller commits.
+
+    Args:
+        cursor: Database cursor
+        rows: Tuples of (tenant_id, process_instance_id, user_id, file_reference,
+              extracted_data_json, match_status, audit_log_json, message_id)
+        query: Upsert statement with a single VALUES %s placeholder, returning
+               id plus the conflict key columns as text
+        template: Row template for execute_values
+
+    Returns:
+        Record IDs in the same order as rows
+    """
+    record_ids: List[Optional[str]] = [None] * len(rows)
+    remaining = list(range(len(rows)))
+
+    while remaining:
+        statement_rows, deferred, seen_keys = [], [], set()
+        for position in remaining:
+            row = rows[position]
+            key = _matching_result_key(row[0], row[1], row[2], row[3], row[7])
+            if key in seen_keys:
+                deferred.append(position)
+            else:
+                seen_keys.add(key)
+                statement_rows.append(position)
+
+        returned = psycopg2.extras.execute_values(
+            cursor,
+            query,
+            [rows[position] for position in statement_rows],
+            template=template,
+            page_size=len(statement_rows),
+            fetch=True
+        )
+        ids_by_key = {_matching_result_key(*returned_row[1:]): returned_row[0] for returned_row in returned}
+        for position in statement_rows:
+            row = rows[position]
+            record_ids[position] = ids_by_key.get(_matching_result_key(row[0], row[1], row[2], row[3], row[7]))
+
+        remaining = deferred
+
+    return record_ids
+
+
+class MatchingResultWriter:
+    """
+    Write-behind batching writer for payslip_matching_results.
+
+    submit() queues a row and returns a Future for its record ID. A background thread
+    flushes pending rows in multi-row upserts (one commit per flush). Saved rows are
+    passed to on_saved(row_info, record_id) after the commit, e.g. to tag the blob.
+    If a batch statement fails, its rows are retried one by one so a single bad row
+    only fails its own Future (as does a row whose data cannot be serialized).
+    """
+
+    def __init__(
+        self,
+        environment: str = "staging",
+        batch_size: int = WRITE_BEHIND_BATCH_SIZE,
+        flush_interval: float = WRITE_BEHIND_FLUSH_INTERVAL_SECONDS,
+        on_saved=None,
+        logger=None
+    ):
+        self.environment = environment
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.on_saved = on_saved
+        self.logger = logger or get_run_logger()
+        self.record_ids: Dict[str, str] = {}  # clean file_reference -> record ID
+        self.stats = {"rows": 0, "flushes": 0, "commits": 0, "failed_rows": 0}
+        self._pending = []  # List of (row_info, Future, enqueued_monotonic)
+        self._condition = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="matching-result-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, row_info: Dict[str, Any]) -> Future:
+        """
+        Queue a row for saving.
+
+        Args:
+            row_info: Dictionary with tenant_id, process_instance_id, user_id, file_reference,
+                      extracted_data, match_status, audit_log and message_id
+
+        Returns:
+            Future resolving to the record ID once the row is committed
+        """
+        future = Future()
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("MatchingResultWriter is closed")
+            self._pending.append((row_info, future, time.monotonic()))
+            if len(self._pending) == 1 or len(self._pending) >= self.batch_size:
+                # Wake the flusher to start the interval timer or flush a full batch
+                self._condition.notify()
+        return future
+
+    def flush(self) -> int:
+        """Synchronously write all pending rows. Returns the number of rows written."""
+        with self._flush_lock:
+            with self._condition:
+                batch, self._pending = self._pending, []
+            if batch:
+                self._write_batch(batch)
+            return len(batch)
+
+    def close(self) -> None:
+        """Flush pending rows and stop the background thread."""
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        self._thread.join()
+        self.flush()
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                while not self._closed:
+                    if len(self._pending) >= self.batch_size:
+                        break
+                    if self._pending:
+                        oldest_age = time.monotonic() - self._pending[0][2]
+                        if oldest_age >= self.flush_interval:
+                            break
+                        self._condition.wait(self.flush_interval - oldest_age)
+                    else:
+                        self._condition.wait()
+                if self._closed:
+                    return
+            try:
+                self.flush()
+            except Exception as e:
+                self.logger.error(f"Write-behind flush failed: {str(e)}")
+
+    def _write_batch(self, batch) -> None:
+        # A row that cannot be serialized fails only its own Future; the rest are still written
+        results, entries, rows = [], [], []
+        for entry in batch:
+            info = entry[0]
+            try:
+                rows.append((
+                    info["tenant_id"],
+                    info["process_instance_id"],
+                    info["user_id"],
+                    info["file_reference"],
+                    json.dumps(info["extracted_data"]),
+                    info["match_status"],
+                    json.dumps(info["audit_log"]),
+                    info["message_id"]
+                ))
+                entries.append(entry)
+            except Exception as row_error:
+                results.append((entry, None, row_error))
+
+        if rows:
+            try:
+                record_ids = self._commit_rows(rows)
+                results.extend(zip(entries, record_ids, [None] * len(entries)))
+            except Exception as e:
+                self.logger.warning(f"Batch upsert of {len(rows)} matching results failed ({str(e)}), retrying rows individually")
+                for entry, row in zip(entries, rows):
+                    try:
+                        results.append((entry, self._commit_rows([row])[0], None))
+                    except Exception as row_error:
+                        results.append((entry, None, row_error))
+
+        self.stats["flushes"] += 1
+        for (info, future, _), record_id, error in results:
+            if error is None and record_id is None:
+                error = RuntimeError(f"No record ID returned for {sanitize_url_for_logging(info['file_reference'])}")
+            if error is not None:
+                self.stats["failed_rows"] += 1
+                future.set_exception(error)
+                continue
+
+            self.stats["rows"] += 1
+            self.record_ids[info["file_reference"]] = record_id
+            future.set_result(record_id)
+            if self.on_saved:
+                try:
+                    self.on_saved(info, record_id)
+                except Exception as callback_error:
+                    self.logger.warning(f"Post-save callback failed for record {record_id}: {str(callback_error)}")
+
+        self.logger.info(f"Write-behind flush: {len(batch)} matching result(s), {self.stats['commits']} commit(s) so far")
+
+    def _commit_rows(self, rows: List[Tuple]) -> List[str]:
+        conn = get_db_connection(self.environment)
+        cursor = conn.cursor()
+        try:
+            record_ids = upsert_matching_results(cursor, rows)
+            conn.commit()
+            self.stats["commits"] += 1
+            return record_ids
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cursor.close()
+            conn.close()
+
+
+_RESULT_WRITERS: Dict[Tuple[str, str], MatchingResultWriter] = {}
+_RESULT_WRITERS_LOCK = threading.Lock()
+
+
+def _on_result_saved(info: Dict[str, Any], record_id: str, environment: str, logger, message_id: str) -> None:
+    """Tag a saved row's blob with its payslip ID and checkpoint the save."""
+    tag_blob_with_payslip_id(info["file_reference"], record_id, environment, logger, message_id)
+    ledger = get_batch_ledger(environment, message_id)
+    if ledger is not None:
+        ledger.record(info["file_reference"], None, ("saved",), record_id=record_id)
+
+
+def open_matching_result_writer(environment: str, message_id: str) -> MatchingResultWriter:
+    """
+    Get (or create) the write-behind writer for a batch.
+
+    Saved rows are tagged on their blob with the payslip ID after commit.
+    """
+    with _RESULT_WRITERS_LOCK:
+        writer = _RESULT_WRITERS.get((environment, message_id))
+        if writer is None:
+            logger = get_run_logger()
+            writer = MatchingResultWriter(
+                environment,
+                on_saved=lambda info, record_id: _on_result_saved(info, record_id, environment, logger, message_id),
+                logger=logger
+            )
+            _RESULT_WRITERS[(environment, message_id)] = writer
+        return writer
+
+
+def close_matching_result_writer(environment: str, message_id: str) -> Optional[MatchingResultWriter]:
+    """
+    Flush and close a batch's write-behind writer.
+
+    Returns:
+        The closed writer (with record_ids for every saved row), or None if none was open
+    """
+    with _RESULT_WRITERS_LOCK:
+        writer = _RESULT_WRITERS.pop((environment, message_id), None)
+    if writer is not None:
+        writer.close()
+    return writer
+
+
+@trace_stage("save")
+def queue_matching_result(
+    tenant_id: str,
+    process_instance_id: str,
+    user_id: str,
+    document_url: str,
+    extracted_data: Dict[str, Any],
+    employee_match: Optional[Dict[str, Any]],
+    match_status: str,
+    environment: str = "staging",
+    performance_metrics: Optional[Dict[str, float]] = None,
+    message_id: Optional[str] = None
+) -> Future:
+    """
+    Write-behind variant of save_matching_result.
+
+    Queues the result on the batch's writer (see open_matching_result_writer) and
+    returns immediately.
+
+    Returns:
+        Future resolving to the record ID once the batch containing the row is committed
+    """
+    audit_log = build_initial_match_audit_log(match_status, user_id, extracted_data, employee_match, performance_metrics)
+    writer = open_matching_result_writer(environment, message_id)
+    return writer.submit({
+        "tenant_id": tenant_id,
+        "process_instance_id": process_instance_id,
+        "user_id": user_id,
+        "file_reference": extract_clean_blob_url(document_url),
+        "extracted_data": extracted_data,
+        "match_status": match_status,
+        "audit_log": audit_log,
+        "message_id": message_id
+    })
+
+
 @task
 def send_notification(user_id: str, process_instance_id: str, match_results: List[Dict[str, Any]], environment: str = "staging", message_id: Optional[str] = None) -> bool:
     """
@@ -1131,7 +5030,7 @@ def send_notification(user_id: str, process_instance_id: str, match_results: Lis
     logger = get_run_logger()
     
     try:
-        notification_api_url = Secret.load(f'notification-api-url-{environment}').get()
+        notification_api_url = get_cached_secret(f'notification-api-url-{environment}')
     except Exception:
         logger.error(f"Notification API URL not found for environment: {environment}")
         return False
@@ -1139,7 +5038,7 @@ def send_notification(user_id: str, process_instance_id: str, match_results: Lis
     # Get APIM subscription key for both staging and production environments
     headers = {"Content-Type": "application/json"}
     try:
-        subscription_key = Secret.load(f'notification-api-subscription-key-{environment}').get()
+        subscription_key = get_cached_secret(f'notification-api-subscription-key-{environment}')
         headers["Ocp-Apim-Subscription-Key"] = subscription_key
         logger.info(f"Using APIM subscription key for {environment} notification")
     except Exception as e:
@@ -1158,7 +5057,7 @@ def send_notification(user_id: str, process_instance_id: str, match_results: Lis
     logger.info(f"Notification headers: {json.dumps({k: v for k, v in headers.items() if k != 'Ocp-Apim-Subscription-Key'})}")
     
     try:
-        response = requests.post(notification_api_url, json=payload, headers=headers)
+        response = get_http_session(environment).post(notification_api_url, json=payload, headers=headers)
         if response.status_code >= 200 and response.status_code < 300:
             logger.info(f"Successfully sent notification: {response.status_code}")
             return True
@@ -1181,7 +5080,29 @@ def payslip_matching_flow(
     environment: str = "staging",
     task_id: Optional[str] = None,  # Backwards compatibility - alias for process_instance_id
     message_id: Optional[str] = None,  # Batch ID to track upload sessions (snake_case)
-    messageId: Optional[str] = None  # Backend sends camelCase - alias for message_id
+    messageId: Optional[str] = None,  # Backend sends camelCase - alias for message_id
+    fuzzy_matching: bool = False,  # Fall back to fuzzy name matching for OCR-noisy names
+    write_behind: bool = False,  # Batch result upserts instead of one commit per document
+    execution_mode: str = "threads",  # "threads" or "asyncio" (single event loop for all analyses)
+    max_in_flight: int = 100,  # Analyses kept in flight at once in asyncio mode
+    adaptive_concurrency: bool = False,  # Adapt in-flight analyses to throttling and latency (AIMD)
+    result_cache: Optional[str] = None,  # "disk:<directory>" or "postgres": reuse analyses of identical files
+    streaming_split: bool = False,  # Split with parallel ranged download and parallel page uploads
+    analyze_pages_from_memory: bool = False,  # Send split pages to Document Intelligence as bytes
+    multipage_analysis: bool = False,  # Analyze each PDF once and split it by the detected payslips
+    sas_scope: str = "blob",  # "container" signs blob_location listings with one container SAS
+    rename_mode: str = "copy",  # "virtual" records friendly names without copying blobs
+    pipeline: bool = False,  # Stream documents through list/sign/split/analyze/save stages
+    pipeline_workers: Optional[Dict[str, int]] = None,  # Worker count per pipeline stage
+    metrics_port: Optional[int] = None,  # Serve Prometheus metrics on this port
+    trace_file: Optional[str] = None,  # Append stage spans to this file as OTLP/JSON lines
+    log_mode: str = "verbose",  # "structured": one JSON event per document instead of detailed lines
+    log_sample_rate: float = LOG_DETAIL_SAMPLE_RATE,  # Fraction of detail events kept in structured mode
+    log_budget: Optional[int] = LOG_EVENT_BUDGET,  # Info-level events per batch in structured mode (None: unlimited)
+    lightweight_tasks: bool = False,  # Run per-document helpers as plain calls instead of Prefect tasks
+    fanout_processes: int = 0,  # Shard document processing across this many worker processes
+    checkpoint: bool = False,  # Record per-document progress so a rerun of this message_id resumes
+    listing_walkers: int = 1  # Concurrent walkers listing blob_location (one per top-level directory)
 ):
     """
     Main workflow for payslip matching.
@@ -1210,8 +5131,63 @@ def payslip_matching_flow(
         task_id: DEPRECATED - Use process_instance_id instead (kept for backwards compatibility)
         message_id: Optional batch ID to track files uploaded in the same session (snake_case)
         messageId: Optional batch ID from backend (camelCase) - alias for message_id
+        fuzzy_matching: If no exact name match is found, match employee names fuzzily
+            (accent-folded, OCR-tolerant Jaro-Winkler) against the tenant roster
+        write_behind: Save matching results through a write-behind writer that flushes
+            multi-row upserts (up to 500 rows per commit) instead of one commit per document
+        execution_mode: "threads" analyzes documents on a small thread pool (one blocked thread
+            per analysis); "asyncio" submits and polls all analyses from one event loop and runs
+            matching/saving as continuations on the thread pool
+        max_in_flight: Maximum concurrent Document Intelligence analyses in asyncio mode
+        adaptive_concurrency: Raise in-flight analyses additively while latency is healthy and
+            cut them multiplicatively on HTTP 429/503 or latency spikes, honouring Retry-After
+        result_cache: Cache Document Intelligence extractions by blob content hash and model
+            ("disk:<directory>" or "postgres", which needs migrations/document_analysis_cache.sql);
+            re-processed or re-uploaded payslips skip the analysis
+        streaming_split: In split mode, download each PDF with parallel ranged GETs into a
+            spooled temp file and upload pages on a bounded parallel uploader as they are produced
+        analyze_pages_from_memory: In split mode, analyze pages from the bytes already in memory
+            while their uploads finish in the background (implies streaming_split)
+        multipage_analysis: In split mode, analyze each PDF with a single Document Intelligence
+            call and create blobs only for the page ranges of the payslips it detects
+        sas_scope: SAS scope for listed blobs: "blob" (one token per blob) or "container" (one
+            read/list token per container, appended to every blob URL)
+        rename_mode: "copy" renames matched blobs; "virtual" leaves them in place and records the
+            friendly name as their display/download name (metadata, Content-Disposition, DB)
+        pipeline: Run the batch as a streaming pipeline (list -> sign -> split -> analyze ->
+            match/save, then rename) with bounded queues between stages instead of in phases.
+            Uses threads regardless of execution_mode
+        pipeline_workers: Worker count per pipeline stage ("sign", "split", "analyze", "save"),
+            overriding PIPELINE_DEFAULT_WORKERS
+        metrics_port: Expose stage latency histograms and throttling counters at
+            http://<worker>:<metrics_port>/metrics (Prometheus text format)
+        trace_file: Append a span per document and stage to this file as OTLP/JSON lines
+        log_mode: "verbose" logs every analysis, extraction and matching step per document;
+            "structured" logs one JSON summary event per document (unmatched ones at warning
+            level) and only a sample of detail events, rendered lazily
+        log_sample_rate: Fraction of detail events kept in structured mode
+        log_budget: Maximum info-level events per batch in structured mode; further ones are
+            dropped and counted in the batch summary
+        lightweight_tasks: Orchestrate only the coarse stages (listing, splitting, the document
+            batch, source files, rename, notification) as Prefect tasks and run the per-document
+            helpers (processing, analysis, extraction, matching, saving, client getters, SAS
+            signing) as plain function calls, without a task run each
+        fanout_processes: Shard the analysis/matching/saving of the batch across this many worker
+            processes (each with its own clients, DB pool and 3 threads); results are aggregated in
+            this process, which sends the single notification. 0 or 1 keeps everything in-process.
+            Not used in pipeline mode
+        checkpoint: Record each document's completed stages (split, analyzed, matched, saved,
+            renamed) in the payslip_batch_progress table (migrations/payslip_batch_progress.sql),
+            keyed by blob URL and ETag. Rerunning
+            the same message_id after a crash resumes: unchanged documents are not split,
+            analyzed or saved again
+        listing_walkers: List blob_location with this many concurrent walkers, one per virtual
+            directory directly under it (useful for very large prefixes). Listed blobs carry
+            their properties, metadata and tags, so no per-document properties call is made
     """
     logger = get_run_logger()
+    set_lightweight_tasks(lightweight_tasks)
+    configure_instrumentation(metrics_port=metrics_port, trace_file=trace_file)
     
     # Handle backwards compatibility: if task_id is provided but process_instance_id is not, use task_id
     if not process_instance_id and task_id:
@@ -1230,66 +5206,164 @@ def payslip_matching_flow(
         message_id = str(uuid.uuid4())
         logger.info(f"No message_id provided, generated: {message_id}")
     
-    logger.info(f"Starting payslip matching workflow for {blob_location}")
-    logger.info(f"Parameters: user_id={user_id}, process_instance_id={process_instance_id}, split={split}, message_id={message_id}")
+    try:
+        # Per-document logging policy, closed (and its event counts logged) when the batch is finalized
+        open_document_event_log(environment, message_id, log_mode, sample_rate=log_sample_rate, budget=log_budget)
+    
+        # Resumable batch: reruns of this message_id skip the stages already recorded
+        if checkpoint:
+            ledger = open_batch_ledger(environment, message_id)
+            logger.info(f"Batch ledger: {ledger.stats['loaded']} document(s) recorded by earlier runs of {message_id}")
+    
+        logger.info(f"Starting payslip matching workflow for {blob_location}")
+        logger.info(f"Parameters: user_id={user_id}, process_instance_id={process_instance_id}, split={split}, message_id={message_id}")
     
-    # If tenant_id is not provided, get it from the process
-    if not tenant_id:
-        conn = get_db_connection(environment)
-        cursor = conn.cursor()
+        # If tenant_id is not provided, get it from the process
+        if not tenant_id:
+            conn = get_db_connection(environment)
+            cursor = conn.cursor()
         
-        try:
-            query = "SELECT tenant_id FROM processes WHERE id = %s"
-            cursor.execute(query, (process_instance_id,))
-            result = cursor.fetchone()
+            try:
+                query = "SELECT tenant_id FROM processes WHERE id = %s"
+                cursor.execute(query, (process_instance_id,))
+                result = cursor.fetchone()
             
-            if result:
-                tenant_id = result[0]
-                logger.info(f"Retrieved tenant_id from process: {tenant_id}")
-            else:
-                logger.error(f"Process {process_instance_id} not found")
+                if result:
+                    tenant_id = result[0]
+                    logger.info(f"Retrieved tenant_id from process: {tenant_id}")
+                else:
+                    logger.error(f"Process {process_instance_id} not found")
+                    return
+            finally:
+                cursor.close()
+                conn.close()
+    
+        if pipeline:
+            if not document_urls and not blob_location:
+                logger.error("Either blob_location or document_urls must be provided")
                 return
-        finally:
-            cursor.close()
-            conn.close()
+            if execution_mode != "threads":
+                logger.warning(f"execution_mode '{execution_mode}' is ignored in pipeline mode (stages run on threads)")
+            if fanout_processes > 1:
+                logger.warning("fanout_processes is ignored in pipeline mode")
+            run_payslip_pipeline(
+                user_id, process_instance_id, tenant_id, environment, message_id,
+                blob_location=blob_location, document_urls=document_urls, split=split,
+                fuzzy_matching=fuzzy_matching, write_behind=write_behind, adaptive_concurrency=adaptive_concurrency,
+                result_cache=result_cache, streaming_split=streaming_split, analyze_pages_from_memory=analyze_pages_from_memory,
+                multipage_analysis=multipage_analysis, sas_scope=sas_scope, stage_workers=pipeline_workers,
+                listing_walkers=listing_walkers
+            )
+            logger.info("Renaming matched payslips with employee names...")
+            rename_matched_payslips_with_employee_names(tenant_id, process_instance_id, message_id, environment, rename_mode)
+            flush_instrumentation()
+            logger.info("Payslip matching workflow completed")
+            return
     
-    # If document_urls is provided, use those directly
-    if document_urls:
-        logger.info(f"Processing {len(document_urls)} provided document URLs")
-        
-        # Prepare URLs with SAS tokens
-        sas_urls = []
-        for i, url in enumerate(document_urls, 1):
-            logger.info(f"Processing URL {i}/{len(document_urls)}: {sanitize_url_for_logging(url)}")
-            try:
-                # generate_sas_url will validate and potentially regenerate SAS tokens
-                sas_url = generate_sas_url(url, environment)
+        # If document_urls is provided, use those directly
+        if document_urls:
+            logger.info(f"Processing {len(document_urls)} provided document URLs")
+        
+            # Prepare URLs with SAS tokens (validated and, where needed, re-signed locally in one pass)
+            sas_urls = []
+            for i, (url, sas_url) in enumerate(zip(document_urls, get_sas_service(environment).ensure_read_urls(document_urls, logger)), 1):
+                if isinstance(sas_url, Exception):
+                    logger.error(f"Failed to prepare URL {i}/{len(document_urls)}: {str(sas_url)}")
+                    logger.error(f"Problematic URL: {sanitize_url_for_logging(url)}")
+                    # Continue with other URLs even if one fails
+                    continue
                 sas_urls.append(sas_url)
-                logger.info(f"Successfully prepared URL {i}/{len(document_urls)} for Document Intelligence")
-            except Exception as e:
-                logger.error(f"Failed to prepare URL {i}/{len(document_urls)}: {str(e)}")
-                logger.error(f"Problematic URL: {sanitize_url_for_logging(url)}")
-                # Continue with other URLs even if one fails
-                continue
         
-        if not sas_urls:
-            logger.error("No valid URLs could be prepared for processing")
-            return
+            if not sas_urls:
+                logger.error("No valid URLs could be prepared for processing")
+                return
+        
+            logger.info(f"Successfully prepared {len(sas_urls)} out of {len(document_urls)} URLs for processing")
+        
+            # Handle PDF splitting if requested
+            if split:
+                logger.info("Split mode enabled - will split multi-page PDFs into individual pages")
+                all_page_urls = []
+                source_files = []  # Track original files that were split
+            
+                for i, pdf_url in enumerate(sas_urls, 1):
+                    logger.info(f"Checking PDF {i}/{len(sas_urls)} for splitting...")
+                    try:
+                        # Split PDF into pages (returns original URL if only 1 page)
+                        page_urls = split_with_checkpoint(pdf_url, environment, message_id, lambda: (
+                            split_pdf_by_analysis(pdf_url, user_id, tenant_id, process_instance_id, environment, message_id)
+                            if multipage_analysis else
+                            split_pdf_to_pages(pdf_url, user_id, tenant_id, process_instance_id, environment, streaming=streaming_split, analyze_from_memory=analyze_pages_from_memory)
+                        ))
+                    
+                        # If splitting produced multiple pages, the original is a source file
+                        if len(page_urls) > 1:
+                            source_files.append(pdf_url)
+                            all_page_urls.extend(page_urls)
+                            logger.info(f"PDF {i} split into {len(page_urls)} pages (original marked as source)")
+                        else:
+                            # Single page PDF, process normally
+                            all_page_urls.extend(page_urls)
+                            logger.info(f"PDF {i} has only 1 page, processing normally")
+                    except Exception as e:
+                        logger.error(f"Failed to split PDF {i}: {str(e)}")
+                        # Fall back to processing original PDF if splitting fails
+                        all_page_urls.append(pdf_url)
+            
+                # Save source files with match_status="source" (don't extract/match)
+                if source_files:
+                    logger.info(f"Saving {len(source_files)} source file(s) without extraction/matching")
+                    save_source_files(source_files, user_id, process_instance_id, tenant_id, environment, message_id)
+            
+                logger.info(f"After splitting: {len(all_page_urls)} page(s) to process")
+                final_urls = all_page_urls
+            else:
+                final_urls = sas_urls
         
-        logger.info(f"Successfully prepared {len(sas_urls)} out of {len(document_urls)} URLs for processing")
+            # Process all files using their SAS URLs
+            process_document_urls(final_urls, user_id, process_instance_id, tenant_id, environment=environment, message_id=message_id, fuzzy_matching=fuzzy_matching, write_behind=write_behind, execution_mode=execution_mode, max_in_flight=max_in_flight, adaptive_concurrency=adaptive_concurrency, result_cache=result_cache, fanout_processes=fanout_processes)
         
-        # Handle PDF splitting if requested
+            # Rename matched payslips with employee names
+            if message_id:
+                logger.info("Renaming matched payslips with employee names...")
+                rename_matched_payslips_with_employee_names(tenant_id, process_instance_id, message_id, environment, rename_mode)
+        
+            flush_instrumentation()
+            return
+    
+        # Otherwise, use blob_location to find and process files
+        if not blob_location:
+            logger.error("Either blob_location or document_urls must be provided")
+            return
+    
+        # Get the list of blobs (their listed properties are reused when the documents are processed)
+        blob_paths = list_blobs(blob_location, environment, listing_walkers)
+    
+        if not blob_paths:
+            logger.warning(f"No blobs found in {blob_location}")
+            return
+    
+        logger.info(f"Found {len(blob_paths)} blobs")
+    
+        # Generate SAS URLs for all blobs in one call
+        blob_urls = get_sas_service(environment).sign_blob_paths(blob_paths, scope=sas_scope)
+    
+        # If split is enabled, split multi-page PDFs into individual pages
         if split:
             logger.info("Split mode enabled - will split multi-page PDFs into individual pages")
             all_page_urls = []
             source_files = []  # Track original files that were split
-            
-            for i, pdf_url in enumerate(sas_urls, 1):
-                logger.info(f"Checking PDF {i}/{len(sas_urls)} for splitting...")
+        
+            for i, pdf_url in enumerate(blob_urls, 1):
+                logger.info(f"Checking PDF {i}/{len(blob_urls)} for splitting...")
                 try:
                     # Split PDF into pages (returns original URL if only 1 page)
-                    page_urls = split_pdf_to_pages(pdf_url, user_id, tenant_id, process_instance_id, environment)
-                    
+                    page_urls = split_with_checkpoint(pdf_url, environment, message_id, lambda: (
+                        split_pdf_by_analysis(pdf_url, user_id, tenant_id, process_instance_id, environment, message_id)
+                        if multipage_analysis else
+                        split_pdf_to_pages(pdf_url, user_id, tenant_id, process_instance_id, environment, streaming=streaming_split, analyze_from_memory=analyze_pages_from_memory)
+                    ))
+                
                     # If splitting produced multiple pages, the original is a source file
                     if len(page_urls) > 1:
                         source_files.append(pdf_url)
@@ -1303,93 +5377,122 @@ def payslip_matching_flow(
                     logger.error(f"Failed to split PDF {i}: {str(e)}")
                     # Fall back to processing original PDF if splitting fails
                     all_page_urls.append(pdf_url)
-            
+        
             # Save source files with match_status="source" (don't extract/match)
             if source_files:
                 logger.info(f"Saving {len(source_files)} source file(s) without extraction/matching")
                 save_source_files(source_files, user_id, process_instance_id, tenant_id, environment, message_id)
-            
+        
             logger.info(f"After splitting: {len(all_page_urls)} page(s) to process")
-            final_urls = all_page_urls
+            process_document_urls(all_page_urls, user_id, process_instance_id, tenant_id, environment=environment, message_id=message_id, fuzzy_matching=fuzzy_matching, write_behind=write_behind, execution_mode=execution_mode, max_in_flight=max_in_flight, adaptive_concurrency=adaptive_concurrency, result_cache=result_cache, fanout_processes=fanout_processes)
         else:
-            final_urls = sas_urls
-        
-        # Process all files using their SAS URLs
-        process_document_urls(final_urls, user_id, process_instance_id, tenant_id, environment=environment, message_id=message_id)
-        
+            # Process PDFs directly without splitting
+            process_document_urls(blob_urls, user_id, process_instance_id, tenant_id, environment=environment, message_id=message_id, fuzzy_matching=fuzzy_matching, write_behind=write_behind, execution_mode=execution_mode, max_in_flight=max_in_flight, adaptive_concurrency=adaptive_concurrency, result_cache=result_cache, fanout_processes=fanout_processes)
+    
         # Rename matched payslips with employee names
         if message_id:
             logger.info("Renaming matched payslips with employee names...")
-            rename_matched_payslips_with_employee_names(tenant_id, process_instance_id, message_id, environment)
-        
-        return
-    
-    # Otherwise, use blob_location to find and process files
-    if not blob_location:
-        logger.error("Either blob_location or document_urls must be provided")
-        return
-    
-    # Get the list of blobs
-    blobs = list_blobs(blob_location, environment)
+            rename_matched_payslips_with_employee_names(tenant_id, process_instance_id, message_id, environment, rename_mode)
     
-    if not blobs:
-        logger.warning(f"No blobs found in {blob_location}")
-        return
-    
-    logger.info(f"Found {len(blobs)} blobs")
+        flush_instrumentation()
+        logger.info("Payslip matching workflow completed")
+    finally:
+        # Early returns and failures must not leave the batch's policy or ledger registered
+        close_document_event_log(environment, message_id)
+        log_batch_ledger_close(environment, message_id, logger)
+
+
+# Existing metadata prefetch
+# Reprocessed documents keep fileSize/payslipId/original_filename from their earlier record.
+# A batch fetches these for all of its files in one set-based query up front; workers read
+# the shared map (read-only once filled) instead of opening a connection per document.
+EXISTING_METADATA_FIELDS = ('fileSize', 'payslipId', 'original_filename')
+
+# Latest record per file_reference, for all the batch's files at once
+EXISTING_METADATA_QUERY = """
+SELECT DISTINCT ON (file_reference) file_reference, extracted_data
+FROM payslip_matching_results
+WHERE tenant_id = %s AND process_instance_id = %s AND file_reference = ANY(%s)
+ORDER BY file_reference, "createdAt" DESC
+"""
+
+_EXISTING_METADATA: Dict[Tuple[str, Optional[str]], Dict[str, Optional[Dict[str, Any]]]] = {}
+_EXISTING_METADATA_LOCK = threading.Lock()
+
+
+def _metadata_fields(extracted_data) -> Optional[Dict[str, Any]]:
+    if not extracted_data:
+        return None
+    if not isinstance(extracted_data, dict):
+        extracted_data = json.loads(extracted_data)
+    metadata = {k: v for k, v in extracted_data.items() if k in EXISTING_METADATA_FIELDS}
+    return metadata or None
+
+
+@trace_stage("metadata_lookup")
+def prefetch_existing_metadata(
+    tenant_id: str,
+    process_instance_id: str,
+    document_urls: List[str],
+    environment: str,
+    message_id: Optional[str]
+) -> int:
+    """
+    Fetch the existing metadata of every file in a batch with one query.
     
-    # Generate SAS URLs for all blobs
-    blob_urls = []
-    for blob in blobs:
-        blob_path = f"{blob_location}/{blob}"
-        sas_url = generate_sas_url(blob_path, environment)
-        blob_urls.append(sas_url)
+    Files without an earlier record are remembered as such, so their lookup needs no query either.
+    On failure nothing is prefetched and lookups fall back to get_existing_metadata().
     
-    # If split is enabled, split multi-page PDFs into individual pages
-    if split:
-        logger.info("Split mode enabled - will split multi-page PDFs into individual pages")
-        all_page_urls = []
-        source_files = []  # Track original files that were split
-        
-        for i, pdf_url in enumerate(blob_urls, 1):
-            logger.info(f"Checking PDF {i}/{len(blob_urls)} for splitting...")
-            try:
-                # Split PDF into pages (returns original URL if only 1 page)
-                page_urls = split_pdf_to_pages(pdf_url, user_id, tenant_id, process_instance_id, environment)
-                
-                # If splitting produced multiple pages, the original is a source file
-                if len(page_urls) > 1:
-                    source_files.append(pdf_url)
-                    all_page_urls.extend(page_urls)
-                    logger.info(f"PDF {i} split into {len(page_urls)} pages (original marked as source)")
-                else:
-                    # Single page PDF, process normally
-                    all_page_urls.extend(page_urls)
-                    logger.info(f"PDF {i} has only 1 page, processing normally")
-            except Exception as e:
-                logger.error(f"Failed to split PDF {i}: {str(e)}")
-                # Fall back to processing original PDF if splitting fails
-                all_page_urls.append(pdf_url)
-        
-        # Save source files with match_status="source" (don't extract/match)
-        if source_files:
-            logger.info(f"Saving {len(source_files)} source file(s) without extraction/matching")
-            save_source_files(source_files, user_id, process_instance_id, tenant_id, environment, message_id)
-        
-        logger.info(f"After splitting: {len(all_page_urls)} page(s) to process")
-        process_document_urls(all_page_urls, user_id, process_instance_id, tenant_id, environment=environment, message_id=message_id)
-    else:
-        # Process PDFs directly without splitting
-        process_document_urls(blob_urls, user_id, process_instance_id, tenant_id, environment=environment, message_id=message_id)
+    Returns:
+        Number of files with existing metadata
+    """
+    logger = get_run_logger()
+    file_references = sorted({extract_clean_blob_url(url) for url in document_urls})
+    prefetched = dict.fromkeys(file_references)
     
-    # Rename matched payslips with employee names
-    if message_id:
-        logger.info("Renaming matched payslips with employee names...")
-        rename_matched_payslips_with_employee_names(tenant_id, process_instance_id, message_id, environment)
+    try:
+        conn = get_db_connection(environment)
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(EXISTING_METADATA_QUERY, (tenant_id, process_instance_id, file_references))
+                for file_reference, extracted_data in cursor.fetchall():
+                    prefetched[file_reference] = _metadata_fields(extracted_data)
+            conn.commit()
+        finally:
+            conn.close()
+    except Exception as e:
+        logger.warning(f"Could not prefetch existing metadata, looking it up per document: {str(e)}")
+        return 0
     
-    logger.info("Payslip matching workflow completed")
+    with _EXISTING_METADATA_LOCK:
+        _EXISTING_METADATA[(environment, message_id)] = prefetched
+    found = sum(1 for metadata in prefetched.values() if metadata)
+    logger.info(f"Prefetched existing metadata: {found} of {len(file_references)} file(s) have an earlier record")
+    return found
+
+
+def lookup_existing_metadata(
+    tenant_id: str,
+    process_instance_id: str,
+    file_reference: str,
+    environment: str = "staging",
+    message_id: Optional[str] = None
+) -> Optional[Dict[str, Any]]:
+    """Existing metadata of a file: from the batch's prefetch if it covers the file, else queried."""
+    with _EXISTING_METADATA_LOCK:
+        prefetched = _EXISTING_METADATA.get((environment, message_id))
+    if prefetched is not None and file_reference in prefetched:
+        return prefetched[file_reference]
+    return get_existing_metadata(tenant_id, process_instance_id, file_reference, environment)
 
 
+def close_existing_metadata(environment: str, message_id: Optional[str]) -> None:
+    """Drop a batch's prefetched metadata."""
+    with _EXISTING_METADATA_LOCK:
+        _EXISTING_METADATA.pop((environment, message_id), None)
+
+
+@trace_stage("metadata_lookup")
 def get_existing_metadata(tenant_id: str, process_instance_id: str, file_reference: str, environment: str = "staging") -> Optional[Dict[str, Any]]:
     """
     Retrieve existing metadata from database record to preserve during reprocessing.
@@ -1423,10 +5526,8 @@ def get_existing_metadata(tenant_id: str, process_instance_id: str, file_referen
         result = cursor.fetchone()
         
         if result and result[0]:
-            existing_data = json.loads(result[0])
             # Only return metadata fields, not Document Intelligence fields
-            metadata_fields = ['fileSize', 'payslipId', 'original_filename']
-            metadata = {k: v for k, v in existing_data.items() if k in metadata_fields}
+            metadata = _metadata_fields(result[0])
             
             if metadata:
                 logger.info(f"Retrieved existing metadata: {metadata}")
@@ -1444,8 +5545,9 @@ def get_existing_metadata(tenant_id: str, process_instance_id: str, file_referen
             conn.close()
 
 
-@task
-def process_single_document(document_url: str, user_id: str, process_instance_id: str, tenant_id: str, environment: str = "staging", message_id: Optional[str] = None) -> Dict[str, Any]:
+@hot_path_task
+@trace_stage("document")
+def process_single_document(document_url: str, user_id: str, process_instance_id: str, tenant_id: str, environment: str = "staging", message_id: Optional[str] = None, fuzzy_matching: bool = False, write_behind: bool = False) -> Dict[str, Any]:
     """
     Process a single document from its URL.
     
@@ -1456,6 +5558,9 @@ def process_single_document(document_url: str, user_id: str, process_instance_id
         tenant_id: The tenant ID
         environment: The environment (staging/production)
         message_id: Optional batch ID for tracking upload sessions
+        fuzzy_matching: Fall back to fuzzy name matching when no exact match is found
+        write_behind: Queue the result on the batch's write-behind writer instead of
+            saving it immediately ("id" is then None until process_document_urls flushes)
         
     Returns:
         Dictionary with processing result
@@ -1464,138 +5569,275 @@ def process_single_document(document_url: str, user_id: str, process_instance_id
     start_time = time.time()
     
     try:
-        logger.info(f"Processing document URL: {sanitize_url_for_logging(document_url)}")
+        if get_document_event_log(environment, message_id).verbose:
+            logger.info(f"Processing document URL: {sanitize_url_for_logging(document_url)}")
+        extracted_data, extraction_time, blob_properties = analyze_single_document(document_url, environment, message_id)
+        
+        return complete_document_processing(
+            document_url, extracted_data, extraction_time, start_time,
+            user_id, process_instance_id, tenant_id, environment, message_id,
+            fuzzy_matching=fuzzy_matching, write_behind=write_behind, blob_properties=blob_properties
+        )
+    
+    except Exception as e:
+        return build_document_failure_result(document_url, e, start_time, user_id, process_instance_id, tenant_id, environment)
+
+
+def analyze_single_document(document_url: str, environment: str = "staging", message_id: Optional[str] = None) -> Tuple[Dict[str, Any], float, Any]:
+    """
+    Extract the fields of one document, using a multipage pre-analysis or the batch's result cache when available.
+    
+    Exceptions propagate to the caller.
+    
+    Returns:
+        (extracted data, extraction time in seconds, blob properties if they were fetched or None)
+    """
+    logger = get_run_logger()
+    
+    # A rerun of a checkpointed batch reuses the extraction recorded for an unchanged document
+    resumed = resume_document_checkpoint(document_url, environment, message_id)
+    if resumed is not None:
+        entry, blob_properties = resumed
+        take_preanalyzed_document(document_url)
+        return dict(entry["data"]["extracted_data"]), 0.0, blob_properties
+    
+    # Documents analyzed as part of a multipage file already have their extraction
+    preanalyzed_data = take_preanalyzed_document(document_url)
+    
+    # Key the batch's result cache (if any) by the blob's content hash
+    cache = None if preanalyzed_data is not None else get_document_result_cache(environment, message_id)
+    blob_properties = None
+    cache_key = None
+    page = get_split_page(document_url)
+    if cache and page and page.data is not None:
+        cache_key = cache.key_for(split_page_digest(page))
+    elif cache:
+        try:
+            if page:
+                page.wait_for_upload()
+            container_name, blob_path = parse_blob_url(document_url)
+            blob_client = get_blob_storage_client(environment).get_blob_client(container=container_name, blob=blob_path)
+            blob_properties = get_listed_blob_properties(document_url)
+            if blob_properties is None:
+                with trace_stage("blob_properties"):
+                    blob_properties = blob_client.get_blob_properties()
+            cache_key = cache.key_for(blob_content_digest(blob_properties, f"{container_name}/{blob_path}"))
+        except Exception as e:
+            logger.warning(f"Could not key document content, analyzing without the result cache: {str(e)}")
+    
+    # Extract data from the document using direct URL analysis
+    extraction_start = time.time()
+    if preanalyzed_data is not None:
+        extracted_data = preanalyzed_data
+    elif cache_key:
+        extracted_data = analyze_with_result_cache(
+            cache, cache_key, lambda: analyze_document_from_url(document_url, environment, message_id)
+        )
+    else:
+        extracted_data = analyze_document_from_url(document_url, environment, message_id)
+    extraction_time = time.time() - extraction_start
+    
+    return extracted_data, extraction_time, blob_properties
+
+
+def complete_document_processing(
+    document_url: str,
+    extracted_data: Dict[str, Any],
+    extraction_time: float,
+    start_time: float,
+    user_id: str,
+    process_instance_id: str,
+    tenant_id: str,
+    environment: str = "staging",
+    message_id: Optional[str] = None,
+    fuzzy_matching: bool = False,
+    write_behind: bool = False,
+    blob_properties=None
+) -> Dict[str, Any]:
+    """
+    Finish processing an analyzed document: add blob metadata, match the employee and save.
+    
+    Shared by the threaded (process_single_document) and asyncio execution modes.
+    Exceptions propagate to the caller.
+    
+    Args:
+        document_url: Document URL with SAS token
+        extracted_data: Fields extracted by Document Intelligence
+        extraction_time: Seconds spent on the analysis
+        start_time: time.time() when processing of the document started
+        blob_properties: Blob properties if the caller already fetched them (skips the lookup)
+        (remaining arguments as for process_single_document)
         
-        # Extract data from the document using direct URL analysis
-        extraction_start = time.time()
-        extracted_data = analyze_document_from_url(document_url, environment)
-        extraction_time = time.time() - extraction_start
+    Returns:
+        Dictionary with processing result
+    """
+    logger = get_run_logger()
+    event_log = get_document_event_log(environment, message_id)
+    verbose = event_log.verbose
+    
+    # Documents an earlier run of a checkpointed batch already saved are done
+    ledger = get_batch_ledger(environment, message_id)
+    file_reference = extract_clean_blob_url(document_url)
+    if ledger is not None:
+        completed = completed_document_result(document_url, environment, message_id, blob_properties)
+        if completed is not None:
+            if verbose:
+                logger.info(f"Resuming {completed['file']}: saved as {completed['id']} by an earlier run")
+            return completed
+    
+    # A split page analyzed from memory may still be uploading; its blob is read below
+    page = get_split_page(document_url)
+    if page:
+        page.wait_for_upload()
+    
+    # Get blob metadata (file size, upload time) from storage
+    etag = None
+    try:
+        parsed_url = urlparse(document_url)
+        path_parts = parsed_url.path.lstrip('/').split('/', 1)
         
-        # Get blob metadata (file size, upload time) from storage
-        try:
-            parsed_url = urlparse(document_url)
-            path_parts = parsed_url.path.lstrip('/').split('/', 1)
+        if len(path_parts) == 2:
+            container_name = path_parts[0]
+            blob_path = path_parts[1]
             
-            if len(path_parts) == 2:
-                container_name = path_parts[0]
-                blob_path = path_parts[1]
-                
-                # Note: The blob storage has a folder "document-repo" inside container "document-repo"
-                # This causes URLs like /document-repo/document-repo/path/file.pdf
-                # We need to keep the folder as part of the blob path, NOT strip it
-                # So blob_path should be: document-repo/69e567f7.../file.pdf
-                
-                # CRITICAL: URL-decode the blob path since Azure stores with actual characters
-                # URLs have %20 for spaces, but Azure storage uses actual spaces in blob names
-                blob_path = unquote(blob_path)
-                
-                # Get blob service client and fetch properties
+            # Note: The blob storage has a folder "document-repo" inside container "document-repo"
+            # This causes URLs like /document-repo/document-repo/path/file.pdf
+            # We need to keep the folder as part of the blob path, NOT strip it
+            # So blob_path should be: document-repo/69e567f7.../file.pdf
+            
+            # CRITICAL: URL-decode the blob path since Azure stores with actual characters
+            # URLs have %20 for spaces, but Azure storage uses actual spaces in blob names
+            blob_path = unquote(blob_path)
+            
+            # Get blob service client and fetch properties (unless the caller or the listing already has them)
+            properties = blob_properties or get_listed_blob_properties(document_url)
+            if properties is None:
                 blob_service_client = get_blob_storage_client(environment)
                 blob_client = blob_service_client.get_blob_client(
                     container=container_name,
                     blob=blob_path
                 )
-                
-                properties = blob_client.get_blob_properties()
-                
-                # Add blob metadata to extracted data
-                extracted_data["fileSize"] = properties.size
-                extracted_data["blobUploadedAt"] = properties.last_modified.isoformat()
-                
-                # Check if this is a split page with source_filename metadata
-                blob_metadata = properties.metadata or {}
-                if 'source_filename' in blob_metadata:
-                    # This is a split page - use the source filename
-                    extracted_data["original_filename"] = blob_metadata['source_filename']
-                    extracted_data["page_number"] = blob_metadata.get('page_number')
-                    extracted_data["total_pages"] = blob_metadata.get('total_pages')
+                with trace_stage("blob_properties"):
+                    properties = blob_client.get_blob_properties()
+            remember_blob_state(container_name, blob_path, metadata=properties.metadata or {}, etag=properties.etag)
+            etag = properties.etag
+            
+            # Add blob metadata to extracted data
+            extracted_data["fileSize"] = properties.size
+            extracted_data["blobUploadedAt"] = properties.last_modified.isoformat()
+            
+            # Check if this is a split page with source_filename metadata
+            blob_metadata = properties.metadata or {}
+            if 'source_filename' in blob_metadata:
+                # This is a split page - use the source filename
+                extracted_data["original_filename"] = blob_metadata['source_filename']
+                extracted_data["page_number"] = blob_metadata.get('page_number')
+                extracted_data["total_pages"] = blob_metadata.get('total_pages')
+                if verbose:
                     logger.info(f"Split page detected - Source: {blob_metadata['source_filename']}, Page: {blob_metadata.get('page_number')}/{blob_metadata.get('total_pages')}")
-                else:
-                    # Regular file - use the blob filename
-                    extracted_data["original_filename"] = unquote(blob_path.split('/')[-1])
-                
-                logger.info(f"Added blob metadata - Size: {properties.size} bytes, Uploaded: {properties.last_modified}")
             else:
-                logger.warning(f"Could not parse blob path from URL: {parsed_url.path}")
-        except Exception as e:
-            logger.warning(f"Could not fetch blob metadata: {str(e)}")
-            logger.warning(f"Error type: {type(e).__name__}")
-            # Fallback: try to add filename from URL
-            try:
-                parsed_url = urlparse(document_url)
-                filename = unquote(parsed_url.path.split('/')[-1])
-                if filename and filename != '':
-                    extracted_data["original_filename"] = filename
-            except Exception:
-                pass
-        
-        # Preserve original metadata by checking for existing database record
-        # and merging with Document Intelligence results
-        try:
-            # Extract clean blob URL to check for existing record
-            clean_blob_url = extract_clean_blob_url(document_url)
+                # Regular file - use the blob filename
+                extracted_data["original_filename"] = unquote(blob_path.split('/')[-1])
             
-            # Check if there's an existing record with metadata to preserve
-            existing_metadata = get_existing_metadata(tenant_id, process_instance_id, clean_blob_url, environment)
-            if existing_metadata:
+            if verbose:
+                logger.info(f"Added blob metadata - Size: {properties.size} bytes, Uploaded: {properties.last_modified}")
+        else:
+            logger.warning(f"Could not parse blob path from URL: {parsed_url.path}")
+    except Exception as e:
+        logger.warning(f"Could not fetch blob metadata: {str(e)}")
+        logger.warning(f"Error type: {type(e).__name__}")
+        # Fallback: try to add filename from URL
+        try:
+            parsed_url = urlparse(document_url)
+            filename = unquote(parsed_url.path.split('/')[-1])
+            if filename and filename != '':
+                extracted_data["original_filename"] = filename
+        except Exception:
+            pass
+    
+    # Checkpoint the analysis, keyed by the blob version it was made from
+    checkpoint = ledger is not None and etag is not None
+    if checkpoint and not ledger.has(file_reference, etag, "analyzed"):
+        ledger.record(file_reference, etag, ("analyzed",), extracted_data=extracted_data)
+    
+    # Preserve original metadata by checking for existing database record
+    # and merging with Document Intelligence results
+    try:
+        # Extract clean blob URL to check for existing record
+        clean_blob_url = extract_clean_blob_url(document_url)
+        
+        # Check if there's an existing record with metadata to preserve
+        existing_metadata = lookup_existing_metadata(tenant_id, process_instance_id, clean_blob_url, environment, message_id)
+        if existing_metadata:
+            if verbose:
                 logger.info(f"Found existing metadata to preserve: {list(existing_metadata.keys())}")
-                # Merge existing metadata with Document Intelligence results
-                # Document Intelligence results take precedence for payslip fields
-                # New blob metadata also takes precedence over old metadata
-                merged_data = {**existing_metadata, **extracted_data}
-                extracted_data = merged_data
+            # Merge existing metadata with Document Intelligence results
+            # Document Intelligence results take precedence for payslip fields
+            # New blob metadata also takes precedence over old metadata
+            merged_data = {**existing_metadata, **extracted_data}
+            extracted_data = merged_data
+            if verbose:
                 logger.info(f"Merged data - preserved metadata + Document Intelligence results + blob metadata")
-        except Exception as e:
-            logger.warning(f"Could not preserve existing metadata: {str(e)}")
-        
+    except Exception as e:
+        logger.warning(f"Could not preserve existing metadata: {str(e)}")
+    
+    if verbose:
         logger.info(f"Final extracted_data keys: {list(extracted_data.keys())}")
-        
-        # Find matching employees
-        employee_name = extracted_data.get("employee_name")
-        employee_id = extracted_data.get("employee_id")
-        
-        matching_start = time.time()
-        if not employee_name and not employee_id:
+    
+    # Find matching employees
+    employee_name = extracted_data.get("employee_name")
+    employee_id = extracted_data.get("employee_id")
+    
+    matching_start = time.time()
+    if not employee_name and not employee_id:
+        if verbose:
             logger.warning(f"No employee name or ID extracted from document")
-            match_status = "extraction_failed"
+        match_status = "extraction_failed"
+        employee_match = None
+    else:
+        matching_employees = find_matching_employees(employee_name, employee_id, tenant_id, environment, fuzzy_matching=fuzzy_matching)
+        
+        if not matching_employees:
+            if verbose:
+                logger.warning(f"No matching employees found for {employee_name} (ID: {employee_id})")
+            match_status = "no_match"
             employee_match = None
-        else:
-            matching_employees = find_matching_employees(employee_name, employee_id, tenant_id, environment)
+        elif len(matching_employees) == 1:
+            # Single match found - create clean employee match object for audit
+            raw_match = matching_employees[0]
+            employee_match = {
+                "id": raw_match.get("id"),
+                "name": raw_match.get("name"),
+                "last_name": raw_match.get("last_name"),
+                "employee_identifier": raw_match.get("employee_identifier")
+            }
+            if "match_score" in raw_match:
+                employee_match["match_score"] = raw_match["match_score"]
+                employee_match["match_method"] = raw_match.get("match_method")
+            match_status = "matched"
             
-            if not matching_employees:
-                logger.warning(f"No matching employees found for {employee_name} (ID: {employee_id})")
-                match_status = "no_match"
-                employee_match = None
-            elif len(matching_employees) == 1:
-                # Single match found - create clean employee match object for audit
-                raw_match = matching_employees[0]
-                employee_match = {
-                    "id": raw_match.get("id"),
-                    "name": raw_match.get("name"),
-                    "last_name": raw_match.get("last_name"),
-                    "employee_identifier": raw_match.get("employee_identifier")
-                }
-                match_status = "matched"
-                
-                # Log extracted payment info for reference (no validation needed)
+            # Log extracted payment info for reference (no validation needed)
+            if verbose:
                 payment_date = extracted_data.get("payment_date")
                 pay_cycle = extracted_data.get("pay_cycle")
                 logger.info(f"Extracted payment info - Date: {payment_date}, Cycle: {pay_cycle}")
                 logger.info(f"Matched employee: {raw_match.get('name')} {raw_match.get('last_name')} (ID: {raw_match.get('employee_identifier')})")
-            else:
-                # Multiple matches found
+        else:
+            # Multiple matches found
+            if verbose:
                 logger.warning(f"Multiple matching employees found for {employee_name} (ID: {employee_id})")
-                match_status = "multiple_matches"
-                employee_match = matching_employees
-        
-        matching_time = time.time() - matching_start
-        
-        # Log extraction and matching results
-        extraction_success = employee_name is not None or employee_id is not None
-        extraction_field_count = sum(1 for k, v in extracted_data.items() 
-                                     if not k.endswith('_confidence') and v is not None 
-                                     and k in ['employee_name', 'employee_id', 'employer', 'payment_date', 'net_pay', 'pay_cycle'])
-        
+            match_status = "multiple_matches"
+            employee_match = matching_employees
+    
+    matching_time = time.time() - matching_start
+    
+    # Log extraction and matching results
+    extraction_success = employee_name is not None or employee_id is not None
+    extraction_field_count = sum(1 for k, v in extracted_data.items() 
+                                 if not k.endswith('_confidence') and v is not None 
+                                 and k in ['employee_name', 'employee_id', 'employer', 'payment_date', 'net_pay', 'pay_cycle'])
+    
+    if verbose:
         if extraction_success:
             logger.info(f"✓ Extraction: SUCCESS - Extracted {extraction_field_count} payslip fields")
         else:
@@ -1609,32 +5851,51 @@ def process_single_document(document_url: str, user_id: str, process_instance_id
             logger.warning(f"⚠ Matching: MULTIPLE_MATCHES - Found {len(employee_match)} employees for '{employee_name}' (ID: {employee_id})")
         elif match_status == "extraction_failed":
             logger.warning(f"✗ Matching: SKIPPED - Extraction failed, no data to match")
-        
-        # Extract filename from URL for reference
-        try:
-            parsed_url = urlparse(document_url)
-            path = parsed_url.path
-            filename = path.split('/')[-1]  # Get last part of path
+    
+    # Extract filename from URL for reference
+    try:
+        parsed_url = urlparse(document_url)
+        path = parsed_url.path
+        filename = path.split('/')[-1]  # Get last part of path
+        if not filename:
+            # Fallback if we couldn't extract a proper filename
+            filename = document_url.split('/')[-1].split('?')[0]
             if not filename:
-                # Fallback if we couldn't extract a proper filename
-                filename = document_url.split('/')[-1].split('?')[0]
-                if not filename:
-                    filename = f"document_{uuid.uuid4().hex[:8]}"
+                filename = f"document_{uuid.uuid4().hex[:8]}"
+        if verbose:
             logger.info(f"Extracted filename: {filename}")
-        except Exception as e:
-            # Fallback if URL parsing fails
-            logger.warning(f"Could not extract filename from URL: {str(e)}")
-            filename = f"document_{uuid.uuid4().hex[:8]}"
-        
-        # Save the matching result with performance metrics
-        save_start = time.time()
-        
-        # Prepare performance metrics before save to include in audit
-        performance_metrics = {
-            "extraction_time_seconds": round(extraction_time, 3),
-            "matching_time_seconds": round(matching_time, 3)
-        }
-        
+    except Exception as e:
+        # Fallback if URL parsing fails
+        logger.warning(f"Could not extract filename from URL: {str(e)}")
+        filename = f"document_{uuid.uuid4().hex[:8]}"
+    
+    # Save the matching result with performance metrics
+    save_start = time.time()
+    
+    # Prepare performance metrics before save to include in audit
+    performance_metrics = {
+        "extraction_time_seconds": round(extraction_time, 3),
+        "matching_time_seconds": round(matching_time, 3)
+    }
+    
+    if write_behind:
+        queue_matching_result(
+            tenant_id,
+            process_instance_id,
+            user_id,
+            document_url,
+            extracted_data,
+            employee_match,
+            match_status,
+            environment,
+            performance_metrics,
+            message_id
+        )
+        record_id = None  # Resolved by process_document_urls after the writer flushes
+        if checkpoint:
+            # "saved" is recorded by the writer once the row commits
+            ledger.record(file_reference, etag, ("matched",), match_status=match_status, file=filename)
+    else:
         record_id = save_matching_result(
             tenant_id,
             process_instance_id,
@@ -1647,64 +5908,92 @@ def process_single_document(document_url: str, user_id: str, process_instance_id
             performance_metrics,
             message_id
         )
-        save_time = time.time() - save_start
-        total_time = time.time() - start_time
-        
-        # Add save and total time to metrics for return
-        performance_metrics["save_time_seconds"] = round(save_time, 3)
-        performance_metrics["total_time_seconds"] = round(total_time, 3)
-        
+        if checkpoint and record_id:
+            ledger.record(file_reference, etag, ("matched", "saved"), record_id=record_id, match_status=match_status, file=filename)
+    save_time = time.time() - save_start
+    total_time = time.time() - start_time
+    
+    # Add save and total time to metrics for return
+    performance_metrics["save_time_seconds"] = round(save_time, 3)
+    performance_metrics["total_time_seconds"] = round(total_time, 3)
+    
+    if verbose:
         logger.info(f"Document processed successfully in {total_time:.2f}s (extraction: {extraction_time:.2f}s, matching: {matching_time:.2f}s, save: {save_time:.2f}s)")
-        
-        return {
-            "success": True,
-            "id": record_id,
-            "file": filename,
-            "match_status": match_status,
-            "performance": performance_metrics
-        }
+    else:
+        # One event per document; unmatched documents are logged at warning level (never dropped)
+        event_log.summary(
+            logger, "document_processed", level=logging.INFO if match_status == "matched" else logging.WARNING,
+            file=filename, match_status=match_status, fields=extraction_field_count,
+            page=extracted_data.get("page_number"), **performance_metrics
+        )
+    
+    return {
+        "success": True,
+        "id": record_id,
+        "file_reference": file_reference,
+        "file": filename,
+        "match_status": match_status,
+        "performance": performance_metrics
+    }
+
+
+def build_document_failure_result(
+    document_url: str,
+    e: Exception,
+    start_time: float,
+    user_id: str,
+    process_instance_id: str,
+    tenant_id: str,
+    environment: str = "staging"
+) -> Dict[str, Any]:
+    """
+    Log a document processing failure with troubleshooting hints and build its result.
+    
+    Returns:
+        Dictionary with the failed processing result
+    """
+    logger = get_run_logger()
+    
+    total_time = time.time() - start_time
+    
+    # Extract filename for error reporting
+    try:
+        filename = document_url.split('/')[-1].split('?')[0] or "unknown"
+    except:
+        filename = "unknown"
+    
+    logger.error(f"Failed to process document '{filename}' in {total_time:.2f}s")
+    logger.error(f"Document URL: {sanitize_url_for_logging(document_url)}")
+    logger.error(f"Error type: {type(e).__name__}")
+    logger.error(f"Error message: {str(e)}")
+    logger.error(f"Processing context - user_id: {user_id}, process_instance_id: {process_instance_id}, tenant_id: {tenant_id}, environment: {environment}")
     
-    except Exception as e:
-        total_time = time.time() - start_time
-        
-        # Extract filename for error reporting
-        try:
-            filename = document_url.split('/')[-1].split('?')[0] or "unknown"
-        except:
-            filename = "unknown"
-        
-        logger.error(f"Failed to process document '{filename}' in {total_time:.2f}s")
-        logger.error(f"Document URL: {sanitize_url_for_logging(document_url)}")
-        logger.error(f"Error type: {type(e).__name__}")
-        logger.error(f"Error message: {str(e)}")
-        logger.error(f"Processing context - user_id: {user_id}, process_instance_id: {process_instance_id}, tenant_id: {tenant_id}, environment: {environment}")
-        
-        # Log specific guidance based on error type
-        if "HttpResponseError" in str(type(e)):
-            logger.error("This appears to be an Azure service error. Check:")
-            logger.error("1. SAS token permissions and expiry")
-            logger.error("2. Document Intelligence service availability")
-            logger.error("3. Network connectivity to Azure services")
-        elif "ConnectionError" in str(type(e)):
-            logger.error("This appears to be a network connectivity issue. Check:")
-            logger.error("1. Internet connectivity")
-            logger.error("2. Azure service endpoints")
-            logger.error("3. Firewall/proxy settings")
-        elif "psycopg2" in str(type(e)) or "database" in str(e).lower():
-            logger.error("This appears to be a database connectivity issue. Check:")
-            logger.error("1. Database connection parameters")
-            logger.error("2. Database service availability")
-            logger.error("3. Network connectivity to database")
-        
-        logger.error("Full error details:", exc_info=True)
-        
-        return {
-            "success": False,
-            "error": str(e),
-            "error_type": type(e).__name__,
-            "file": filename,
-            "performance": {"total_time": total_time}
-        }
+    # Log specific guidance based on error type
+    if "HttpResponseError" in str(type(e)):
+        logger.error("This appears to be an Azure service error. Check:")
+        logger.error("1. SAS token permissions and expiry")
+        logger.error("2. Document Intelligence service availability")
+        logger.error("3. Network connectivity to Azure services")
+    elif "ConnectionError" in str(type(e)):
+        logger.error("This appears to be a network connectivity issue. Check:")
+        logger.error("1. Internet connectivity")
+        logger.error("2. Azure service endpoints")
+        logger.error("3. Firewall/proxy settings")
+    elif "psycopg2" in str(type(e)) or "database" in str(e).lower():
+        logger.error("This appears to be a database connectivity issue. Check:")
+        logger.error("1. Database connection parameters")
+        logger.error("2. Database service availability")
+        logger.error("3. Network connectivity to database")
+    
+    logger.error("Full error details:", exc_info=True)
+    
+    return {
+        "success": False,
+        "error": str(e),
+        "error_type": type(e).__name__,
+        "file": filename,
+        "performance": {"total_time": total_time}
+    }
 
 
 @task
@@ -1730,6 +6019,8 @@ def save_source_files(
     """
     logger = get_run_logger()
     
+    rows = []
+    row_source_urls = []
     for source_url in source_urls:
         try:
             # Extract clean blob URL for file_reference
@@ -1760,60 +6051,76 @@ def save_source_files(
                 ]
             }
             
-            # Save to database with match_status="source"
-            conn = get_db_connection(environment)
-            cursor = conn.cursor()
-            
+            rows.append((
+                tenant_id,
+                process_instance_id,
+                user_id,
+                clean_blob_url,
+                json.dumps(extracted_data),
+                "source",  # match_status
+                json.dumps(audit_log),
+                message_id
+            ))
+            row_source_urls.append(source_url)
+        except Exception as e:
+            logger.error(f"Failed to save source file {source_url}: {str(e)}")
+    
+    if not rows:
+        return
+    
+    # Save all source files with match_status="source" in a single multi-row upsert
+    query = """
+    INSERT INTO payslip_matching_results (
+        tenant_id, 
+        process_instance_id, 
+        user_id, 
+        file_reference, 
+        extracted_data, 
+        match_status, 
+        audit_log,
+        message_id
+    )
+    VALUES %s
+    ON CONFLICT (tenant_id, process_instance_id, user_id, file_reference, message_id)
+    DO UPDATE SET
+        match_status = EXCLUDED.match_status,
+        extracted_data = EXCLUDED.extracted_data,
+        audit_log = jsonb_set(
+            COALESCE(payslip_matching_results.audit_log, '{"events":[]}'::jsonb),
+            '{events}',
+            COALESCE(payslip_matching_results.audit_log->'events', '[]'::jsonb) || EXCLUDED.audit_log->'events'
+        ),
+        "updatedAt" = CURRENT_TIMESTAMP
+    RETURNING id, tenant_id::text, process_instance_id::text, user_id::text, file_reference, message_id::text
+    """
+    template = "(%s, %s, %s, %s, %s, %s, %s, %s)"
+    
+    conn = get_db_connection(environment)
+    cursor = conn.cursor()
+    
+    try:
+        try:
+            record_ids = upsert_matching_results(cursor, rows, query, template)
+            conn.commit()
+            for record_id in record_ids:
+                logger.info(f"✓ Source file saved with ID: {record_id}")
+            return
+        except Exception as e:
+            conn.rollback()
+            logger.warning(f"Batch save of {len(rows)} source file(s) failed ({str(e)}), saving individually")
+        
+        # Fall back to one upsert per file so one bad row doesn't lose the others
+        for row, source_url in zip(rows, row_source_urls):
             try:
-                query = """
-                INSERT INTO payslip_matching_results (
-                    tenant_id, 
-                    process_instance_id, 
-                    user_id, 
-                    file_reference, 
-                    extracted_data, 
-                    match_status, 
-                    audit_log,
-                    message_id
-                )
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-                ON CONFLICT (tenant_id, process_instance_id, user_id, file_reference, message_id)
-                DO UPDATE SET
-                    match_status = EXCLUDED.match_status,
-                    extracted_data = EXCLUDED.extracted_data,
-                    audit_log = jsonb_set(
-                        COALESCE(payslip_matching_results.audit_log, '{"events":[]}'::jsonb),
-                        '{events}',
-                        COALESCE(payslip_matching_results.audit_log->'events', '[]'::jsonb) || EXCLUDED.audit_log->'events'
-                    ),
-                    "updatedAt" = CURRENT_TIMESTAMP
-                RETURNING id
-                """
-                
-                cursor.execute(
-                    query,
-                    (
-                        tenant_id,
-                        process_instance_id,
-                        user_id,
-                        clean_blob_url,
-                        json.dumps(extracted_data),
-                        "source",  # match_status
-                        json.dumps(audit_log),
-                        message_id
-                    )
-                )
-                
-                record_id = cursor.fetchone()[0]
+                record_id = upsert_matching_results(cursor, [row], query, template)[0]
                 conn.commit()
                 logger.info(f"✓ Source file saved with ID: {record_id}")
-                
-            finally:
-                cursor.close()
-                conn.close()
-                
-        except Exception as e:
-            logger.error(f"Failed to save source file {source_url}: {str(e)}")
+            except Exception as e:
+                conn.rollback()
+                logger.error(f"Failed to save source file {source_url}: {str(e)}")
+    finally:
+        cursor.close()
+        conn.close()
 
 
 def sanitize_filename(text: str) -> str:
@@ -1931,12 +6238,255 @@ def generate_payslip_filename(
     return f"{base_name}.pdf"
 
 
+# Rename engine
+# Renames run concurrently: each file is copied server-side in one synchronous call that
+# also sets its metadata, tags and content type, database updates are committed in chunks,
+# and old blobs are deleted in batches only after the chunk referencing the new names commits.
+RENAME_MAX_CONCURRENCY = 32
+RENAME_DB_CHUNK_SIZE = 200
+RENAME_DELETE_BATCH_SIZE = 256  # Blob batch API limit
+RENAME_COPY_POLL_INITIAL_SECONDS = 0.1  # Only used when the synchronous copy is unavailable
+RENAME_COPY_POLL_MAX_SECONDS = 2.0
+RENAME_MODES = ("copy", "virtual")  # "virtual" keeps blobs in place and only records the friendly name
+
+RENAME_BATCH_UPDATE_QUERY = """
+    UPDATE payslip_matching_results AS r
+    SET file_reference = COALESCE(v.file_reference, r.file_reference),
+        extracted_data = jsonb_set(r.extracted_data, '{matched_filename}', to_jsonb(v.matched_filename)),
+        audit_log = CASE
+            WHEN v.audit_entry IS NULL THEN r.audit_log
+            ELSE jsonb_set(
+                COALESCE(r.audit_log, '{"events":[]}'::jsonb),
+                '{events}',
+                COALESCE(r.audit_log->'events', '[]'::jsonb) || v.audit_entry
+            )
+        END,
+        "updatedAt" = CURRENT_TIMESTAMP
+    FROM (VALUES %s) AS v(id, file_reference, matched_filename, audit_entry)
+    WHERE r.id = v.id::uuid
+      AND (v.file_reference IS NOT NULL OR r.extracted_data->>'matched_filename' IS DISTINCT FROM v.matched_filename)
+"""
+RENAME_ROW_TEMPLATE = "(%s, %s, %s, %s::jsonb)"
+
+
+def plan_payslip_renames(records: List[Tuple]) -> List[Dict[str, Any]]:
+    """
+    Work out the new name of every matched file.
+    
+    Files are grouped by employee and pay period; files sharing a group get a sequence number.
+    
+    Args:
+        records: (id, file_reference, extracted_data, match_status) rows
+    
+    Returns:
+        One plan entry per record with its old/new blob paths and file reference
+    """
+    grouped_files = {}  # Key: (employee_id, pay_period), Value: list of records
+    for record_id, file_reference, extracted_data, match_status in records:
+        # extracted_data is already a dict (JSONB column), no need to parse
+        period_key = extracted_data.get('pay_cycle') or extracted_data.get('payment_date') or "unknown"
+        group_key = (extracted_data.get('employee_id') or extracted_data.get('employee_name') or "unknown", period_key)
+        grouped_files.setdefault(group_key, []).append((record_id, file_reference, extracted_data))
+    
+    plan = []
+    for files in grouped_files.values():
+        total_files = len(files)
+        for idx, (record_id, file_reference, extracted_data) in enumerate(files, 1):
+            new_filename = generate_payslip_filename(
+                employee_name=extracted_data.get('employee_name'),
+                employee_id=extracted_data.get('employee_id'),
+                pay_cycle=extracted_data.get('pay_cycle'),
+                payment_date=extracted_data.get('payment_date'),
+                sequence=idx if total_files > 1 else None,
+                total=total_files if total_files > 1 else None
+            )
+            
+            # Parse old blob path, removing the container name
+            parsed_url = urlparse(file_reference)
+            old_blob_path = unquote(parsed_url.path.lstrip('/'))
+            path_parts = old_blob_path.split('/', 1)
+            if len(path_parts) > 1:
+                old_blob_path = path_parts[1]
+            
+            # Same directory, new filename
+            blob_dir = '/'.join(old_blob_path.split('/')[:-1])
+            new_blob_path = f"{blob_dir}/{new_filename}"
+            old_filename = old_blob_path.split('/')[-1]
+            plan.append({
+                'id': str(record_id),
+                'file_reference': file_reference,
+                'old_blob_path': old_blob_path,
+                'new_blob_path': new_blob_path,
+                'old_filename': old_filename,
+                'new_filename': new_filename,
+                'new_file_reference': f"{parsed_url.scheme}://{parsed_url.netloc}/document-repo/{new_blob_path}",
+                'needs_copy': old_filename != new_filename
+            })
+    return plan
+
+
+@trace_stage("rename")
+def copy_blob_for_rename(container_client, sas_service: SasService, container_name: str, old_blob_path: str,
+                         new_blob_path: str, new_filename: str) -> None:
+    """
+    Copy a blob to its new name with updated metadata, its tags and a PDF content type.
+    
+    Uses a synchronous server-side copy (Put Blob From URL) so no status polling is needed;
+    falls back to an asynchronous copy with backoff polling if the service rejects it
+    (e.g. blobs over the 5000 MiB limit).
+    """
+    old_blob_client = container_client.get_blob_client(old_blob_path)
+    new_blob_client = container_client.get_blob_client(new_blob_path)
+    
+    known = get_known_blob_state(container_name, old_blob_path)
+    metadata, tags = known.get('metadata'), known.get('tags')
+    if metadata is None or tags is None or 'file_size' not in metadata:
+        properties = old_blob_client.get_blob_properties()
+        metadata = dict(properties.metadata or {})
+        metadata.setdefault('file_size', str(properties.size))
+        if tags is None:
+            tags = old_blob_client.get_blob_tags() if properties.tag_count else {}
+    metadata = {**metadata, 'original_file_name': quote(new_filename), 'file_name': quote(new_filename)}
+    content_settings = ContentSettings(content_type='application/pdf')
+    
+    try:
+        copy_result = new_blob_client.upload_blob_from_url(
+            sas_service.sign_blob(container_name, old_blob_path),
+            overwrite=True,
+            metadata=metadata,
+            tags=tags or None,
+            content_settings=content_settings
+        )
+        etag = copy_result.get('etag')
+    except HttpResponseError as sync_copy_error:
+        if getattr(sync_copy_error, 'status_code', None) in THROTTLING_STATUS_CODES:
+            raise
+        new_blob_client.start_copy_from_url(old_blob_client.url, metadata=metadata, tags=tags or None)
+        delay = RENAME_COPY_POLL_INITIAL_SECONDS
+        copy_properties = new_blob_client.get_blob_properties()
+        while copy_properties.copy.status == 'pending':
+            time.sleep(delay)
+            delay = min(delay * 2, RENAME_COPY_POLL_MAX_SECONDS)
+            copy_properties = new_blob_client.get_blob_properties()
+        if copy_properties.copy.status != 'success':
+            raise RuntimeError(f"Failed to copy blob: {copy_properties.copy.status}")
+        etag = new_blob_client.set_http_headers(content_settings=content_settings).get('etag')
+    
+    remember_blob_state(container_name, new_blob_path, tags=tags, metadata=metadata, etag=etag)
+
+
+# Blob index tag values only allow these characters (and at most 256 of them)
+BLOB_TAG_UNSAFE_CHARACTERS = re.compile(r'[^A-Za-z0-9 +\-./:=_]')
+BLOB_TAG_VALUE_MAX_LENGTH = 256
+
+
+def display_name_tag_value(display_name: str) -> str:
+    """
+    Tag-safe form of a display name: accents stripped, other disallowed characters as '_'.
+    
+    Example:
+        "PS_Zoë_Müller_(2)_Mars_2024.pdf" -> "PS_Zoe_Muller__2__Mars_2024.pdf"
+    """
+    ascii_name = unicodedata.normalize('NFKD', display_name).encode('ascii', 'ignore').decode('ascii')
+    return BLOB_TAG_UNSAFE_CHARACTERS.sub('_', ascii_name)[:BLOB_TAG_VALUE_MAX_LENGTH]
+
+
+def content_disposition_for(filename: str) -> str:
+    """Content-Disposition header that downloads a blob as filename (RFC 6266, with an ASCII fallback)."""
+    ascii_name = unicodedata.normalize('NFKD', filename).encode('ascii', 'ignore').decode('ascii').replace('"', '')
+    return f"attachment; filename=\"{ascii_name or 'payslip.pdf'}\"; filename*=UTF-8''{quote(filename, safe='')}"
+
+
+@trace_stage("rename")
+def apply_virtual_filename(blob_client, container_name: str, blob_name: str, display_name: str) -> None:
+    """
+    Give a blob a display/download name without moving it.
+    
+    Sets the display_name/file_name metadata and a Content-Disposition header. The
+    blob's other HTTP headers (including Content-MD5, which the result cache keys on)
+    are carried over from its current properties.
+    """
+    properties = blob_client.get_blob_properties()
+    metadata = {
+        **(properties.metadata or {}),
+        'display_name': quote(display_name),
+        'original_file_name': quote(display_name),
+        'file_name': quote(display_name)
+    }
+    result = blob_client.set_blob_metadata(metadata=metadata, etag=properties.etag, match_condition=MatchConditions.IfNotModified)
+    current = properties.content_settings
+    result = blob_client.set_http_headers(content_settings=ContentSettings(
+        content_type='application/pdf',
+        content_encoding=getattr(current, 'content_encoding', None),
+        content_language=getattr(current, 'content_language', None),
+        content_disposition=content_disposition_for(display_name),
+        cache_control=getattr(current, 'cache_control', None),
+        content_md5=getattr(current, 'content_md5', None)
+    )) or result
+    remember_blob_state(container_name, blob_name, metadata=metadata, etag=(result or {}).get('etag'))
+
+
+def find_payslips_by_display_name(display_name: str, environment: str = "staging", container_name: str = "document-repo") -> List[str]:
+    """
+    Resolve a virtual filename to the blob(s) carrying it, via the display_name blob index tag.
+    
+    The tag holds the name's tag-safe form (display_name_tag_value), so names that differ only
+    in accents or punctuation can resolve to several blobs.
+    
+    Returns:
+        Blob names (empty if nothing matches)
+    """
+    tag_value = display_name_tag_value(display_name)
+    if not tag_value:
+        return []
+    container_client = get_blob_storage_client(environment).get_container_client(container_name)
+    escaped = tag_value.replace("'", "''")
+    return [blob.name for blob in container_client.find_blobs_by_tags(f"\"display_name\" = '{escaped}'")]
+
+
+@trace_stage("rename_delete")
+def delete_blobs_in_batches(container_client, container_name: str, blob_paths: List[str], logger=None) -> int:
+    """
+    Delete blobs with batch requests (one request per RENAME_DELETE_BATCH_SIZE blobs).
+    
+    Returns:
+        Number of blobs that could not be deleted
+    """
+    failed = 0
+    for start in range(0, len(blob_paths), RENAME_DELETE_BATCH_SIZE):
+        batch = blob_paths[start:start + RENAME_DELETE_BATCH_SIZE]
+        try:
+            responses = container_client.delete_blobs(*batch, raise_on_any_failure=False)
+            statuses = [getattr(response, 'status_code', 202) for response in responses]
+        except Exception as batch_error:
+            # Batch requests unavailable (e.g. some emulators) - delete one by one
+            if logger:
+                logger.warning(f"Batch delete failed ({str(batch_error)}), deleting {len(batch)} blob(s) individually")
+            statuses = []
+            for blob_path in batch:
+                try:
+                    container_client.delete_blob(blob_path)
+                    statuses.append(202)
+                except Exception:
+                    statuses.append(500)
+        for blob_path, status in zip(batch, statuses):
+            if status in (200, 202, 404):
+                forget_blob_state(container_name, blob_path)
+            else:
+                failed += 1
+                if logger:
+                    logger.error(f"  ✗ Failed to delete old blob {blob_path} (status {status})")
+    return failed
+
+
 @task
+@trace_stage("rename_batch")
 def rename_matched_payslips_with_employee_names(
     tenant_id: str,
     process_instance_id: str,
     message_id: str,
-    environment: str = "staging"
+    environment: str = "staging",
+    rename_mode: str = "copy"
 ):
     """
     Rename matched payslip files with employee names and pay periods.
@@ -1945,18 +6495,32 @@ def rename_matched_payslips_with_employee_names(
     1. Queries all matched files in the batch
     2. Groups by employee and pay period
     3. Generates standardized names
-    4. Renames files in blob storage
-    5. Updates database file_reference
+    4. Copies files to their new names in parallel (server-side, synchronous)
+    5. Updates database file_reference in committed chunks
+    6. Deletes the old blobs in batches once their chunk is committed
+    
+    A failure part-way through keeps every committed chunk; files whose old blob was not
+    deleted yet still have both names in storage, never a dangling file_reference.
+    
+    In "virtual" mode steps 4 and 6 are skipped: blobs stay where they are, and the new name
+    is recorded as their display/download name (metadata, Content-Disposition, a display_name
+    index tag and extracted_data.matched_filename). file_reference is left unchanged.
     
     Args:
         tenant_id: Tenant ID
         process_instance_id: Process instance ID
         message_id: Message/batch ID
         environment: Environment (staging/production)
+        rename_mode: "copy" (rename the blobs) or "virtual" (display name only)
     """
     logger = get_run_logger()
-    logger.info(f"Starting payslip rename for batch {message_id}")
+    if rename_mode not in RENAME_MODES:
+        raise ValueError(f"rename_mode must be one of {RENAME_MODES}, got '{rename_mode}'")
+    logger.info(f"Starting payslip rename for batch {message_id} ({rename_mode} mode)")
     
+    conn = None
+    cursor = None
+    annotation_writer = None
     try:
         # Get database connection
         conn = get_db_connection(environment)
@@ -1978,186 +6542,124 @@ def rename_matched_payslips_with_employee_names(
         """, (tenant_id, process_instance_id, message_id))
         
         records = cursor.fetchall()
+        conn.commit()  # Don't hold the snapshot open while blobs are copied
         
         if not records:
             logger.info("No matched files to rename")
             return
         
         logger.info(f"Found {len(records)} files to potentially rename")
+        rename_start = time.time()
+        plan = plan_payslip_renames(records)
         
-        # Parse records and group by employee + pay period
-        grouped_files = {}  # Key: (employee_id, pay_period), Value: list of records
-        
-        for record in records:
-            record_id, file_reference, extracted_data, match_status = record
-            # extracted_data is already a dict (JSONB column), no need to parse
-            
-            employee_name = extracted_data.get('employee_name')
-            employee_id = extracted_data.get('employee_id')
-            pay_cycle = extracted_data.get('pay_cycle')
-            payment_date = extracted_data.get('payment_date')
-            
-            # Create grouping key (use pay_cycle or payment_date)
-            period_key = pay_cycle or payment_date or "unknown"
-            group_key = (employee_id or employee_name or "unknown", period_key)
-            
-            if group_key not in grouped_files:
-                grouped_files[group_key] = []
-            
-            grouped_files[group_key].append({
-                'id': record_id,
-                'file_reference': file_reference,
-                'extracted_data': extracted_data,
-                'employee_name': employee_name,
-                'employee_id': employee_id,
-                'pay_cycle': pay_cycle,
-                'payment_date': payment_date
-            })
-        
-        # Get blob service client
-        blob_service_client = get_blob_storage_client(environment)
-        
+        container_name = "document-repo"
+        container_client = get_blob_storage_client(environment).get_container_client(container_name)
+        sas_service = get_sas_service(environment)
+        
+        virtual = rename_mode == "virtual"
+        annotation_writer = BlobAnnotationWriter(environment, logger=logger) if virtual else None
+        
+        # A rerun of a checkpointed batch skips files already given the same display name
+        ledger = get_batch_ledger(environment, message_id)
+        if ledger is not None and virtual:
+            already_named = {
+                entry['id'] for entry in plan
+                if (ledger.get(entry['file_reference']) or {}).get('data', {}).get('display_name') == entry['new_filename']
+            }
+            if already_named:
+                logger.info(f"Resuming rename: {len(already_named)} file(s) already named by an earlier run")
+                plan = [entry for entry in plan if entry['id'] not in already_named]
+        
+        # Files that already have the right name only need matched_filename recorded
+        pending_rows = [] if virtual else [(entry['id'], None, entry['new_filename'], None) for entry in plan if not entry['needs_copy']]
+        pending_deletes = []
+        pending_checkpoints = []
         renamed_count = 0
-        
-        # Process each group
-        for group_key, files in grouped_files.items():
-            employee_key, period_key = group_key
-            total_files = len(files)
-            
-            logger.info(f"Processing group: {employee_key} - {period_key} ({total_files} file(s))")
-            
-            # Generate new names for each file in the group
-            for idx, file_info in enumerate(files, 1):
+        failed_count = 0
+        deletes_failed = 0
+        slugged_tags = 0
+        
+        def commit_chunk():
+            nonlocal pending_rows, pending_deletes, pending_checkpoints, deletes_failed
+            if pending_rows:
+                psycopg2.extras.execute_values(cursor, RENAME_BATCH_UPDATE_QUERY, pending_rows,
+                                               template=RENAME_ROW_TEMPLATE, page_size=len(pending_rows))
+                conn.commit()
+            if ledger is not None:
+                for entry in pending_checkpoints:
+                    if virtual:
+                        ledger.record(entry['file_reference'], None, ("renamed",), display_name=entry['new_filename'])
+                    else:
+                        ledger.record(entry['file_reference'], None, ("renamed",), renamed_to=entry['new_file_reference'])
+            if pending_deletes:
+                deletes_failed += delete_blobs_in_batches(container_client, container_name, pending_deletes, logger)
+            pending_rows, pending_deletes, pending_checkpoints = [], [], []
+        
+        with ThreadPoolExecutor(max_workers=RENAME_MAX_CONCURRENCY, thread_name_prefix="rename") as executor:
+            if virtual:
+                futures = {
+                    executor.submit(
+                        contextvars.copy_context().run, apply_virtual_filename,
+                        container_client.get_blob_client(entry['old_blob_path']), container_name,
+                        entry['old_blob_path'], entry['new_filename']
+                    ): entry
+                    for entry in plan
+                }
+            else:
+                futures = {
+                    executor.submit(
+                        contextvars.copy_context().run, copy_blob_for_rename, container_client, sas_service,
+                        container_name, entry['old_blob_path'], entry['new_blob_path'], entry['new_filename']
+                    ): entry
+                    for entry in plan if entry['needs_copy']
+                }
+            for future in as_completed(futures):
+                entry = futures[future]
                 try:
-                    old_file_reference = file_info['file_reference']
-                    
-                    # Generate new filename
-                    new_filename = generate_payslip_filename(
-                        employee_name=file_info['employee_name'],
-                        employee_id=file_info['employee_id'],
-                        pay_cycle=file_info['pay_cycle'],
-                        payment_date=file_info['payment_date'],
-                        sequence=idx if total_files > 1 else None,
-                        total=total_files if total_files > 1 else None
-                    )
-                    
-                    # Parse old blob path
-                    parsed_url = urlparse(old_file_reference)
-                    old_blob_path = unquote(parsed_url.path.lstrip('/'))  # Decode URL encoding
-                    
-                    # Remove container name if present
-                    path_parts = old_blob_path.split('/', 1)
-                    if len(path_parts) > 1:
-                        old_blob_path = path_parts[1]
-                    
-                    # Build new blob path (same directory, new filename)
-                    blob_dir = '/'.join(old_blob_path.split('/')[:-1])
-                    new_blob_path = f"{blob_dir}/{new_filename}"
-                    
-                    # Build new file reference URL
-                    new_file_reference = f"{parsed_url.scheme}://{parsed_url.netloc}/document-repo/{new_blob_path}"
-                    
-                    # Check if old and new names are the same
-                    old_filename = old_blob_path.split('/')[-1]
-                    if old_filename == new_filename:
-                        logger.info(f"  Skipping rename: {old_filename} (already has correct name)")
-                        # Still update database to add matched_filename if not present
-                        cursor.execute("""
-                            UPDATE payslip_matching_results
-                            SET extracted_data = jsonb_set(extracted_data, '{matched_filename}', %s::jsonb),
-                                "updatedAt" = CURRENT_TIMESTAMP
-                            WHERE id = %s
-                              AND (extracted_data->>'matched_filename' IS NULL 
-                                   OR extracted_data->>'matched_filename' != %s)
-                        """, (json.dumps(new_filename), file_info['id'], new_filename))
-                        continue
-                    
-                    logger.info(f"  Renaming: {old_filename} -> {new_filename}")
-                    
-                    # Copy blob to new name with proper content type
-                    container_name = "document-repo"
-                    container_client = blob_service_client.get_container_client(container_name)
-                    
-                    old_blob_client = container_client.get_blob_client(old_blob_path)
-                    new_blob_client = container_client.get_blob_client(new_blob_path)
-                    
-                    # Copy blob (preserves content)
-                    new_blob_client.start_copy_from_url(old_blob_client.url)
-                    
-                    # Wait for copy to complete
-                    copy_properties = new_blob_client.get_blob_properties()
-                    while copy_properties.copy.status == 'pending':
-                        time.sleep(0.1)
-                        copy_properties = new_blob_client.get_blob_properties()
-                    
-                    if copy_properties.copy.status != 'success':
-                        logger.error(f"  Failed to copy blob: {copy_properties.copy.status}")
-                        continue
-                    
-                    # Set content type on new blob
-                    new_blob_client.set_http_headers(content_settings=ContentSettings(content_type='application/pdf'))
-                    
-                    # Update metadata with matched filename
-                    try:
-                        # Get current metadata
-                        blob_properties = new_blob_client.get_blob_properties()
-                        current_metadata = blob_properties.metadata or {}
-                        
-                        # Get new file size
-                        new_file_size = blob_properties.size
-                        
-                        # Update metadata with matched filename
-                        current_metadata['original_file_name'] = quote(new_filename)
-                        current_metadata['file_name'] = quote(new_filename)
-                        current_metadata['file_size'] = str(new_file_size)
-                        
-                        # Set updated metadata
-                        new_blob_client.set_blob_metadata(metadata=current_metadata)
-                        logger.info(f"  Updated blob metadata with matched filename: {new_filename}")
-                    except Exception as metadata_error:
-                        logger.warning(f"  Failed to update blob metadata: {str(metadata_error)}")
-                        # Continue anyway - metadata update is not critical
-                    
-                    # Delete old blob
-                    old_blob_client.delete_blob()
-                    
-                    # Create audit log entry for rename
+                    future.result()
+                except Exception as rename_error:
+                    failed_count += 1
+                    logger.error(f"  ✗ Failed to rename {entry['old_filename']} -> {entry['new_filename']}: {str(rename_error)}")
+                    continue
+                
+                if virtual:
+                    rename_audit_entry = {
+                        "timestamp": datetime.utcnow().isoformat() + "Z",
+                        "action": "display_name_set",
+                        "details": {
+                            "filename": entry['old_filename'],
+                            "display_name": entry['new_filename'],
+                            "reason": "User-friendly name with employee name and pay period (blob not moved)"
+                        }
+                    }
+                    pending_rows.append((entry['id'], None, entry['new_filename'], json.dumps(rename_audit_entry)))
+                    tag_value = display_name_tag_value(entry['new_filename'])
+                    slugged_tags += tag_value != entry['new_filename']
+                    annotation_writer.update_tags(container_name, entry['old_blob_path'], {'display_name': tag_value})
+                else:
                     rename_audit_entry = {
                         "timestamp": datetime.utcnow().isoformat() + "Z",
                         "action": "file_renamed",
                         "details": {
-                            "old_filename": old_filename,
-                            "new_filename": new_filename,
+                            "old_filename": entry['old_filename'],
+                            "new_filename": entry['new_filename'],
                             "reason": "Renamed to user-friendly format with employee name and pay period"
                         }
                     }
-                    
-                    # Update database with new file_reference, add matched_filename, and append audit log
-                    cursor.execute("""
-                        UPDATE payslip_matching_results
-                        SET file_reference = %s,
-                            extracted_data = jsonb_set(extracted_data, '{matched_filename}', %s::jsonb),
-                            audit_log = jsonb_set(
-                                COALESCE(audit_log, '{"events":[]}'::jsonb),
-                                '{events}',
-                                COALESCE(audit_log->'events', '[]'::jsonb) || %s::jsonb
-                            ),
-                            "updatedAt" = CURRENT_TIMESTAMP
-                        WHERE id = %s
-                    """, (new_file_reference, json.dumps(new_filename), json.dumps(rename_audit_entry), file_info['id']))
-                    
-                    renamed_count += 1
-                    logger.info(f"  ✓ Renamed successfully")
-                    
-                except Exception as rename_error:
-                    logger.error(f"  ✗ Failed to rename file: {str(rename_error)}")
-                    # Continue with other files even if one fails
-                    continue
-        
-        # Commit all database updates
-        conn.commit()
-        
-        logger.info(f"Payslip rename completed: {renamed_count}/{len(records)} files renamed")
+                    pending_rows.append((entry['id'], entry['new_file_reference'], entry['new_filename'], json.dumps(rename_audit_entry)))
+                    pending_deletes.append(entry['old_blob_path'])
+                pending_checkpoints.append(entry)
+                renamed_count += 1
+                if len(pending_rows) >= RENAME_DB_CHUNK_SIZE:
+                    commit_chunk()
+                    logger.info(f"  Renamed {renamed_count}/{len(futures)} file(s) so far")
+        commit_chunk()
+        
+        if slugged_tags:
+            logger.info(f"{slugged_tags} display name(s) had characters blob index tags don't allow; tagged with their tag-safe form")
+        logger.info(f"Payslip rename completed: {renamed_count}/{len(records)} files {'named' if virtual else 'renamed'} "
+                    f"({len(plan) - len(futures)} already named, {failed_count} failed, "
+                    f"{deletes_failed} old blob(s) not deleted) in {time.time() - rename_start:.2f}s")
         
     except Exception as e:
         logger.error(f"Error in rename_matched_payslips_with_employee_names: {str(e)}")
@@ -2165,34 +6667,375 @@ def rename_matched_payslips_with_employee_names(
             conn.rollback()
         raise
     finally:
-        if cursor:
-            cursor.close()
-        if conn:
-            conn.close()
+        # Queued display_name tags are applied (and the writer's pool stopped) even after a failure
+        if annotation_writer:
+            annotation_stats = annotation_writer.close()
+            logger.info(f"Tagged {annotation_stats['mutations_applied']} file(s) with their display name "
+                        f"({annotation_stats['failures']} failed)")
+        if cursor:
+            cursor.close()
+        if conn:
+            conn.close()
+
+
+# Analyses kept in flight at once by the asyncio execution mode
+ASYNC_MAX_IN_FLIGHT_ANALYSES = 100
+
+
+def _finish_analyzed_document(
+    document_url: str,
+    result,
+    extraction_time: float,
+    start_time: float,
+    user_id: str,
+    process_instance_id: str,
+    tenant_id: str,
+    environment: str,
+    message_id: Optional[str],
+    fuzzy_matching: bool,
+    write_behind: bool,
+    blob_properties,
+    extracted_data: Optional[Dict[str, Any]] = None,
+    cache: Optional[DocumentResultCache] = None,
+    cache_key: Optional[str] = None
+) -> Dict[str, Any]:
+    """
+    Continuation for the asyncio mode: extract fields from an analysis result, then match and save.
+    
+    Runs on the continuation thread pool so blocking database work never stalls the event loop.
+    extracted_data is given instead of result for result cache hits; on a cache miss the
+    extraction is stored under cache_key and published to identical documents.
+    """
+    try:
+        if extracted_data is None:
+            try:
+                extracted_data = extract_payslip_fields(result, verbose=get_document_event_log(environment, message_id).verbose)
+            except Exception as e:
+                if cache_key:
+                    cache.resolve(cache_key, error=e)
+                raise
+            if cache_key:
+                cache.put(cache_key, extracted_data)
+                cache.resolve(cache_key, extracted_data)
+        return complete_document_processing(
+            document_url, extracted_data, extraction_time, start_time,
+            user_id, process_instance_id, tenant_id, environment, message_id,
+            fuzzy_matching=fuzzy_matching, write_behind=write_behind, blob_properties=blob_properties
+        )
+    except Exception as e:
+        return build_document_failure_result(document_url, e, start_time, user_id, process_instance_id, tenant_id, environment)
+
+
+async def _get_blob_properties_async(blob_service_client, document_url: str):
+    """Fetch blob properties with the async client; None lets the continuation fetch them itself."""
+    listed = get_listed_blob_properties(document_url)
+    if listed is not None or blob_service_client is None:
+        return listed
+    try:
+        container_name, blob_path = parse_blob_url(document_url)
+        blob_client = blob_service_client.get_blob_client(container=container_name, blob=blob_path)
+        with trace_stage("blob_properties"):
+            return await blob_client.get_blob_properties()
+    except Exception:
+        return None
+
+
+async def _get_content_key_async(cache: DocumentResultCache, blob_service_client, document_url: str) -> Tuple[Any, Optional[str]]:
+    """(blob properties, result cache key) for a document; either is None if unavailable."""
+    page = get_split_page(document_url)
+    if page and page.data is not None:
+        return None, cache.key_for(split_page_digest(page))
+    if page:
+        await asyncio.wrap_future(page.upload)
+    if blob_service_client is None:
+        return None, None
+    try:
+        container_name, blob_path = parse_blob_url(document_url)
+        properties = get_listed_blob_properties(document_url)
+        if properties is None:
+            blob_client = blob_service_client.get_blob_client(container=container_name, blob=blob_path)
+            with trace_stage("blob_properties"):
+                properties = await blob_client.get_blob_properties()
+    except Exception:
+        return None, None
+    return properties, cache.key_for(blob_content_digest(properties, f"{container_name}/{blob_path}"))
+
+
+async def _analyze_document_async(
+    document_url: str,
+    di_client,
+    blob_service_client,
+    model_id: str,
+    semaphore: Optional[asyncio.Semaphore],
+    controller: Optional[AdaptiveConcurrencyController],
+    lookup_semaphore: asyncio.Semaphore,
+    executor: ThreadPoolExecutor,
+    cache: Optional[DocumentResultCache],
+    user_id: str,
+    process_instance_id: str,
+    tenant_id: str,
+    environment: str,
+    message_id: Optional[str],
+    fuzzy_matching: bool,
+    write_behind: bool
+) -> Dict[str, Any]:
+    """
+    Analyze one document on the event loop and hand the result to a continuation thread.
+    
+    The concurrency slot (adaptive controller, or a fixed semaphore) is held only while the
+    analysis is in flight, so matching and saving never count against the Document
+    Intelligence concurrency limit. Result cache hits skip the analysis entirely; the blob
+    lookups that key the cache are bounded separately by lookup_semaphore.
+    """
+    loop = asyncio.get_running_loop()
+    start_time = time.time()
+    blob_properties = None
+    cache_key = None
+    owns_cache_key = False
+    result = None
+    extracted_data = None
+    
+    try:
+        extraction_start = time.time()
+        resumed = None
+        if get_batch_ledger(environment, message_id) is not None:
+            resumed = await loop.run_in_executor(executor, resume_document_checkpoint, document_url, environment, message_id)
+        extracted_data = take_preanalyzed_document(document_url)
+        if resumed is not None:
+            extracted_data = dict(resumed[0]["data"]["extracted_data"])
+            blob_properties = resumed[1]
+        if cache and extracted_data is None:
+            async with lookup_semaphore:
+                blob_properties, cache_key = await _get_content_key_async(cache, blob_service_client, document_url)
+        if cache_key:
+            owner, future = cache.claim(cache_key)
+            if not owner:
+                extracted_data = dict(await asyncio.wrap_future(future))
+            else:
+                owns_cache_key = True
+                extracted_data = await loop.run_in_executor(executor, cache.get, cache_key)
+                if extracted_data is not None:
+                    owns_cache_key = False
+                    cache.resolve(cache_key, extracted_data)
+        
+        if extracted_data is None:
+            result, blob_properties = await _run_analysis_async(
+                document_url, di_client, blob_service_client, model_id, semaphore, controller, blob_properties
+            )
+        extraction_time = time.time() - extraction_start
+    except Exception as e:
+        if owns_cache_key:
+            cache.resolve(cache_key, error=e)
+        return build_document_failure_result(document_url, e, start_time, user_id, process_instance_id, tenant_id, environment)
+    
+    # Carry the Prefect run context over to the continuation thread
+    continuation = functools.partial(
+        _finish_analyzed_document, document_url, result, extraction_time, start_time,
+        user_id, process_instance_id, tenant_id, environment, message_id,
+        fuzzy_matching, write_behind, blob_properties,
+        extracted_data=extracted_data, cache=cache, cache_key=cache_key if owns_cache_key else None
+    )
+    return await loop.run_in_executor(executor, contextvars.copy_context().run, continuation)
+
+
+async def _run_analysis_async(
+    document_url: str,
+    di_client,
+    blob_service_client,
+    model_id: str,
+    semaphore: Optional[asyncio.Semaphore],
+    controller: Optional[AdaptiveConcurrencyController],
+    blob_properties=None
+) -> Tuple[Any, Any]:
+    """
+    Run one Document Intelligence analysis, fetching blob properties alongside it if not given.
+    
+    Returns:
+        (analysis result, blob properties or None)
+    """
+    # Split pages still in memory are sent as bytes; their blob may not exist yet, so
+    # properties are left to the continuation (which waits for the upload)
+    page = get_split_page(document_url)
+    page_data = page.data if page else None
+    if page and page_data is None:
+        await asyncio.wrap_future(page.upload)
+    
+    if controller:
+        started_at = await controller.acquire_async()
+    else:
+        await semaphore.acquire()
+    properties_task = None
+    if blob_properties is None and page is None:
+        properties_task = asyncio.ensure_future(_get_blob_properties_async(blob_service_client, document_url))
+    try:
+        body_args, body_kwargs = analyze_request_args(document_url, page_data)
+        body_kwargs["raw_response_hook"] = analysis_response_hook(controller)
+        with trace_stage("di_submit", model=model_id):
+            poller = await di_client.begin_analyze_document(model_id, *body_args, **body_kwargs)
+        with trace_stage("di_poll", model=model_id):
+            result = await poller.result()
+    except Exception as e:
+        if controller:
+            controller.release(started_at, error=e)
+        raise
+    else:
+        if controller:
+            controller.release(started_at)
+    finally:
+        if not controller:
+            semaphore.release()
+        if properties_task is not None:
+            blob_properties = await properties_task
+    if page:
+        release_split_page_data(page)
+    return result, blob_properties
+
+
+async def _process_documents_async(
+    document_urls: List[str],
+    user_id: str,
+    process_instance_id: str,
+    tenant_id: str,
+    environment: str,
+    message_id: Optional[str],
+    fuzzy_matching: bool,
+    write_behind: bool,
+    model_id: str,
+    max_workers: int,
+    max_in_flight: int
+) -> List[Tuple[str, Any]]:
+    """
+    Run all document analyses concurrently from a single event loop.
+    
+    In-flight analyses are bounded by the batch's adaptive concurrency controller when
+    one is open, otherwise by max_in_flight; the blob lookups that key the result cache
+    are bounded by max_in_flight as well.
+    
+    Returns:
+        (document_url, result) pairs in input order; result is an exception if the
+        document's coroutine itself failed
+    """
+    logger = get_run_logger()
+    
+    endpoint = get_cached_secret(f"document-intelligence-endpoint-{environment}")
+    key = get_cached_secret(f"document-intelligence-key-{environment}")
+    
+    # Blob properties are prefetched alongside each analysis when a connection string is available;
+    # otherwise the continuation falls back to the synchronous lookup
+    try:
+        connection_string = get_cached_secret(f"azure-storage-connection-string-{environment}")
+        blob_service_client = AsyncBlobServiceClient.from_connection_string(connection_string)
+    except Exception as e:
+        logger.info(f"Async blob client unavailable, blob properties will be fetched per document: {str(e)}")
+        blob_service_client = None
+    
+    controller = get_concurrency_controller(environment, message_id)
+    semaphore = None if controller else asyncio.Semaphore(max(1, max_in_flight))
+    # Result cache keys may need a properties call per document: bound those too, not just analyses
+    lookup_semaphore = asyncio.Semaphore(max(1, max_in_flight))
+    cache = get_document_result_cache(environment, message_id)
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    try:
+        async with AsyncDocumentIntelligenceClient(endpoint=endpoint, credential=AzureKeyCredential(key)) as di_client:
+            results = await asyncio.gather(
+                *(
+                    _analyze_document_async(
+                        url, di_client, blob_service_client, model_id, semaphore, controller, lookup_semaphore, executor, cache,
+                        user_id, process_instance_id, tenant_id, environment, message_id,
+                        fuzzy_matching, write_behind
+                    )
+                    for url in document_urls
+                ),
+                return_exceptions=True
+            )
+    finally:
+        if blob_service_client is not None:
+            await blob_service_client.close()
+        executor.shutdown(wait=True)
+    
+    return list(zip(document_urls, results))
 
 
-@task
-def process_document_urls(document_urls: List[str], user_id: str, process_instance_id: str, tenant_id: str, max_workers: int = 3, environment: str = "staging", message_id: Optional[str] = None):
+def run_coroutine_blocking(coroutine):
     """
-    Process multiple documents from their URLs in parallel.
+    Run a coroutine to completion from synchronous code.
+    
+    Uses asyncio.run directly, or a helper thread when this thread already runs an event loop.
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coroutine)
+    
+    with ThreadPoolExecutor(max_workers=1) as runner:
+        return runner.submit(contextvars.copy_context().run, asyncio.run, coroutine).result()
+
+
+def open_document_batch(
+    environment: str,
+    message_id: Optional[str],
+    pool_size: int,
+    write_behind: bool = False,
+    result_cache: Optional[str] = None,
+    need_model_id: bool = False
+) -> Optional[str]:
+    """
+    Open the per-batch resources workers share: DB pool size, blob annotation writer,
+    write-behind writer and result cache. Pair with finalize_document_batch().
+    
+    Returns:
+        The Document Intelligence model ID if it was resolved (result cache or need_model_id), else None
+    """
+    logger = get_run_logger()
+    
+    # Make sure every worker can hold a pooled DB connection without waiting
+    configure_db_pool(environment, pool_size)
+
+    # Blob tag updates made while saving results are queued and applied in the background
+    open_blob_annotation_writer(environment, message_id)
+    if write_behind:
+        open_matching_result_writer(environment, message_id)
+    
+    model_id = None
+    if result_cache or need_model_id:
+        model_id = get_document_intelligence_model_id(environment)
+    if result_cache:
+        try:
+            open_document_result_cache(environment, message_id, result_cache, model_id)
+        except Exception as e:
+            logger.warning(f"Analysis result cache unavailable, analyzing every document: {str(e)}")
+    return model_id
+
+
+def finalize_document_batch(
+    document_results: List[Tuple[str, Any]],
+    document_urls: List[str],
+    user_id: str,
+    process_instance_id: str,
+    environment: str,
+    message_id: Optional[str],
+    write_behind: bool,
+    start_time: float
+) -> List[Dict[str, Any]]:
+    """
+    Aggregate a batch's per-document results, close its resources, log the summary and notify the user.
     
     Args:
-        document_urls: List of document URLs with SAS tokens
-        user_id: The user ID
-        process_instance_id: The process instance ID (payroll process)
-        tenant_id: The tenant ID
-        max_workers: Maximum number of parallel workers (default: 3)
-        environment: The environment (staging/production)
-        message_id: Optional batch ID to track upload sessions
+        document_results: (url, result dict or exception) per processed document
+        document_urls: Every URL the batch processed (their split-page/pre-analysis entries are released)
+        start_time: time.time() when the batch started
+        (remaining arguments as for process_document_urls)
+    
+    Returns:
+        List of {"id", "file", "match_status"} for the saved documents
     """
     logger = get_run_logger()
-    start_time = time.time()
-    logger.info(f"Processing {len(document_urls)} documents with {max_workers} parallel workers")
     
     match_results = []
+    pending_results = []  # (match_result, file_reference) awaiting a write-behind record ID
     failed_results = []
     performance_stats = {
-        "total_documents": len(document_urls),
+        "total_documents": len(document_results),
         "successful": 0,
         "failed": 0,
         "total_extraction_time": 0,
@@ -2200,47 +7043,83 @@ def process_document_urls(document_urls: List[str], user_id: str, process_instan
         "total_save_time": 0
     }
     
-    # Process documents in parallel
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        # Submit all tasks
-        future_to_url = {
-            executor.submit(process_single_document, url, user_id, process_instance_id, tenant_id, environment, message_id): url 
-            for url in document_urls
-        }
-        
-        # Collect results as they complete
-        for future in as_completed(future_to_url):
-            url = future_to_url[future]
-            try:
-                result = future.result()
-                
-                if result["success"]:
-                    match_results.append({
-                        "id": result["id"],
-                        "file": result["file"],
-                        "match_status": result["match_status"]
-                    })
-                    performance_stats["successful"] += 1
-                    
-                    # Aggregate performance metrics
-                    perf = result["performance"]
-                    performance_stats["total_extraction_time"] += perf.get("extraction_time", 0)
-                    performance_stats["total_matching_time"] += perf.get("matching_time", 0)
-                    performance_stats["total_save_time"] += perf.get("save_time", 0)
-                else:
-                    failed_results.append({
-                        "file": result["file"],
-                        "error": result["error"]
-                    })
-                    performance_stats["failed"] += 1
-                    
-            except Exception as e:
-                logger.error(f"Unexpected error processing {url}: {str(e)}")
-                failed_results.append({
-                    "file": url.split('/')[-1].split('?')[0] or "unknown",
-                    "error": str(e)
-                })
+    for url, result in document_results:
+        if isinstance(result, Exception):
+            logger.error(f"Unexpected error processing {url}: {str(result)}")
+            failed_results.append({
+                "file": url.split('/')[-1].split('?')[0] or "unknown",
+                "error": str(result)
+            })
+            performance_stats["failed"] += 1
+        elif result["success"]:
+            match_result = {
+                "id": result["id"],
+                "file": result["file"],
+                "match_status": result["match_status"]
+            }
+            if result["id"] is None:
+                pending_results.append((match_result, result["file_reference"]))
+            else:
+                match_results.append(match_result)
+            performance_stats["successful"] += 1
+            
+            # Aggregate performance metrics
+            perf = result["performance"]
+            performance_stats["total_extraction_time"] += perf.get("extraction_time_seconds", 0)
+            performance_stats["total_matching_time"] += perf.get("matching_time_seconds", 0)
+            performance_stats["total_save_time"] += perf.get("save_time_seconds", 0)
+        else:
+            failed_results.append({
+                "file": result["file"],
+                "error": result["error"]
+            })
+            performance_stats["failed"] += 1
+    
+    if write_behind:
+        # Flush everything still queued so every result is committed before notifying
+        writer = close_matching_result_writer(environment, message_id)
+        record_ids = writer.record_ids if writer else {}
+        for match_result, file_reference in pending_results:
+            match_result["id"] = record_ids.get(file_reference)
+            if match_result["id"] is not None:
+                match_results.append(match_result)
+            else:
+                failed_results.append({"file": match_result["file"], "error": "Write-behind save failed"})
+                performance_stats["successful"] -= 1
                 performance_stats["failed"] += 1
+        if writer:
+            logger.info(f"Write-behind saves: {writer.stats['rows']} row(s) in {writer.stats['commits']} commit(s), "
+                        f"{writer.stats['failed_rows']} failed")
+    
+    for url in document_urls:
+        forget_split_page(url)
+        take_preanalyzed_document(url)
+        forget_listed_blob(url)
+    
+    close_existing_metadata(environment, message_id)
+    cache_stats = close_document_result_cache(environment, message_id)
+    if cache_stats:
+        logger.info(f"Analysis result cache: {cache_stats['hits']} hit(s), {cache_stats['misses']} miss(es), "
+                    f"{cache_stats['deduplicated']} in-batch duplicate(s), {cache_stats['stores']} stored, {cache_stats['errors']} error(s)")
+    
+    event_log_stats = close_document_event_log(environment, message_id)
+    if event_log_stats:
+        logger.info(f"Structured document log: {event_log_stats['emitted']} event(s) emitted, "
+                    f"{event_log_stats['sampled_out']} sampled out, {event_log_stats['over_budget']} dropped over budget")
+    
+    concurrency_stats = close_concurrency_controller(environment, message_id)
+    if concurrency_stats:
+        logger.info(f"Adaptive concurrency: final limit {concurrency_stats['limit']}, peak in flight {concurrency_stats['peak_in_flight']}, "
+                    f"{concurrency_stats['increases']} increase(s), {concurrency_stats['decreases']} decrease(s), "
+                    f"{concurrency_stats['throttled_responses']} throttled response(s), {concurrency_stats['latency_spikes']} latency spike(s), "
+                    f"{concurrency_stats['wait_seconds']:.1f}s waiting for slots")
+    
+    # Apply all queued blob tag updates before the batch is reported (and renamed)
+    annotation_stats = close_blob_annotation_writer(environment, message_id)
+    if annotation_stats:
+        logger.info(f"Blob annotations: {annotation_stats['mutations_applied']} blob(s) updated with "
+                    f"{annotation_stats['storage_calls']} storage call(s) "
+                    f"({annotation_stats['updates_coalesced']} update(s) coalesced, {annotation_stats['failures']} failed)")
     
     total_processing_time = time.time() - start_time
     performance_stats["total_processing_time"] = total_processing_time
@@ -2263,6 +7142,27 @@ def process_document_urls(document_urls: List[str], user_id: str, process_instan
         avg_save = performance_stats["total_save_time"] / performance_stats["successful"]
         logger.info(f"Average times - Extraction: {avg_extraction:.2f}s, Matching: {avg_matching:.2f}s, Save: {avg_save:.2f}s")
     
+    # Cumulative for this process (the same values the metrics endpoint exposes)
+    stage_latencies = METRICS.histogram_summary("payslip_stage_duration_seconds", "stage")
+    if stage_latencies:
+        logger.info("Stage latencies - " + ", ".join(
+            f"{stage}: {entry['count']} x {entry['mean']:.3f}s avg ({entry['max']:.3f}s max, {entry['total']:.1f}s total)"
+            for stage, entry in sorted(stage_latencies.items(), key=lambda item: -item[1]['total'])
+        ))
+    flush_instrumentation()
+
+    client_stats = {name: stats for name, stats in get_shared_client_stats().items() if name.endswith(f":{environment}")}
+    if client_stats:
+        logger.info("Shared clients - " + ", ".join(
+            f"{name}: {stats['created']} created, {stats['reused']} reused" for name, stats in sorted(client_stats.items())
+        ))
+
+    pool_stats = get_db_pool_stats(environment).get(environment, {})
+    if pool_stats:
+        logger.info(f"DB pool stats - created: {pool_stats['connections_created']}, checkouts: {pool_stats['checkouts']}, "
+                    f"waits: {pool_stats['waits']} (avg {pool_stats['avg_wait_seconds']:.3f}s, max {pool_stats['max_wait_seconds']:.3f}s), "
+                    f"peak in use: {pool_stats['peak_in_use']}/{pool_stats['max_size']}")
+
     if failed_results:
         logger.warning(f"Failed to process {len(failed_results)} documents:")
         for failed in failed_results:
@@ -2276,10 +7176,639 @@ def process_document_urls(document_urls: List[str], user_id: str, process_instan
     return match_results
 
 
+@task
+def process_document_urls(document_urls: List[str], user_id: str, process_instance_id: str, tenant_id: str, max_workers: int = 3, environment: str = "staging", message_id: Optional[str] = None, fuzzy_matching: bool = False, write_behind: bool = False, execution_mode: str = "threads", max_in_flight: int = ASYNC_MAX_IN_FLIGHT_ANALYSES, adaptive_concurrency: bool = False, max_concurrency: int = ADAPTIVE_MAX_CONCURRENCY, result_cache: Optional[str] = None, fanout_processes: int = 0):
+    """
+    Process multiple documents from their URLs in parallel.
+    
+    Args:
+        document_urls: List of document URLs with SAS tokens
+        user_id: The user ID
+        process_instance_id: The process instance ID (payroll process)
+        tenant_id: The tenant ID
+        max_workers: Maximum number of parallel workers (default: 3)
+        environment: The environment (staging/production)
+        message_id: Optional batch ID to track upload sessions
+        fuzzy_matching: Fall back to fuzzy name matching when no exact match is found
+        write_behind: Batch result upserts through a write-behind writer; it is flushed
+            (and record IDs resolved) before the notification is sent
+        execution_mode: "threads" (one worker thread per in-progress document) or "asyncio"
+            (analyses polled from one event loop; max_workers then sizes the matching/saving pool)
+        max_in_flight: Maximum concurrent Document Intelligence analyses in asyncio mode
+        adaptive_concurrency: Adapt the number of in-flight analyses (AIMD) instead of using a
+            fixed count: start at max_workers, grow while latency is healthy, cut on 429/503
+            or latency spikes and honour Retry-After
+        max_concurrency: Upper bound for the adaptive limit in threaded mode (asyncio mode
+            uses max_in_flight)
+        result_cache: Cache extracted fields by blob content hash in "disk:<directory>" or "postgres"
+            storage, skipping the analysis of files seen before or duplicated in the batch
+        fanout_processes: Shard the batch across this many worker processes (each running
+            max_workers threads); 0 or 1 processes everything in this process
+    """
+    logger = get_run_logger()
+    start_time = time.time()
+    
+    if execution_mode == "asyncio" and not ASYNC_AZURE_AVAILABLE:
+        logger.warning("Async Azure clients (aiohttp) are not installed, falling back to threaded execution")
+        execution_mode = "threads"
+    elif execution_mode not in ("threads", "asyncio"):
+        raise ValueError(f"Unknown execution_mode '{execution_mode}' (expected 'threads' or 'asyncio')")
+    
+    if fanout_processes > 1 and not fanout_available():
+        logger.warning(f"fanout_processes ignored: worker processes can't import module '{__name__}' by name "
+                       f"(load it from a directory on sys.path)")
+        fanout_processes = 0
+    if fanout_processes > 1:
+        if execution_mode == "asyncio":
+            logger.warning("execution_mode 'asyncio' is ignored with fanout_processes (shards run on threads)")
+        document_results = process_documents_fanout(
+            document_urls, fanout_processes, max_workers, user_id, process_instance_id, tenant_id, environment, message_id,
+            fuzzy_matching=fuzzy_matching, write_behind=write_behind, adaptive_concurrency=adaptive_concurrency,
+            max_concurrency=max_concurrency, result_cache=result_cache
+        )
+        # Shards flush their own write-behind writers and return resolved record IDs
+        return finalize_document_batch(document_results, document_urls, user_id, process_instance_id, environment, message_id, False, start_time)
+    
+    # Threaded mode needs a worker per potential in-flight analysis; the controller decides how many run
+    analysis_workers = max_workers
+    if adaptive_concurrency:
+        limit_ceiling = max_in_flight if execution_mode == "asyncio" else max(max_workers, max_concurrency)
+        open_concurrency_controller(environment, message_id, initial_limit=max_workers, max_limit=limit_ceiling, logger=logger)
+        if execution_mode == "threads":
+            analysis_workers = limit_ceiling
+        logger.info(f"Adaptive analysis concurrency: starting at {max_workers}, up to {limit_ceiling}")
+    
+    if execution_mode == "asyncio":
+        logger.info(f"Processing {len(document_urls)} documents with up to {max_in_flight} analyses in flight "
+                    f"and {max_workers} continuation workers")
+    else:
+        logger.info(f"Processing {len(document_urls)} documents with {analysis_workers} parallel workers")
+
+    # Every threaded worker may save a result, so the pool covers all of them; asyncio saves on max_workers continuations
+    model_id = open_document_batch(
+        environment, message_id, pool_size=analysis_workers, write_behind=write_behind,
+        result_cache=result_cache, need_model_id=execution_mode == "asyncio"
+    )
+    prefetch_existing_metadata(tenant_id, process_instance_id, document_urls, environment, message_id)
+    
+    document_results = []  # (url, result dict or exception)
+    if execution_mode == "asyncio":
+        document_results = run_coroutine_blocking(_process_documents_async(
+            document_urls, user_id, process_instance_id, tenant_id, environment, message_id,
+            fuzzy_matching, write_behind, model_id, max_workers, max_in_flight
+        ))
+    else:
+        document_results = process_documents_threaded(
+            document_urls, analysis_workers, user_id, process_instance_id, tenant_id,
+            environment, message_id, fuzzy_matching, write_behind
+        )
+    
+    return finalize_document_batch(document_results, document_urls, user_id, process_instance_id, environment, message_id, write_behind, start_time)
+
+
+def process_documents_threaded(
+    document_urls: List[str],
+    workers: int,
+    user_id: str,
+    process_instance_id: str,
+    tenant_id: str,
+    environment: str,
+    message_id: Optional[str],
+    fuzzy_matching: bool = False,
+    write_behind: bool = False
+) -> List[Tuple[str, Any]]:
+    """Run process_single_document for every URL on a thread pool. Returns (url, result dict or exception) pairs."""
+    document_results = []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        # Submit all tasks
+        future_to_url = {
+            executor.submit(contextvars.copy_context().run, process_single_document, url, user_id, process_instance_id, tenant_id, environment, message_id, fuzzy_matching, write_behind): url 
+            for url in document_urls
+        }
+        
+        # Collect results as they complete
+        for future in as_completed(future_to_url):
+            url = future_to_url[future]
+            try:
+                document_results.append((url, future.result()))
+            except Exception as e:
+                document_results.append((url, e))
+    return document_results
+
+
+# Process fan-out
+# Very large batches can be sharded across worker processes, so PDF work, matching and logging
+# use more than one core. Each worker runs the threaded per-document path on its shards with its
+# own clients, DB pool, result cache and write-behind writer; the per-document results come back
+# to the flow's process, where finalize_document_batch aggregates them and sends one notification.
+# Workers are spawned interpreters that resolve this module's functions by name, so the module
+# must be importable from sys.path (or be the main script); otherwise the batch runs in-process.
+FANOUT_SHARDS_PER_PROCESS = 4  # Shards per worker process, so faster workers pick up more of the batch
+FANOUT_SHARD_ATTEMPTS = 2      # With checkpointing, a shard whose worker fails is retried once, in a fresh pool
+
+
+def _init_fanout_worker(secrets: Dict[str, str]) -> None:
+    """Process pool initializer: seed the worker's secret cache with the flow's resolved secrets."""
+    _SECRET_CACHE.update(secrets)
+
+
+def fanout_available() -> bool:
+    """Whether spawned worker processes can import this module to run its shards."""
+    if __name__ == "__main__":
+        return True  # Spawned workers re-run the main script as __mp_main__
+    return importlib.machinery.PathFinder.find_spec(__name__.split(".")[0], sys.path) is not None
+
+
+def shard_documents(document_urls: List[str], shard_count: int) -> List[List[str]]:
+    """Split URLs into at most shard_count contiguous shards of (nearly) equal size."""
+    shard_size = max(1, -(-len(document_urls) // max(1, shard_count)))
+    return [document_urls[start:start + shard_size] for start in range(0, len(document_urls), shard_size)]
+
+
+@task
+def process_document_shard(
+    shard_index: int,
+    document_urls: List[str],
+    preanalyzed: Dict[str, Dict[str, Any]],
+    user_id: str,
+    process_instance_id: str,
+    tenant_id: str,
+    environment: str,
+    message_id: Optional[str],
+    max_workers: int = 3,
+    options: Optional[Dict[str, Any]] = None
+) -> List[Tuple[str, Any]]:
+    """
+    Process one shard of a fanned-out batch inside a worker process.
+    
+    Opens the shard's batch resources, processes its documents on max_workers threads and
+    closes the resources again, resolving write-behind record IDs before returning.
+    
+    Args:
+        preanalyzed: Extractions of the shard's documents analyzed by the multipage split, by URL
+        options: Batch options of the flow's process (fuzzy_matching, write_behind,
+            adaptive_concurrency, max_concurrency, result_cache, lightweight_tasks, log_mode,
+            log_sample_rate, log_budget, checkpoint)
+    
+    Returns:
+        (url, result dict or RuntimeError) per document; errors are re-raised as RuntimeError
+        so they always pickle back to the flow's process
+    """
+    logger = get_run_logger()
+    options = options or {}
+    write_behind = options.get("write_behind", False)
+    
+    set_lightweight_tasks(options.get("lightweight_tasks", False))
+    open_document_event_log(environment, message_id, options.get("log_mode", "verbose"),
+                            sample_rate=options.get("log_sample_rate", LOG_DETAIL_SAMPLE_RATE),
+                            budget=options.get("log_budget", LOG_EVENT_BUDGET))
+    if options.get("checkpoint"):
+        open_batch_ledger(environment, message_id)
+    for url, extracted_data in preanalyzed.items():
+        hold_preanalyzed_document(url, extracted_data)
+    
+    workers = max_workers
+    if options.get("adaptive_concurrency"):
+        # max_concurrency is this process's share of the batch's ceiling (see process_documents_fanout)
+        workers = options.get("max_concurrency", ADAPTIVE_MAX_CONCURRENCY)
+        open_concurrency_controller(environment, message_id, initial_limit=min(max_workers, workers), max_limit=workers, logger=logger)
+    open_document_batch(environment, message_id, pool_size=workers, write_behind=write_behind,
+                        result_cache=options.get("result_cache"))
+    prefetch_existing_metadata(tenant_id, process_instance_id, document_urls, environment, message_id)
+    try:
+        document_results = process_documents_threaded(
+            document_urls, workers, user_id, process_instance_id, tenant_id,
+            environment, message_id, options.get("fuzzy_matching", False), write_behind
+        )
+    finally:
+        writer = close_matching_result_writer(environment, message_id) if write_behind else None
+        close_document_result_cache(environment, message_id)
+        close_concurrency_controller(environment, message_id)
+        close_blob_annotation_writer(environment, message_id)
+        close_document_event_log(environment, message_id)
+        close_batch_ledger(environment, message_id)
+        close_existing_metadata(environment, message_id)
+        for url in document_urls:
+            take_preanalyzed_document(url)
+    
+    record_ids = writer.record_ids if writer else {}
+    shard_results = []
+    for url, result in document_results:
+        if isinstance(result, Exception):
+            result = RuntimeError(f"{type(result).__name__}: {result}")
+        elif write_behind and result["success"] and result["id"] is None:
+            result["id"] = record_ids.get(result["file_reference"])
+            if result["id"] is None:
+                result = {"success": False, "error": "Write-behind save failed", "file": result["file"], "performance": result["performance"]}
+        shard_results.append((url, result))
+    
+    logger.info(f"Shard {shard_index}: {len(document_urls)} document(s) processed by worker process {os.getpid()}")
+    return shard_results
+
+
+def _run_document_shard(*args) -> List[Tuple[str, Any]]:
+    # Process pool entry point (a plain function, pickled by reference)
+    return process_document_shard(*args)
+
+
+def process_documents_fanout(
+    document_urls: List[str],
+    processes: int,
+    max_workers: int,
+    user_id: str,
+    process_instance_id: str,
+    tenant_id: str,
+    environment: str,
+    message_id: Optional[str],
+    fuzzy_matching: bool = False,
+    write_behind: bool = False,
+    adaptive_concurrency: bool = False,
+    max_concurrency: int = ADAPTIVE_MAX_CONCURRENCY,
+    result_cache: Optional[str] = None
+) -> List[Tuple[str, Any]]:
+    """
+    Shard a batch across worker processes and gather the per-document results.
+    
+    Split pages still uploading from memory are waited for first (workers analyze them by URL),
+    and multipage pre-analyses are sent along with their shard; they stay held here until the
+    shard succeeds. With checkpointing, a shard whose worker fails is retried once in a fresh
+    pool and resumes from the batch ledger; a shard that still fails (or any failed shard without
+    checkpointing) reports the error for each of its documents.
+    
+    With adaptive_concurrency, max_concurrency bounds the whole batch: each process gets an equal
+    share as its own ceiling, so throttling in one process can't be offset by the others.
+    
+    Returns:
+        (url, result dict or exception) per document, as process_documents_threaded
+    """
+    logger = get_run_logger()
+    
+    for url in document_urls:
+        page = get_split_page(url)
+        if page:
+            page.wait_for_upload()
+            release_split_page_data(page)
+    
+    event_log = get_document_event_log(environment, message_id)
+    options = {
+        "fuzzy_matching": fuzzy_matching,
+        "write_behind": write_behind,
+        "adaptive_concurrency": adaptive_concurrency,
+        "max_concurrency": max(1, max_concurrency // processes),
+        "result_cache": result_cache,
+        "lightweight_tasks": _LIGHTWEIGHT_TASKS.get(),
+        "log_mode": event_log.mode,
+        "log_sample_rate": event_log.sample_rate,
+        "log_budget": event_log.budget,
+        "checkpoint": get_batch_ledger(environment, message_id) is not None
+    }
+    secrets = dict(_SECRET_CACHE)
+    
+    shards = shard_documents(document_urls, processes * FANOUT_SHARDS_PER_PROCESS)
+    logger.info(f"Fanning out {len(document_urls)} documents to {processes} worker processes "
+                f"({len(shards)} shard(s), {max_workers} threads per process)")
+    
+    # A retried shard starts over, so it is only retried when the batch ledger lets it skip the
+    # documents its failed attempt already analyzed or saved
+    attempts = FANOUT_SHARD_ATTEMPTS if options["checkpoint"] else 1
+    
+    document_results = []
+    pending_shards = list(enumerate(shards))
+    for attempt in range(1, attempts + 1):
+        failed_shards = []
+        with ProcessPoolExecutor(max_workers=min(processes, len(pending_shards)), mp_context=multiprocessing.get_context("spawn"),
+                                 initializer=_init_fanout_worker, initargs=(secrets,)) as executor:
+            future_to_shard = {}
+            for index, shard in pending_shards:
+                preanalyzed = {}
+                for url in shard:
+                    extracted_data = peek_preanalyzed_document(url)
+                    if extracted_data is not None:
+                        preanalyzed[url] = extracted_data
+                future = executor.submit(
+                    _run_document_shard, index, shard, preanalyzed, user_id, process_instance_id, tenant_id,
+                    environment, message_id, max_workers, options
+                )
+                future_to_shard[future] = (index, shard)
+            
+            for future in as_completed(future_to_shard):
+                index, shard = future_to_shard[future]
+                try:
+                    document_results.extend(future.result())
+                except Exception as e:
+                    logger.error(f"Shard of {len(shard)} document(s) failed in its worker process (attempt {attempt}): {str(e)}")
+                    failed_shards.append((index, shard, e))
+                    continue
+                for url in shard:
+                    take_preanalyzed_document(url)
+        
+        pending_shards = [(index, shard) for index, shard, _ in failed_shards]
+        if not pending_shards:
+            break
+    
+    for _, shard, error in failed_shards:
+        document_results.extend((url, error) for url in shard)
+    return document_results
+
+
+# Streaming pipeline
+# list -> sign -> split -> analyze -> match/save run as concurrent stages connected by bounded
+# queues: documents are analyzed while later PDFs are still being listed or split, and a full
+# queue blocks the stage feeding it, so memory stays flat however large the batch is.
+PIPELINE_DEFAULT_WORKERS = {"sign": 1, "split": 4, "analyze": 8, "save": 4}
+PIPELINE_QUEUE_FACTOR = 2  # Queue capacity per stage, in multiples of its worker count
+
+_PIPELINE_DONE = object()
+
+
+class StagedPipeline:
+    """
+    Runs items through a chain of stages, each a pool of worker threads reading a bounded queue.
+    
+    A stage handler is called as handler(item, emit) and calls emit(output) for every item it
+    passes on (zero or more). Handler exceptions are counted and logged; the item is dropped.
+    """
+
+    def __init__(self, name: str = "pipeline", logger=None):
+        self.name = name
+        self.logger = logger or get_run_logger()
+        self.stages: List[Dict[str, Any]] = []
+        self.first_output_seconds: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def add_stage(self, name: str, handler, workers: int = 1, queue_size: Optional[int] = None) -> "StagedPipeline":
+        """Append a stage with its own worker count and input queue capacity."""
+        workers = max(1, int(workers))
+        self.stages.append({
+            "name": name,
+            "handler": handler,
+            "workers": workers,
+            "queue": queue.Queue(maxsize=queue_size or workers * PIPELINE_QUEUE_FACTOR),
+            "running": workers,
+            "stats": {"items": 0, "emitted": 0, "errors": 0, "busy_seconds": 0.0, "blocked_seconds": 0.0, "max_queued": 0}
+        })
+        return self
+
+    def run(self, source) -> List[Any]:
+        """
+        Feed every item of source (an iterable, consumed lazily) through the stages.
+        
+        Returns:
+            Everything the last stage emitted
+        """
+        outputs = []
+        start = time.time()
+        threads = []
+        for index, stage in enumerate(self.stages):
+            for worker in range(stage["workers"]):
+                thread = threading.Thread(
+                    target=contextvars.copy_context().run,
+                    args=(self._work, index, outputs, start),
+                    name=f"{self.name}-{stage['name']}-{worker}",
+                    daemon=True
+                )
+                thread.start()
+                threads.append(thread)
+        
+        try:
+            for item in source:
+                self._put(0, item)
+        finally:
+            # Workers of each stage hand the end-of-input marker downstream once all of them finish
+            for _ in range(self.stages[0]["workers"]):
+                self.stages[0]["queue"].put(_PIPELINE_DONE)
+            for thread in threads:
+                thread.join()
+        return outputs
+
+    @property
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """Per-stage counters; blocked_seconds is time spent waiting on a full downstream queue."""
+        with self._lock:
+            return {stage["name"]: dict(stage["stats"], workers=stage["workers"]) for stage in self.stages}
+
+    def _put(self, index: int, item) -> float:
+        stage = self.stages[index]
+        put_start = time.time()
+        stage["queue"].put(item)
+        blocked = time.time() - put_start
+        queued = stage["queue"].qsize()
+        with self._lock:
+            if queued > stage["stats"]["max_queued"]:
+                stage["stats"]["max_queued"] = queued
+        return blocked
+
+    def _work(self, index: int, outputs: List[Any], start: float) -> None:
+        stage = self.stages[index]
+        last = index == len(self.stages) - 1
+        blocked = [0.0]
+        
+        def emit(output) -> None:
+            if last:
+                with self._lock:
+                    outputs.append(output)
+                    if self.first_output_seconds is None:
+                        self.first_output_seconds = time.time() - start
+            else:
+                blocked[0] += self._put(index + 1, output)
+            with self._lock:
+                stage["stats"]["emitted"] += 1
+        
+        while True:
+            item = stage["queue"].get()
+            if item is _PIPELINE_DONE:
+                break
+            item_start = time.time()
+            blocked[0] = 0.0
+            try:
+                with trace_stage(f"pipeline_{stage['name']}"):
+                    stage["handler"](item, emit)
+            except Exception as e:
+                with self._lock:
+                    stage["stats"]["errors"] += 1
+                self.logger.error(f"Pipeline stage '{stage['name']}' failed on an item: {str(e)}")
+            with self._lock:
+                stage["stats"]["items"] += 1
+                stage["stats"]["busy_seconds"] += time.time() - item_start - blocked[0]
+                stage["stats"]["blocked_seconds"] += blocked[0]
+        
+        with self._lock:
+            stage["running"] -= 1
+            finished = stage["running"] == 0
+        if finished and not last:
+            for _ in range(self.stages[index + 1]["workers"]):
+                self.stages[index + 1]["queue"].put(_PIPELINE_DONE)
+
+
+def created_by_split_since(blob, since: datetime) -> bool:
+    """Whether a listed blob is a split page (see upload_split_page) uploaded at or after since (naive UTC)."""
+    metadata = getattr(blob, "metadata", None) or {}
+    if "source_filename" not in metadata or not metadata.get("created_at"):
+        return False
+    try:
+        created_at = datetime.fromisoformat(metadata["created_at"].rstrip("Z"))
+    except ValueError:
+        return False
+    return created_at >= since
+
+
+def iter_blob_paths(blob_location: str, environment: str = "staging", walkers: int = 1,
+                    skip_split_pages_since: Optional[datetime] = None):
+    """
+    Yield "container/blob" paths under blob_location as the listing pages arrive (see iter_listed_blobs).
+    
+    Args:
+        skip_split_pages_since: Leave out split pages uploaded at or after this time (naive UTC).
+            The split stage uploads pages next to their source while the listing is still
+            running, so later listing pages can return them; they are this batch's output.
+    """
+    skipped = 0
+    try:
+        for path, blob in iter_listed_blobs(blob_location, environment, walkers):
+            if skip_split_pages_since is not None and created_by_split_since(blob, skip_split_pages_since):
+                with _LISTED_BLOBS_LOCK:
+                    _LISTED_BLOBS.pop(tuple(path.split("/", 1)), None)
+                skipped += 1
+                continue
+            yield path
+    finally:
+        if skipped:
+            get_run_logger().info(f"Listing skipped {skipped} page(s) split by this batch")
+
+
+@task
+def run_payslip_pipeline(
+    user_id: str,
+    process_instance_id: str,
+    tenant_id: str,
+    environment: str,
+    message_id: str,
+    blob_location: Optional[str] = None,
+    document_urls: Optional[List[str]] = None,
+    split: bool = False,
+    fuzzy_matching: bool = False,
+    write_behind: bool = False,
+    adaptive_concurrency: bool = False,
+    max_concurrency: int = ADAPTIVE_MAX_CONCURRENCY,
+    result_cache: Optional[str] = None,
+    streaming_split: bool = False,
+    analyze_pages_from_memory: bool = False,
+    multipage_analysis: bool = False,
+    sas_scope: str = "blob",
+    stage_workers: Optional[Dict[str, int]] = None,
+    listing_walkers: int = 1
+) -> List[Dict[str, Any]]:
+    """
+    Process a batch as a streaming pipeline: list -> sign -> split -> analyze -> match/save.
+    
+    Each stage has its own worker pool (stage_workers overrides PIPELINE_DEFAULT_WORKERS) and
+    a bounded input queue, so the first documents are saved while later ones are still being
+    listed or split. Renaming is left to the caller: generated names depend on every file of an
+    employee's pay period, so it starts as soon as the last document is saved.
+    
+    Args:
+        blob_location: Container/path to list (used when document_urls is not given)
+        document_urls: URLs to process instead of listing blob_location
+        stage_workers: Worker count per stage ("sign", "split", "analyze", "save")
+        listing_walkers: Concurrent walkers listing blob_location
+        (remaining arguments as for payslip_matching_flow / process_document_urls)
+    
+    Returns:
+        List of {"id", "file", "match_status"} for the saved documents
+    """
+    logger = get_run_logger()
+    start_time = time.time()
+    workers = {**PIPELINE_DEFAULT_WORKERS, **(stage_workers or {})}
+    sas_service = get_sas_service(environment)
+    
+    if adaptive_concurrency:
+        limit_ceiling = max(workers["analyze"], max_concurrency)
+        open_concurrency_controller(environment, message_id, initial_limit=workers["analyze"], max_limit=limit_ceiling, logger=logger)
+        logger.info(f"Adaptive analysis concurrency: starting at {workers['analyze']}, up to {limit_ceiling}")
+        workers["analyze"] = limit_ceiling
+    open_document_batch(
+        environment, message_id, pool_size=workers["analyze"] + workers["save"],
+        write_behind=write_behind, result_cache=result_cache
+    )
+    
+    processed_urls = []
+    processed_lock = threading.Lock()
+    
+    def sign(item, emit):
+        if document_urls:
+            emit(sas_service.ensure_read_url(item, logger))
+        else:
+            emit(sas_service.sign_blob_paths([item], scope=sas_scope)[0])
+    
+    def split_document(pdf_url, emit):
+        try:
+            page_urls = split_with_checkpoint(pdf_url, environment, message_id, lambda: (
+                split_pdf_by_analysis(pdf_url, user_id, tenant_id, process_instance_id, environment, message_id)
+                if multipage_analysis else
+                split_pdf_to_pages(pdf_url, user_id, tenant_id, process_instance_id, environment, streaming=streaming_split, analyze_from_memory=analyze_pages_from_memory)
+            ))
+        except Exception as e:
+            logger.error(f"Failed to split PDF {sanitize_url_for_logging(pdf_url)}: {str(e)}")
+            # Fall back to processing original PDF if splitting fails
+            page_urls = [pdf_url]
+        if len(page_urls) > 1:
+            # The original is a source file, saved without extraction/matching
+            save_source_files([pdf_url], user_id, process_instance_id, tenant_id, environment, message_id)
+        for page_url in page_urls:
+            emit(page_url)
+    
+    def analyze(document_url, emit):
+        with processed_lock:
+            processed_urls.append(document_url)
+        document_start = time.time()
+        try:
+            extracted_data, extraction_time, blob_properties = analyze_single_document(document_url, environment, message_id)
+        except Exception as e:
+            emit((document_url, None, e, document_start))
+            return
+        emit((document_url, (extracted_data, extraction_time, blob_properties), None, document_start))
+    
+    def save(item, emit):
+        document_url, analysis, error, document_start = item
+        try:
+            if error is not None:
+                raise error
+            extracted_data, extraction_time, blob_properties = analysis
+            result = complete_document_processing(
+                document_url, extracted_data, extraction_time, document_start,
+                user_id, process_instance_id, tenant_id, environment, message_id,
+                fuzzy_matching=fuzzy_matching, write_behind=write_behind, blob_properties=blob_properties
+            )
+        except Exception as e:
+            result = build_document_failure_result(document_url, e, document_start, user_id, process_instance_id, tenant_id, environment)
+        emit((document_url, result))
+    
+    pipeline = StagedPipeline(f"payslips-{message_id}", logger)
+    pipeline.add_stage("sign", sign, workers["sign"])
+    if split:
+        pipeline.add_stage("split", split_document, workers["split"])
+    pipeline.add_stage("analyze", analyze, workers["analyze"])
+    pipeline.add_stage("save", save, workers["save"])
+    
+    logger.info("Streaming pipeline: " + " -> ".join(
+        f"{stage['name']} ({stage['workers']} worker(s))" for stage in pipeline.stages
+    ))
+    source = document_urls if document_urls else iter_blob_paths(
+        blob_location, environment, listing_walkers, skip_split_pages_since=datetime.utcnow() if split else None
+    )
+    document_results = pipeline.run(source)
+    
+    if pipeline.first_output_seconds is not None:
+        logger.info(f"Pipeline: first document saved after {pipeline.first_output_seconds:.2f}s")
+    for stage_name, stats in pipeline.stats.items():
+        logger.info(f"Pipeline stage '{stage_name}': {stats['items']} item(s), {stats['emitted']} emitted, "
+                    f"{stats['errors']} error(s), {stats['busy_seconds']:.1f}s busy, "
+                    f"{stats['blocked_seconds']:.1f}s blocked downstream, max {stats['max_queued']} queued")
+    
+    return finalize_document_batch(document_results, processed_urls, user_id, process_instance_id, environment, message_id, write_behind, start_time)
+
 if __name__ == "__main__":
     # For local testing
-    import sys
-    
     # Check if direct URLs are provided as arguments
     if len(sys.argv) > 1 and sys.argv[1] == "--urls":
         # Use direct URLs mode
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The pipeline lives in UNQORK/python.py as a flat script; make it importable as `python`
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,94 @@
+import random
+from types import SimpleNamespace
+
+import pytest
+
+import python as pipeline
+
+LAST_NAMES = ["Garcia", "Dubois", "Nkemelu", "Okonkwo", "Lefebvre", "Haddad", "Moreau", "Fournier"]
+
+
+def make_roster(names):
+    """Roster stand-in: FuzzyNameMatcher only reads .employees."""
+    employees = {}
+    for index, (name, last_name, preferred_name) in enumerate(names):
+        employees[index] = {
+            "id": index,
+            "name": name,
+            "last_name": last_name,
+            "other_name": None,
+            "preferred_name": preferred_name,
+            "employee_identifier": f"E{index:05d}",
+        }
+    return SimpleNamespace(employees=employees)
+
+
+def random_last_name(rng):
+    return "".join(rng.choice("bdfgklmnprstvz") + rng.choice("aeiou") for _ in range(rng.randint(3, 4))).title()
+
+
+@pytest.fixture
+def common_name_roster(monkeypatch):
+    # Small block limit, so a few hundred employees make "maria" a common key
+    monkeypatch.setattr(pipeline, "FUZZY_MAX_BLOCK_SIZE", 50)
+    rng = random.Random(7)
+    names = [("Maria", random_last_name(rng), None) for _ in range(400)]
+    names += [("Jean", random_last_name(rng), None) for _ in range(400)]
+    names += [("Maria", "Garcia", None), ("Jean", "Okonkwo", None), ("Maria", "Lefebvre", "Maria")]
+    return make_roster(names), len(names)
+
+
+def ids(results):
+    return [result["id"] for result in results]
+
+
+@pytest.mark.parametrize("query, expected", [
+    ("J0hn Sm1th", "John Smith"),         # OCR digit/letter confusions
+    ("Jhon Smith", "John Smith"),         # Transposed letters
+    ("Zoë O'Neil-Brown", "Zoe ONeil Brown"),
+    ("Smith, John", "John Smith"),        # Reversed name order
+    ("Aminata Diallo", "Aminata Diallo"),
+])
+def test_ocr_noisy_names_match(query, expected):
+    roster = make_roster([
+        ("John", "Smith", None),
+        ("Zoe", "ONeil Brown", None),
+        ("Aminata", "Diallo", None),
+        ("Joan", "Smithers", None),
+    ])
+    matcher = pipeline.FuzzyNameMatcher(roster)
+    results = pipeline.select_fuzzy_matches(matcher.find(query))
+    assert len(results) == 1
+    matched = results[0]
+    assert pipeline.fold_name(f"{matched['name']} {matched['last_name']}") == pipeline.fold_name(expected)
+
+
+def test_common_first_name_with_rare_last_name_matches(common_name_roster):
+    roster, total = common_name_roster
+    matcher = pipeline.FuzzyNameMatcher(roster)
+    assert ids(pipeline.select_fuzzy_matches(matcher.find("Maria Garcia"))) == [total - 3]
+    assert ids(pipeline.select_fuzzy_matches(matcher.find("Marla Garcla"))) == [total - 3]
+    assert ids(pipeline.select_fuzzy_matches(matcher.find("Jean 0konkwo"))) == [total - 2]
+
+
+def test_lookup_scores_a_small_candidate_set(common_name_roster):
+    roster, _ = common_name_roster
+    matcher = pipeline.FuzzyNameMatcher(roster)
+    assert len(matcher._candidate_indexes(pipeline.fold_name("Maria Garcia"))) < 50
+
+
+def test_name_made_only_of_common_keys_still_matches(common_name_roster):
+    roster, total = common_name_roster
+    matcher = pipeline.FuzzyNameMatcher(roster)
+    folded = pipeline.fold_name("Maria")
+    assert all(len(matcher._blocks[key]) > pipeline.FUZZY_MAX_BLOCK_SIZE for key in pipeline._blocking_keys(folded))
+
+    candidates = matcher._candidate_indexes(folded)
+    assert 0 < len(candidates) <= pipeline.FUZZY_MAX_CANDIDATES
+    assert ids(matcher.find("Maria"))[0] == total - 1
+
+
+def test_unknown_name_has_no_candidates(common_name_roster):
+    roster, _ = common_name_roster
+    matcher = pipeline.FuzzyNameMatcher(roster)
+    assert matcher.find("Quentin Xu") == []
@@ -0,0 +1,115 @@
+import logging
+
+import pytest
+
+import python as pipeline
+
+
+def make_row(file_reference, user_id="user-1", message_id="batch-1"):
+    return ("tenant-1", "process-1", user_id, file_reference, "{}", "matched", "[]", message_id)
+
+
+class FakeExecuteValues:
+    """Stands in for psycopg2.extras.execute_values, returning one ID per row."""
+
+    def __init__(self):
+        self.statements = []
+
+    def __call__(self, cursor, query, rows, template=None, page_size=None, fetch=False):
+        rows = list(rows)
+        self.statements.append(rows)
+        return [
+            (f"id-{len(self.statements)}-{position}", row[0], row[1], row[2], row[3], row[7])
+            for position, row in enumerate(rows)
+        ]
+
+
+@pytest.fixture
+def execute_values(monkeypatch):
+    fake = FakeExecuteValues()
+    monkeypatch.setattr(pipeline.psycopg2.extras, "execute_values", fake)
+    return fake
+
+
+def test_upsert_spreads_rows_sharing_a_conflict_key_over_statements(execute_values):
+    rows = [
+        make_row("a.pdf"),
+        make_row("b.pdf"),
+        make_row("a.pdf"),
+        make_row("a.pdf", user_id="USER-1"),  # Same key: the comparison is case-insensitive
+        make_row("a.pdf", message_id="batch-2"),
+    ]
+
+    record_ids = pipeline.upsert_matching_results(cursor=None, rows=rows)
+
+    assert [len(statement) for statement in execute_values.statements] == [3, 1, 1]
+    for statement in execute_values.statements:
+        keys = [pipeline._matching_result_key(row[0], row[1], row[2], row[3], row[7]) for row in statement]
+        assert len(keys) == len(set(keys))
+    assert record_ids == ["id-1-0", "id-1-1", "id-2-0", "id-3-0", "id-1-2"]
+
+
+def test_upsert_without_duplicates_uses_one_statement(execute_values):
+    rows = [make_row(f"{index}.pdf") for index in range(5)]
+    record_ids = pipeline.upsert_matching_results(cursor=None, rows=rows)
+    assert len(execute_values.statements) == 1
+    assert record_ids == [f"id-1-{index}" for index in range(5)]
+
+
+def row_info(file_reference, extracted_data=None):
+    return {
+        "tenant_id": "tenant-1",
+        "process_instance_id": "process-1",
+        "user_id": "user-1",
+        "file_reference": file_reference,
+        "extracted_data": extracted_data if extracted_data is not None else {"employee_name": "Ana"},
+        "match_status": "matched",
+        "audit_log": [],
+        "message_id": "batch-1",
+    }
+
+
+@pytest.fixture
+def writer():
+    writer = pipeline.MatchingResultWriter(batch_size=1000, flush_interval=3600, logger=logging.getLogger("test"))
+    yield writer
+    writer.close()
+
+
+def test_unserializable_row_fails_only_its_own_future(writer, monkeypatch):
+    committed = []
+
+    def commit_rows(rows):
+        committed.append([row[3] for row in rows])
+        return [f"id-{row[3]}" for row in rows]
+
+    monkeypatch.setattr(writer, "_commit_rows", commit_rows)
+    good = writer.submit(row_info("good.pdf"))
+    bad = writer.submit(row_info("bad.pdf", extracted_data={"amount": object()}))
+    other = writer.submit(row_info("other.pdf"))
+
+    assert writer.flush() == 3
+    assert committed == [["good.pdf", "other.pdf"]]
+    assert good.result(timeout=1) == "id-good.pdf"
+    assert other.result(timeout=1) == "id-other.pdf"
+    with pytest.raises(TypeError):
+        bad.result(timeout=1)
+    assert writer.stats["rows"] == 2
+    assert writer.stats["failed_rows"] == 1
+
+
+def test_failed_batch_is_retried_row_by_row(writer, monkeypatch):
+    def commit_rows(rows):
+        if len(rows) > 1 or rows[0][3] == "bad.pdf":
+            raise RuntimeError("constraint violation")
+        return [f"id-{rows[0][3]}"]
+
+    monkeypatch.setattr(writer, "_commit_rows", commit_rows)
+    good = writer.submit(row_info("good.pdf"))
+    bad = writer.submit(row_info("bad.pdf"))
+
+    writer.flush()
+    assert good.result(timeout=1) == "id-good.pdf"
+    with pytest.raises(RuntimeError):
+        bad.result(timeout=1)
+    assert writer.record_ids == {"good.pdf": "id-good.pdf"}
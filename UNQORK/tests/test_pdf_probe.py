@@ -0,0 +1,72 @@
+import io
+
+import pytest
+
+pypdf = pytest.importorskip("pypdf")
+
+import python as pipeline
+
+
+class FakeDownload:
+    def __init__(self, data: bytes):
+        self.data = data
+
+    def readall(self) -> bytes:
+        return self.data
+
+
+class FakeBlobClient:
+    """Serves ranged downloads from an in-memory blob."""
+
+    def __init__(self, data: bytes):
+        self.data = data
+        self.ranges = []
+
+    def download_blob(self, offset=0, length=None, **kwargs):
+        self.ranges.append((offset, length))
+        end = len(self.data) if length is None else offset + length
+        return FakeDownload(self.data[offset:end])
+
+
+def make_pdf(pages: int = 1, padding: int = 0) -> bytes:
+    writer = pypdf.PdfWriter()
+    for _ in range(pages):
+        writer.add_blank_page(width=200, height=200)
+    if padding:
+        writer.add_metadata({"/Padding": "x" * padding})
+    output = io.BytesIO()
+    writer.write(output)
+    return output.getvalue()
+
+
+@pytest.mark.parametrize("block_size", [7, 64, 1000])
+@pytest.mark.parametrize("start", [0, 5, 63, 64, 65, 999])
+def test_readinto_fills_buffer_across_block_boundaries(block_size, start):
+    data = bytes(range(256)) * 20
+    reader = pipeline.RangedBlobReader(FakeBlobClient(data), len(data), block_size=block_size, max_reads=10_000)
+    reader.seek(start)
+    buffer = bytearray(300)
+    count = reader.readinto(buffer)
+    assert count == 300
+    assert bytes(buffer) == data[start:start + 300]
+    assert reader.tell() == start + 300
+
+
+def test_readinto_stops_at_end_of_blob():
+    data = b"0123456789"
+    reader = pipeline.RangedBlobReader(FakeBlobClient(data), len(data), block_size=4)
+    reader.seek(6)
+    buffer = bytearray(8)
+    assert reader.readinto(buffer) == 4
+    assert bytes(buffer[:4]) == b"6789"
+    assert reader.readinto(buffer) == 0
+
+
+@pytest.mark.parametrize("padding", range(0, 70_000, 3_500))
+def test_pdf_page_count_read_through_ranged_blocks(padding):
+    for pages in (1, 3):
+        data = make_pdf(pages, padding)
+        reader = pipeline.RangedBlobReader(FakeBlobClient(data), len(data), block_size=pipeline.PDF_PROBE_BLOCK_SIZE)
+        pdf_reader = pypdf.PdfReader(reader)
+        assert len(pdf_reader.pages) == pages
+        assert reader.reads <= pipeline.PDF_PROBE_MAX_READS